@@ -0,0 +1,213 @@
+"""
+Compare the column-wise frame builds in create_dataframes.py with the row by
+row build it replaced, which is kept here as the reference.
+
+Writes a synthetic dataset (see synthetic_data.py) with short news bodies,
+so the build rather than the text dominates, and:
+- times both builds of the news and game frames over the same batches in
+  this process, with the peak traced allocation of each
+- runs create_dataframes.py end to end with each build, reporting wall time
+  and peak RSS, and checks that the csv files come out identical
+
+    python benchmark_dataframes.py [--apps 200000] [--news-per-app 5]
+"""
+
+import argparse
+import copy
+import filecmp
+import gc
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Set, Tuple
+
+import pandas as pd
+
+from benchmark_memory import REPORT_RSS
+from constants import SRC_DIR
+from create_dataframes import (
+    build_game_frames, build_news_frames, CHUNK_ROWS, Frames, GAME_LINKS, new_games,
+)
+from json_stream import batched, iter_apps, iter_gamedetails, iter_newsitems
+from synthetic_data import write_dataset
+
+def build_news_rows(items: List[Dict[str, Any]], final_ids: Set[int]) -> Frames:
+    """
+    The original row by row build of a chunk of news items.
+    """
+    newsitems_data = []
+    newsitem_tags = []
+    for row in items:
+        appid = row["appid"]
+        if appid in final_ids:
+            tags = row.pop("tags", [])
+            newsitems_data.append(row)
+            newsitem_tags.extend([{"gid": row["gid"], "tag": tag} for tag in tags])
+    return {
+        "newsitems": pd.DataFrame(newsitems_data),
+        "newsitem_tags": pd.DataFrame(newsitem_tags, columns=["gid", "tag"]),
+    }
+
+def build_game_rows(games: List[Dict[str, Any]], names: Dict[int, str]) -> Frames:
+    """
+    The original row by row build of a chunk of (deduplicated) games.
+    """
+    frames = {table: [] for table in ["details", *GAME_LINKS]}
+    for game in games:
+        appid = game["appid"]
+        for x in game.pop("developers", []):
+            frames["developers"].append({"appid": appid, "developer": x})
+        for x in game.pop("publishers", []):
+            frames["publishers"].append({"appid": appid, "publisher": x})
+        for x in game.pop("tags", []):
+            if x != "+":
+                frames["tags"].append({"appid": appid, "tag": x})
+        for x in game.pop("features", []):
+            frames["features"].append({"appid": appid, "feature": x})
+        frames["details"].append({"appid": appid, "name": names[appid], **game})
+    return {
+        table: pd.DataFrame(rows, columns=None if table == "details" else ["appid", GAME_LINKS[table]])
+        for table, rows in frames.items()
+    }
+
+BUILDERS: Dict[str, Tuple[Callable[..., Frames], Callable[..., Frames]]] = {
+    "rows": (build_news_rows, build_game_rows),
+    "columns": (build_news_frames, build_game_frames),
+}
+
+def traced_peak(build: Callable, batch: list, arg) -> float:
+    """
+    The peak MB traced while building one batch.
+    """
+    tracemalloc.start()
+    build(copy.deepcopy(batch), arg)
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return peak
+
+def time_builds(builds: Dict[str, Callable], batches: List[list], arg, repeat: int = 5) -> Dict[str, float]:
+    """
+    The best of `repeat` runs of the seconds each build takes over every
+    batch. The builds take turns, so a noisy machine slows them alike, and
+    get copies, since the row builds pop from records.
+    """
+    best = dict.fromkeys(builds, float("inf"))
+    for _ in range(repeat):
+        for name, build in builds.items():
+            copies = copy.deepcopy(batches)
+            # keep the collector from walking every held record over and over
+            gc.collect()
+            gc.freeze()
+            start = time.perf_counter()
+            for batch in copies:
+                build(batch, arg)
+            best[name] = min(best[name], time.perf_counter() - start)
+            gc.unfreeze()
+            del copies
+    return best
+
+def run_end_to_end(data_dir: str, build: str, out_dir: str) -> Tuple[float, float]:
+    """
+    Wall seconds and peak RSS in MB of create_dataframes.py as a fresh process.
+    """
+    os.makedirs(out_dir)
+    env = dict(os.environ, STEAM_DATA_DIR=data_dir)
+    # the reference build is swapped in for create_dataframes' own
+    script = (
+        "import benchmark_dataframes, create_dataframes\n"
+        f"build_news, build_games = benchmark_dataframes.BUILDERS[{build!r}]\n"
+        "create_dataframes.build_news_frames = build_news\n"
+        "create_dataframes.build_game_frames = build_games\n"
+        f"create_dataframes.main(['--out-dir', {out_dir!r}])\n"
+    )
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", script + REPORT_RSS],
+        cwd=SRC_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    elapsed = time.perf_counter() - start
+    return elapsed, int(result.stdout.strip().splitlines()[-1]) / 1024
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--apps", type=int, default=200000)
+    parser.add_argument("--news-per-app", type=int, default=5)
+    parser.add_argument(
+        "--in-process-rows",
+        type=int,
+        default=200000,
+        help="news items to time the build functions on directly",
+    )
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        size = write_dataset(tmp_dir, args.apps, args.news_per_app, contents_words=(5, 20))
+        print(
+            f"{args.apps} apps, {args.apps * args.news_per_app} news items, "
+            f"{size / 2**20:.1f} MB of input"
+        )
+
+        # end to end first; a child's peak RSS starts from this process's,
+        # which is about to hold every batch
+        results: Dict[str, Dict[str, Tuple[float, float]]] = {
+            build: {"end to end": run_end_to_end(tmp_dir, build, os.path.join(tmp_dir, build))}
+            for build in BUILDERS
+        }
+
+        apps = os.path.join(tmp_dir, "applist.json")
+        details = os.path.join(tmp_dir, "gamedetails.json")
+        news = os.path.join(tmp_dir, "newsitems.json")
+        names = {app["appid"]: app["name"] for app in iter_apps(apps)}
+        final_ids = set(names)
+        news_batches = []
+        for batch in batched(iter_newsitems(news), CHUNK_ROWS):
+            news_batches.append(batch)
+            if len(news_batches) * CHUNK_ROWS >= args.in_process_rows:
+                break
+        game_batches = []
+        for batch in batched(new_games(iter_gamedetails(details), final_ids), CHUNK_ROWS):
+            game_batches.append(batch)
+            if len(game_batches) * CHUNK_ROWS >= args.in_process_rows:
+                break
+
+        for step, batches, arg, which in [
+            ("news build", news_batches, final_ids, 0),
+            ("games build", game_batches, names, 1),
+        ]:
+            builds = {build: builders[which] for build, builders in BUILDERS.items()}
+            seconds = time_builds(builds, batches, arg)
+            for build, fn in builds.items():
+                results[build][step] = (seconds[build], traced_peak(fn, batches[0], arg))
+        del news_batches, game_batches
+
+        tables = sorted(os.listdir(os.path.join(tmp_dir, "rows")))
+        _, mismatch, errors = filecmp.cmpfiles(
+            os.path.join(tmp_dir, "rows"),
+            os.path.join(tmp_dir, "columns"),
+            tables,
+            shallow=False,
+        )
+
+    rows, columns = results["rows"], results["columns"]
+    print(f"{'':<12} {'rows':>18} {'columns':>18} {'speedup':>8}")
+    for step in rows:
+        (before, before_mb), (after, after_mb) = rows[step], columns[step]
+        print(
+            f"{step:<12} {before:>6.2f} s {before_mb:>6.0f} MB "
+            f"{after:>6.2f} s {after_mb:>6.0f} MB {before / after:>7.1f}x"
+        )
+    print("(peak MB: traced for one batch in process, RSS end to end)")
+    if mismatch or errors:
+        print(f"output differs: {mismatch + errors}")
+    else:
+        print(f"identical output for {', '.join(tables)}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
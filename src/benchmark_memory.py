@@ -0,0 +1,83 @@
+"""
+Peak memory of reading the collected data files, as the catalog grows.
+
+Writes synthetic applist.json, gamedetails.json and newsitems.json (see
+synthetic_data.py) of increasing size to a scratch directory and, for each
+size, measures the peak RSS of a fresh process that:
+- json_load: `json.loads` all three files, which is what the loaders used to do
+- json_stream: walks every record with the streaming readers
+- create_dataframes: runs create_dataframes.py against the scratch data
+
+The streaming rows should stay flat while json_load grows with the files.
+
+    python benchmark_memory.py [--apps 2000 8000 32000] [--news-per-app 5]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from typing import List
+
+from constants import SRC_DIR
+from synthetic_data import write_dataset
+
+TARGETS = {
+    "json_load": """
+import json, os
+from constants import DATA_DIR
+data = []
+for name in ("applist.json", "gamedetails.json", "newsitems.json"):
+    with open(os.path.join(DATA_DIR, name), "r") as f:
+        data.append(json.loads(f.read()))
+""",
+    "json_stream": """
+from json_stream import iter_apps, iter_gamedetails, iter_newsitems
+for it in (iter_apps(), iter_gamedetails(), iter_newsitems()):
+    for record in it:
+        pass
+""",
+    "create_dataframes": """
+import runpy
+runpy.run_path("create_dataframes.py", run_name="__main__")
+""",
+}
+
+# appended to every target; ru_maxrss is in KiB on linux
+REPORT_RSS = """
+import resource
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+def peak_rss_mb(target: str, data_dir: str) -> float:
+    env = dict(os.environ, STEAM_DATA_DIR=data_dir)
+    result = subprocess.run(
+        [sys.executable, "-c", TARGETS[target] + REPORT_RSS],
+        cwd=SRC_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return int(result.stdout.strip().splitlines()[-1]) / 1024
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--apps", type=int, nargs="+", default=[2000, 8000, 32000])
+    parser.add_argument("--news-per-app", type=int, default=5)
+    parser.add_argument("--targets", nargs="+", choices=sorted(TARGETS), default=list(TARGETS))
+    args = parser.parse_args(argv)
+
+    print(f"{'apps':>8} {'input MB':>9} " + " ".join(f"{t:>18}" for t in args.targets))
+    for apps in args.apps:
+        with tempfile.TemporaryDirectory() as data_dir:
+            size = write_dataset(data_dir, apps, args.news_per_app)
+            peaks = [peak_rss_mb(target, data_dir) for target in args.targets]
+        print(
+            f"{apps:>8} {size / 2**20:>9.1f} "
+            + " ".join(f"{peak:>15.1f} MB" for peak in peaks)
+        )
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
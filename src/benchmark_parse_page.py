@@ -0,0 +1,106 @@
+"""
+Compare the BeautifulSoup and lxml store page parsers.
+
+Runs both over a directory of saved store pages named {appid}.html, checks
+that they extract the same data for every page, and reports pages/sec for
+each. Without that directory (data/store_pages by default; the scraper
+doesn't keep one), synthetic pages from synthetic_data.py are used instead.
+
+    python benchmark_parse_page.py [fixtures_dir] [--repeat N] [--synthetic N]
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bs4 import BeautifulSoup
+
+from constants import DATA_DIR
+from store_page import parse_html, parse_page
+from synthetic_data import app_record, app_rng, game_record, store_page
+
+FIXTURES_DIR = os.path.join(DATA_DIR, "store_pages")
+
+def load_fixtures(fixtures_dir: str) -> List[Tuple[int, str]]:
+    pages = []
+    for name in sorted(os.listdir(fixtures_dir)):
+        if not name.endswith(".html"):
+            continue
+        with open(os.path.join(fixtures_dir, name), "r", encoding="utf-8") as f:
+            pages.append((int(name.rsplit(".", 1)[0]), f.read()))
+    return pages
+
+def synthetic_pages(count: int) -> List[Tuple[int, str]]:
+    return [
+        (appid, store_page(game_record(app_rng(0, appid), appid, count), app_record(appid)["name"]))
+        for appid in range(count)
+    ]
+
+def parse_with_soup(html: str, appid: int) -> Optional[Dict[str, Any]]:
+    # what the scraper used to do for every page
+    soup = BeautifulSoup(html, "lxml")
+    if soup.find_all(class_="home_page_col_wrapper"):
+        return None
+    return parse_page(soup, appid)
+
+def normalize(page_data: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    # the list fields are built from sets, so their order isn't meaningful
+    if page_data is None:
+        return None
+    return {
+        key: sorted(value) if isinstance(value, list) else value
+        for key, value in page_data.items()
+    }
+
+def pages_per_sec(
+    parser: Callable[[str, int], Optional[Dict[str, Any]]],
+    pages: List[Tuple[int, str]],
+    repeat: int,
+) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for appid, html in pages:
+            parser(html, appid)
+    return repeat * len(pages) / (time.perf_counter() - start)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("fixtures_dir", nargs="?", default=FIXTURES_DIR)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        default=200,
+        help="pages to generate when fixtures_dir doesn't exist",
+    )
+    args = parser.parse_args()
+
+    if os.path.isdir(args.fixtures_dir):
+        pages = load_fixtures(args.fixtures_dir)
+        if not pages:
+            print(f"no .html fixtures found in {args.fixtures_dir}")
+            return 1
+        print(f"{len(pages)} pages from {args.fixtures_dir}")
+    else:
+        pages = synthetic_pages(args.synthetic)
+        print(f"{args.fixtures_dir} doesn't exist; using {len(pages)} synthetic pages")
+
+    mismatches = 0
+    for appid, html in pages:
+        expected = normalize(parse_with_soup(html, appid))
+        actual = normalize(parse_html(html, appid))
+        if expected != actual:
+            mismatches += 1
+            print(f"mismatch on {appid=}:\n  soup: {expected}\n  lxml: {actual}")
+    print(f"{len(pages) - mismatches}/{len(pages)} pages match")
+
+    soup_rate = pages_per_sec(parse_with_soup, pages, args.repeat)
+    lxml_rate = pages_per_sec(parse_html, pages, args.repeat)
+    print(f"BeautifulSoup: {soup_rate:,.1f} pages/sec")
+    print(f"lxml:          {lxml_rate:,.1f} pages/sec ({lxml_rate / soup_rate:.1f}x)")
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+Time common queries against the steam_project schema with and without the
+secondary indexes from database.INDEX_PLAN.
+
+Loads a synthetic dataset (see synthetic_data.py) into a scratch SQLite
+database with create_tables.py, then runs every query with the plan's indexes
+dropped and again after create_indexes(), and reports the median time of
+each.
+
+    python benchmark_queries.py [--apps 20000] [--news-per-app 5] [--repeat 5]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from sqlalchemy import create_engine, Engine, text
+
+from constants import SRC_DIR
+from database import create_indexes, drop_indexes
+from synthetic_data import write_dataset
+
+QUERIES = {
+    "games with tag": (
+        "SELECT g.appid, g.name FROM games g "
+        "JOIN game_tags gt ON gt.appid = g.appid "
+        "JOIN game_tag_enumerations e ON e.game_tag_enumeration_id = gt.game_tag_enumeration_id "
+        "WHERE e.tag = 'RPG'"
+    ),
+    "tags of a game": (
+        "SELECT e.tag FROM game_tags gt "
+        "JOIN game_tag_enumerations e ON e.game_tag_enumeration_id = gt.game_tag_enumeration_id "
+        "WHERE gt.appid = :appid"
+    ),
+    "news for app in date range": (
+        "SELECT gid, title FROM newsitems "
+        "WHERE appid = :appid AND date BETWEEN '2020-01-01' AND '2030-01-01' "
+        "ORDER BY date DESC"
+    ),
+    "company by name": "SELECT company_id FROM companies WHERE company = 'Developer 7'",
+    "games by developer": (
+        "SELECT d.appid FROM developers d "
+        "JOIN companies c ON c.company_id = d.company_id "
+        "WHERE c.company = 'Developer 7'"
+    ),
+}
+# the same searches as full text queries, once the fts tables exist
+TEXT_QUERIES = {
+    "search news": (
+        "SELECT gid FROM newsitems WHERE title LIKE '%12345%' OR contents LIKE '%12345%'",
+        "SELECT rowid FROM ft_newsitems_title_contents "
+        "WHERE ft_newsitems_title_contents MATCH '12345'",
+    ),
+}
+
+def load(data_dir: str, sqlite_fh: str) -> None:
+    env = dict(
+        os.environ,
+        STEAM_DATA_DIR=data_dir,
+        STEAM_DB_BACKEND="sqlite",
+        STEAM_SQLITE_FH=sqlite_fh,
+    )
+    subprocess.run(
+        [sys.executable, "create_tables.py", "--fulltext"],
+        cwd=SRC_DIR,
+        env=env,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+def time_query(engine: Engine, query: str, repeat: int) -> float:
+    """
+    Median seconds to run `query` and fetch every row.
+    """
+    times = []
+    with engine.connect() as conn:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(text(query), {"appid": 1234}).fetchall()
+            times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--apps", type=int, default=20000)
+    parser.add_argument("--news-per-app", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f"loading {args.apps} apps")
+        write_dataset(tmp_dir, args.apps, args.news_per_app)
+        sqlite_fh = os.path.join(tmp_dir, "steam_project.sqlite")
+        load(tmp_dir, sqlite_fh)
+        engine = create_engine(f"sqlite:///{sqlite_fh}")
+
+        results: Dict[str, List[float]] = {}
+        drop_indexes(engine)
+        for name, query in QUERIES.items():
+            results[name] = [time_query(engine, query, args.repeat)]
+        for name, (scan, _) in TEXT_QUERIES.items():
+            results[name] = [time_query(engine, scan, args.repeat)]
+        create_indexes(engine, fulltext=True)
+        for name, query in QUERIES.items():
+            results[name].append(time_query(engine, query, args.repeat))
+        for name, (_, search) in TEXT_QUERIES.items():
+            results[name].append(time_query(engine, search, args.repeat))
+        engine.dispose()
+
+    print(f"{'query':<28} {'no indexes':>12} {'indexes':>12} {'speedup':>8}")
+    for name, (before, after) in results.items():
+        print(
+            f"{name:<28} {before * 1000:>9.2f} ms {after * 1000:>9.2f} ms "
+            f"{before / after:>7.0f}x"
+        )
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
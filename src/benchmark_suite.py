@@ -0,0 +1,330 @@
+"""
+Time the hot paths of the pipeline on synthetic data, and save the results.
+
+Generates a dataset with synthetic_data.py (or reuses one generated earlier
+with the same arguments in --data-dir), then runs every benchmark in a fresh
+process and records its time, throughput and peak RSS:
+- parse_page: parse_html over the synthetic store pages, checked against the
+  gamedetails records they were made from
+- json_stream: walk every record of the three data files
+- dataframes: create_dataframes.py, csv output
+- dataframes_columnar: create_dataframes.py --format parquet (pickle without
+  pyarrow)
+- load: create_tables.py into a scratch SQLite database
+- load_incremental: create_tables.py --incremental over an unchanged database
+- load_content_store: create_tables.py with STEAM_CONTENT_STORE=1
+The load benchmarks also record the size of the database they wrote.
+
+The results are written as JSON, and --compare checks them against an
+earlier run: anything slower by more than --threshold is reported as a
+regression, and the exit status is 1.
+
+    python benchmark_suite.py [--apps 10000] [--store-pages 1000] [--only load ...]
+        [--data-dir DIR] [--out results.json] [--compare baseline.json]
+"""
+
+import argparse
+from datetime import datetime
+import json
+import os
+import platform
+import resource
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from constants import DATA_DIR, SRC_DIR
+from dataframe_store import missing_dependency
+import synthetic_data
+
+RESULTS_DIR = os.path.join(DATA_DIR, "benchmarks")
+
+def run_script(script: str, *args: str) -> None:
+    # the stage scripts read sys.argv themselves
+    sys.argv = [script, *args]
+    runpy.run_path(os.path.join(SRC_DIR, script), run_name="__main__")
+
+# each benchmark runs in its own process, with STEAM_DATA_DIR pointing at
+# the synthetic data, and returns the number of items it handled and the
+# seconds it took, leaving out its own setup
+
+def bench_parse_page(data_dir: str) -> Dict[str, float]:
+    from json_stream import iter_gamedetails
+    from store_page import parse_html
+
+    pages_dir = os.path.join(data_dir, "store_pages")
+    pages = []
+    for name in sorted(os.listdir(pages_dir)):
+        with open(os.path.join(pages_dir, name), "r", encoding="utf-8") as f:
+            pages.append((int(name.rsplit(".", 1)[0]), f.read()))
+    start = time.perf_counter()
+    parsed = [parse_html(page, appid) for appid, page in pages]
+    seconds = time.perf_counter() - start
+
+    # the list fields are built from sets, so their order isn't meaningful
+    def normalize(page_data):
+        return {
+            key: sorted(value) if isinstance(value, list) else value
+            for key, value in page_data.items()
+        }
+    expected = {}
+    for game in iter_gamedetails():
+        if game["appid"] >= len(pages):
+            break
+        expected[game["appid"]] = normalize(game)
+    wrong = [
+        page_data["appid"] for page_data in parsed
+        if normalize(page_data) != expected[page_data["appid"]]
+    ]
+    if wrong:
+        raise AssertionError(f"parse_html got the wrong data for appids {wrong[:10]}")
+    return {"items": len(pages), "seconds": seconds}
+
+def bench_json_stream(data_dir: str) -> Dict[str, float]:
+    from json_stream import iter_apps, iter_gamedetails, iter_newsitems
+
+    items = 0
+    start = time.perf_counter()
+    for records in (iter_apps(), iter_gamedetails(), iter_newsitems()):
+        for _ in records:
+            items += 1
+    return {"items": items, "seconds": time.perf_counter() - start}
+
+def _bench_dataframes(data_dir: str, *args: str) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as out_dir:
+        start = time.perf_counter()
+        run_script("create_dataframes.py", "--out-dir", out_dir, *args)
+        seconds = time.perf_counter() - start
+    return {"items": manifest_items(data_dir), "seconds": seconds}
+
+def bench_dataframes(data_dir: str) -> Dict[str, float]:
+    return _bench_dataframes(data_dir)
+
+def bench_dataframes_columnar(data_dir: str) -> Dict[str, float]:
+    # create_dataframes.py won't fall back to pickle by itself
+    fmt = "parquet" if missing_dependency("parquet") is None else "pickle"
+    return _bench_dataframes(data_dir, "--format", fmt)
+
+def bench_load(data_dir: str) -> Dict[str, float]:
+    start = time.perf_counter()
+    run_script("create_tables.py")
+    return {"items": manifest_items(data_dir), "seconds": time.perf_counter() - start}
+
+def bench_load_incremental(data_dir: str) -> Dict[str, float]:
+    # the full load isn't timed; create_tables.py runs at import, so it is
+    # run in a process of its own
+    subprocess.run(
+        [sys.executable, "create_tables.py"],
+        cwd=SRC_DIR,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    start = time.perf_counter()
+    run_script("create_tables.py", "--incremental")
+    return {"items": manifest_items(data_dir), "seconds": time.perf_counter() - start}
+
+BENCHMARKS: Dict[str, Callable[[str], Dict[str, float]]] = {
+    "parse_page": bench_parse_page,
+    "json_stream": bench_json_stream,
+    "dataframes": bench_dataframes,
+    "dataframes_columnar": bench_dataframes_columnar,
+    "load": bench_load,
+    "load_incremental": bench_load_incremental,
+    "load_content_store": bench_load,
+}
+# environment the benchmark's process runs with, on top of the defaults
+BENCHMARK_ENV: Dict[str, Dict[str, str]] = {
+    "load_content_store": {"STEAM_CONTENT_STORE": "1"},
+}
+
+MANIFEST = "synthetic.json"
+
+def manifest_items(data_dir: str) -> int:
+    """
+    Apps plus news items in the dataset, the unit for the whole-file stages.
+    """
+    with open(os.path.join(data_dir, MANIFEST), "r") as f:
+        params = json.loads(f.read())
+    return params["apps"] * (1 + params["news_per_app"])
+
+def prepare_data(data_dir: str, params: Dict[str, Any]) -> None:
+    """
+    Generate the dataset into `data_dir`, unless it already holds one made
+    with the same `params`.
+    """
+    manifest_fh = os.path.join(data_dir, MANIFEST)
+    if os.path.exists(manifest_fh):
+        with open(manifest_fh, "r") as f:
+            if json.loads(f.read()) == params:
+                print(f"reusing the synthetic data in {data_dir}")
+                return
+        os.remove(manifest_fh)
+    os.makedirs(data_dir, exist_ok=True)
+    print(f"generating {params['apps']} apps in {data_dir}")
+    start = time.perf_counter()
+    size = synthetic_data.write_dataset(
+        data_dir,
+        params["apps"],
+        params["news_per_app"],
+        params["seed"],
+        tuple(params["contents_words"]),
+    )
+    pages_dir = os.path.join(data_dir, "store_pages")
+    if os.path.exists(pages_dir):
+        for name in os.listdir(pages_dir):
+            os.remove(os.path.join(pages_dir, name))
+    synthetic_data.write_store_pages(pages_dir, params["apps"], params["store_pages"], params["seed"])
+    print(f"wrote {size / 2**20:.1f} MB in {time.perf_counter() - start:.1f}s")
+    # written last, so an interrupted generation is never reused
+    with open(manifest_fh, "w") as f:
+        f.write(json.dumps(params))
+
+def run_benchmark(name: str, data_dir: str) -> Dict[str, float]:
+    """
+    Run one benchmark in a fresh process, so its peak RSS is its own.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sqlite_fh = os.path.join(tmp_dir, "steam_project.sqlite")
+        env = {
+            **os.environ,
+            "STEAM_DATA_DIR": data_dir,
+            "STEAM_DB_BACKEND": "sqlite",
+            "STEAM_SQLITE_FH": sqlite_fh,
+            "STEAM_CONTENT_STORE": "0",
+            **BENCHMARK_ENV.get(name, {}),
+        }
+        result = subprocess.run(
+            [sys.executable, "benchmark_suite.py", "--child", name, "--data-dir", data_dir],
+            cwd=SRC_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        db_mb = os.path.getsize(sqlite_fh) / 2**20 if os.path.exists(sqlite_fh) else None
+    if result.returncode:
+        raise RuntimeError(f"benchmark {name} failed:\n{result.stderr}")
+    # the benchmarked scripts print their own progress; the result is the
+    # last line
+    result = json.loads(result.stdout.strip().splitlines()[-1])
+    if db_mb is not None:
+        result["db_mb"] = db_mb
+    result["items_per_sec"] = result["items"] / result["seconds"]
+    return result
+
+def child(name: str, data_dir: str) -> None:
+    result = BENCHMARKS[name](data_dir)
+    # ru_maxrss is in KiB on linux
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    sys.stdout.flush()
+    print("\n" + json.dumps(result))
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=SRC_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> List[str]:
+    """
+    Print each benchmark next to the baseline; returns the ones that got
+    slower by more than `threshold`.
+    """
+    regressions = []
+    print(f"\n{'vs baseline':<20} {'time':>9} {'peak RSS':>9}")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<20} {'new':>9}")
+            continue
+        time_ratio = result["seconds"] / before["seconds"]
+        rss_ratio = result["peak_rss_mb"] / before["peak_rss_mb"]
+        flag = ""
+        if time_ratio > 1 + threshold:
+            flag = "  <- slower"
+            regressions.append(name)
+        print(f"{name:<20} {time_ratio:>8.2f}x {rss_ratio:>8.2f}x{flag}")
+    return regressions
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--apps", type=int, default=10000)
+    parser.add_argument("--news-per-app", type=int, default=5)
+    parser.add_argument("--contents-words", type=int, nargs=2, default=[20, 200])
+    parser.add_argument("--store-pages", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument(
+        "--data-dir",
+        help="where to keep the synthetic data between runs; a scratch directory by default",
+    )
+    parser.add_argument("--out", help=f"results file; by default a new file in {RESULTS_DIR}")
+    parser.add_argument("--compare", help="results file of an earlier run to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="how much slower than the baseline counts as a regression",
+    )
+    parser.add_argument("--child", choices=list(BENCHMARKS), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args.child, args.data_dir)
+        return 0
+
+    params = {
+        "apps": args.apps,
+        "news_per_app": args.news_per_app,
+        "contents_words": args.contents_words,
+        "store_pages": args.store_pages,
+        "seed": args.seed,
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = os.path.abspath(args.data_dir or tmp_dir)
+        prepare_data(data_dir, params)
+        results = {}
+        print(f"{'benchmark':<20} {'seconds':>9} {'items/sec':>12} {'peak RSS':>11}")
+        for name in args.only:
+            result = results[name] = run_benchmark(name, data_dir)
+            print(
+                f"{name:<20} {result['seconds']:>9.2f} {result['items_per_sec']:>12,.0f} "
+                f"{result['peak_rss_mb']:>8.0f} MB"
+            )
+
+    run = {
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "results": results,
+    }
+    out_fh = args.out
+    if out_fh is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        out_fh = os.path.join(RESULTS_DIR, f"{stamp}-{args.apps}.json")
+    with open(out_fh, "w") as f:
+        f.write(json.dumps(run, indent=2))
+    print(f"results written to {out_fh}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.loads(f.read())
+        if baseline["params"] != params:
+            print("note: the baseline was run with different parameters")
+        if compare(results, baseline["results"], args.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
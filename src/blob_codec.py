@@ -0,0 +1,28 @@
+"""
+Compression for the bodies kept in the html cache and the database's
+contents table: zstd when the `zstandard` package is installed, zlib
+otherwise. The codec is stored next to every body, so either can be read
+back wherever the package is available.
+"""
+
+import zlib
+from typing import Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+def compress(data: bytes) -> Tuple[bytes, str]:
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress(data), "zstd"
+    return zlib.compress(data, 6), "zlib"
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("the zstandard package is needed to read zstd bodies")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    raise ValueError(f"unknown codec {codec!r}")
@@ -0,0 +1,280 @@
+"""
+Batched multi-row inserts for loading the steam_project tables.
+
+Rows are collected as plain dicts and written with a single Core
+`INSERT ... VALUES` executemany per batch, skipping the ORM unit of work
+entirely. Callers decide when to flush, so they can keep foreign key
+parents ahead of their children, or hand them to `flush_parallel`, which
+writes independent tables over several connections at once. For incremental
+loads the inserts can be upserts instead (`INSERT ... ON DUPLICATE KEY
+UPDATE` on MySQL).
+"""
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from functools import partial
+import hashlib
+import json
+from operator import itemgetter
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Type
+
+from sqlalchemy import Engine, delete, insert, select, union
+from sqlalchemy.dialects import mysql, sqlite
+
+from blob_codec import compress
+from constants import LOAD_BATCH_SIZE, LOAD_WORKERS
+from database import Base, Content
+import metrics
+
+class TableLoader:
+    def __init__(
+        self,
+        engine: Engine,
+        model: Type[Base],
+        batch_size: int = LOAD_BATCH_SIZE,
+        upsert: bool = False,
+        shard_key: Optional[str] = None,
+    ):
+        self.engine = engine
+        self.table = model.__table__
+        self.batch_size = batch_size
+        self.upsert = upsert
+        # rows can be split into ranges of this column and written in parallel
+        self.shard_key = shard_key
+        self.rows: List[Dict[str, Any]] = []
+        self.count = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+        self.rows_total = metrics.counter("load_rows_total", "Rows written", table=self.table.name)
+        self.batch_seconds = metrics.histogram(
+            "load_batch_seconds", "Time to write one batch of rows", table=self.table.name,
+        )
+
+    @property
+    def full(self) -> bool:
+        return len(self.rows) >= self.batch_size
+
+    def add(self, row: Dict[str, Any]) -> None:
+        self.rows.append(row)
+
+    def statement(self):
+        if not self.upsert:
+            return insert(self.table)
+        # on a key that already exists, overwrite every other column
+        keys = [column.name for column in self.table.primary_key]
+        dialect = self.engine.dialect.name
+        if dialect == "mysql":
+            statement = mysql.insert(self.table)
+            return statement.on_duplicate_key_update({
+                column.name: statement.inserted[column.name]
+                for column in self.table.columns
+                if column.name not in keys
+            })
+        if dialect == "sqlite":
+            statement = sqlite.insert(self.table)
+            return statement.on_conflict_do_update(
+                index_elements=keys,
+                set_={
+                    column.name: statement.excluded[column.name]
+                    for column in self.table.columns
+                    if column.name not in keys
+                },
+            )
+        raise ValueError(f"no upsert for the {dialect!r} dialect; expected mysql or sqlite")
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        start = time.perf_counter()
+        statement = self.statement()
+        for i in range(0, len(rows), self.batch_size):
+            batch_start = time.perf_counter()
+            with self.engine.begin() as conn:
+                conn.execute(statement, rows[i:i + self.batch_size])
+            self.batch_seconds.observe(time.perf_counter() - batch_start)
+            self.rows_total.inc(len(rows[i:i + self.batch_size]))
+        with self._lock:
+            self.seconds += time.perf_counter() - start
+            self.count += len(rows)
+
+    def flush(self) -> None:
+        rows, self.rows = self.rows, []
+        self.write(rows)
+
+    def flush_tasks(self, shards: int) -> List[Callable[[], None]]:
+        """
+        The work of a flush, split into up to `shards` independent pieces
+        when the loader has a shard key and enough rows to be worth it.
+        """
+        if self.shard_key is None or len(self.rows) < 2 * self.batch_size:
+            return [self.flush]
+        rows, self.rows = sorted(self.rows, key=itemgetter(self.shard_key)), []
+        # whole batches, so no shard ends up with a sliver of a batch
+        batches = -(-len(rows) // self.batch_size)
+        size = -(-batches // shards) * self.batch_size
+        return [partial(self.write, rows[i:i + size]) for i in range(0, len(rows), size)]
+
+    def report(self) -> str:
+        rate = self.count / self.seconds if self.seconds else 0.0
+        return (
+            f"{self.table.name}: {self.count} rows in {self.seconds:.1f}s "
+            f"({rate:,.0f} rows/sec)"
+        )
+
+def flush_all(*loaders: TableLoader) -> None:
+    """
+    Flush `loaders` in the order given, i.e. parents first.
+    """
+    for loader in loaders:
+        loader.flush()
+
+def flush_parallel(*loaders: TableLoader, workers: int = LOAD_WORKERS) -> None:
+    """
+    Flush `loaders` over up to `workers` connections at once. A loader is
+    only started once the loaders of every table it has a foreign key to are
+    done; sharded loaders are written as several pieces side by side.
+    """
+    by_table = {loader.table.name: loader for loader in loaders}
+    parents = {
+        name: {
+            fk.column.table.name for fk in loader.table.foreign_keys
+            if fk.column.table.name in by_table and fk.column.table.name != name
+        }
+        for name, loader in by_table.items()
+    }
+    waiting = dict(by_table)
+    done: Set[str] = set()
+    # table name -> number of its pieces still running
+    running: Dict[str, int] = {}
+    futures: Dict[Future, str] = {}
+    running_gauge = metrics.gauge("load_tasks_running", "Flush pieces being written at once")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while waiting or futures:
+            for name in [name for name in waiting if parents[name] <= done]:
+                tasks = waiting.pop(name).flush_tasks(workers)
+                running[name] = len(tasks)
+                for task in tasks:
+                    futures[executor.submit(task)] = name
+            running_gauge.set(len(futures))
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = futures.pop(future)
+                try:
+                    future.result()
+                except BaseException:
+                    for other in futures:
+                        other.cancel()
+                    raise
+                running[name] -= 1
+                if not running[name]:
+                    done.add(name)
+    running_gauge.set(0)
+
+class LinkLoader(TableLoader):
+    """
+    A TableLoader for link tables (e.g. the tags of a game) in incremental
+    loads. The links of a changed parent are replaced wholesale: its old rows
+    are deleted right before the new ones are inserted, in the same
+    transaction, so readers never see it without any.
+    """
+    def __init__(
+        self,
+        engine: Engine,
+        model: Type[Base],
+        key_column: str,
+        batch_size: int = LOAD_BATCH_SIZE,
+    ):
+        super().__init__(engine, model, batch_size=batch_size)
+        self.key_column = self.table.c[key_column]
+        self.stale: Set[Any] = set()
+
+    def replace(self, key: Any) -> None:
+        """
+        Delete the links `key` already has on the next flush.
+        """
+        self.stale.add(key)
+
+    def flush(self) -> None:
+        start = time.perf_counter()
+        rows, self.rows = self.rows, []
+        stale, self.stale = sorted(self.stale), set()
+        with self.engine.begin() as conn:
+            for i in range(0, len(stale), self.batch_size):
+                chunk = stale[i:i + self.batch_size]
+                conn.execute(delete(self.table).where(self.key_column.in_(chunk)))
+            for i in range(0, len(rows), self.batch_size):
+                batch_start = time.perf_counter()
+                conn.execute(insert(self.table), rows[i:i + self.batch_size])
+                self.batch_seconds.observe(time.perf_counter() - batch_start)
+        self.rows_total.inc(len(rows))
+        with self._lock:
+            self.seconds += time.perf_counter() - start
+            self.count += len(rows)
+
+    def flush_tasks(self, shards: int) -> List[Callable[[], None]]:
+        # the deletes and inserts have to stay in one transaction
+        return [self.flush]
+
+class ContentLoader(TableLoader):
+    """
+    A TableLoader for the content store: `ref` turns a body into the id
+    rows point at, and only bodies that aren't stored yet are compressed
+    and written. Flush it before the tables that reference it.
+    """
+    def __init__(self, engine: Engine, batch_size: int = LOAD_BATCH_SIZE, incremental: bool = False):
+        super().__init__(engine, Content, batch_size=batch_size)
+        # raw sha1 digests, which take less than half the memory of the hex
+        self.known: Set[bytes] = set()
+        if incremental:
+            with engine.connect() as conn:
+                self.known = {
+                    bytes.fromhex(content_id)
+                    for content_id in conn.execute(select(Content.content_id)).scalars()
+                }
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.duplicates = 0
+
+    def ref(self, text: Optional[str]) -> Optional[str]:
+        if not text:
+            return None
+        raw = text.encode("utf-8")
+        digest = hashlib.sha1(raw).digest()
+        if digest in self.known:
+            self.duplicates += 1
+            return digest.hex()
+        self.known.add(digest)
+        body, codec = compress(raw)
+        self.raw_bytes += len(raw)
+        self.stored_bytes += len(body)
+        self.add(dict(content_id=digest.hex(), codec=codec, raw_length=len(raw), body=body))
+        return digest.hex()
+
+    def collect_garbage(self) -> int:
+        """
+        Delete the bodies no row points at any more, like the old contents of
+        a news item an incremental load replaced. Returns how many went.
+        """
+        content_id = self.table.c.content_id
+        referenced = union(*(
+            select(key.parent).where(key.parent.is_not(None))
+            for table in Base.metadata.sorted_tables
+            for key in table.foreign_keys
+            if key.column is content_id
+        ))
+        with self.engine.begin() as conn:
+            return conn.execute(delete(self.table).where(content_id.not_in(referenced))).rowcount
+
+    def report(self) -> str:
+        ratio = self.raw_bytes / self.stored_bytes if self.stored_bytes else 0.0
+        return (
+            f"{super().report()}; {self.duplicates} duplicate bodies skipped, "
+            f"{self.raw_bytes / 2**20:,.1f} MiB compressed to {self.stored_bytes / 2**20:,.1f} MiB "
+            f"({ratio:.1f}x)"
+        )
+
+def content_hash(value: Any) -> str:
+    """
+    A stable hash of some JSON-able scraped data.
+    """
+    data = json.dumps(value, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(data).hexdigest()
@@ -0,0 +1,71 @@
+"""
+Concurrent fetching of the per-app Steamworks API endpoints.
+
+Requests are issued from a bounded pool of worker threads that share a single
+keep-alive `SteamClient`, but results are yielded back in submission order so
+callers can keep checkpointing by index. A client error (e.g. the 403 for an
+app without stats) is the API's final answer and comes back as an empty
+dict, which the callers store as "no data". A body that isn't JSON, or a
+host that kept failing past the retries, is left out instead, rather than
+ending the whole crawl; the callers only store what they got, so it is
+tried again on the next run. Both are counted.
+"""
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Hashable, Iterable, Iterator, Optional, Tuple
+
+from constants import CONCURRENCY
+from http_client import endpoint, PermanentError, RetriesExceeded, SteamClient
+import metrics
+
+def fetch_json(
+    url: str,
+    jobs: Iterable[Tuple[Hashable, Dict[str, Any]]],
+    concurrency: int = CONCURRENCY,
+    client: Optional[SteamClient] = None,
+) -> Iterator[Tuple[Hashable, Any]]:
+    """
+    GET `url` once for each `(key, params)` in `jobs` and yield `(key, json)`
+    in the same order as `jobs`; see above for the jobs that failed. At
+    most `2 * concurrency` requests are in flight or buffered at any time, so
+    `jobs` can be arbitrarily long.
+    """
+    if client is None:
+        client = SteamClient(pool_size=concurrency)
+    pending: deque[Tuple[Hashable, Future]] = deque()
+    depth = metrics.gauge(
+        "fetch_pending", "Requests in flight or done but not yet handed back", endpoint=endpoint(url),
+    )
+
+    def failed(reason: str) -> None:
+        client.count("skipped")
+        metrics.counter("steam_skipped_total", "Apps without data", reason=reason).inc()
+
+    def next_result() -> Iterator[Tuple[Hashable, Any]]:
+        key, future = pending.popleft()
+        depth.set(len(pending))
+        try:
+            value = future.result()
+        except PermanentError as e:
+            if e.status is None:
+                failed("not_json")
+                return
+            # the client has counted the status, and the caller counts the
+            # app as one without data
+            value = {}
+        except RetriesExceeded:
+            failed("gave_up")
+            return
+        yield key, value
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for key, params in jobs:
+            pending.append(
+                (key, executor.submit(client.get_json, url, params))
+            )
+            depth.set(len(pending))
+            if len(pending) >= 2 * concurrency:
+                yield from next_result()
+        while pending:
+            yield from next_result()
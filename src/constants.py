@@ -2,4 +2,60 @@ import os
 
 SRC_DIR = os.path.abspath(os.path.dirname(__file__))
 ROOT_DIR = os.path.dirname(SRC_DIR)
-DATA_DIR = os.path.join(ROOT_DIR, "data")
+# where the collected data lives; overridable so scratch datasets (e.g. for
+# benchmarks) can be used instead
+DATA_DIR = os.environ.get("STEAM_DATA_DIR", os.path.join(ROOT_DIR, "data"))
+
+# number of simultaneous requests made against the Steamworks API
+CONCURRENCY = int(os.environ.get("STEAM_CONCURRENCY", "16"))
+
+# number of store pages scraped at once, each with its own browser
+SCRAPE_WORKERS = int(os.environ.get("STEAM_SCRAPE_WORKERS", "4"))
+# browsers are restarted after this many pages to keep memory in check
+PAGES_PER_DRIVER = int(os.environ.get("STEAM_PAGES_PER_DRIVER", "200"))
+# processes used to parse the scraped store pages
+PARSE_WORKERS = int(os.environ.get("STEAM_PARSE_WORKERS", str(os.cpu_count() or 1)))
+# pages fetched but not yet parsed and written; bounds the scraper's memory
+MAX_PAGES_IN_FLIGHT = int(os.environ.get("STEAM_MAX_PAGES_IN_FLIGHT", "64"))
+
+# where the Steamworks API and the store are; overridable to point the
+# crawlers at a local stand-in (see mock_steam.py)
+API_BASE = os.environ.get("STEAM_API_BASE", "https://api.steampowered.com")
+STORE_BASE = os.environ.get("STEAM_STORE_BASE", "https://store.steampowered.com")
+
+# upper bound on requests/sec per host; the client starts lower, backs off on
+# 429s and works its way up towards this while requests succeed
+MAX_RATE = float(os.environ.get("STEAM_MAX_RATE", "50"))
+# how many times a failed request is retried before giving up
+MAX_RETRIES = int(os.environ.get("STEAM_MAX_RETRIES", "6"))
+
+# rows sent to the database per multi-row INSERT when loading tables
+LOAD_BATCH_SIZE = int(os.environ.get("STEAM_LOAD_BATCH_SIZE", "5000"))
+# tables (or shards of a table) written at once, each over its own connection
+LOAD_WORKERS = int(os.environ.get("STEAM_LOAD_WORKERS", "4"))
+# connections kept open to the database; should be at least LOAD_WORKERS
+DB_POOL_SIZE = int(os.environ.get("STEAM_DB_POOL_SIZE", "8"))
+# "mysql", or "sqlite" for a local single-file copy of the database
+DB_BACKEND = os.environ.get("STEAM_DB_BACKEND", "mysql")
+SQLITE_FH = os.environ.get("STEAM_SQLITE_FH", os.path.join(DATA_DIR, "steam_project.sqlite"))
+# keep news contents and game descriptions compressed in a table of their own,
+# once per distinct body, instead of inline (see database.Content); changes
+# the schema, so the database has to be rebuilt after switching it
+CONTENT_STORE = os.environ.get("STEAM_CONTENT_STORE", "0") not in ("", "0")
+
+# where metrics.py writes its JSON snapshots and Prometheus textfiles, and how
+# often (seconds)
+METRICS_DIR = os.environ.get("STEAM_METRICS_DIR", os.path.join(DATA_DIR, "metrics"))
+METRICS_INTERVAL = float(os.environ.get("STEAM_METRICS_INTERVAL", "30"))
+
+# what profiling.py profiles in every stage, e.g. "cpu,memory" or "all", and
+# where it writes the results
+PROFILE = os.environ.get("STEAM_PROFILE", "")
+PROFILE_DIR = os.environ.get("STEAM_PROFILE_DIR", os.path.join(DATA_DIR, "profiles"))
+# frames kept per allocation by the memory profile; more show where the top
+# allocators were called from, but every one makes the run slower (10 frames
+# made create_tables.py 20x slower, 1 frame 5x)
+TRACEMALLOC_FRAMES = int(os.environ.get("STEAM_TRACEMALLOC_FRAMES", "1"))
+# stages that batch their writes flush early once their RSS goes over this
+# many MB; 0 for no budget
+MEMORY_BUDGET_MB = float(os.environ.get("STEAM_MEMORY_BUDGET_MB", "0"))
@@ -0,0 +1,216 @@
+"""
+End to end crawl throughput against mock_steam.py.
+
+Starts a mock API host and a mock store host (separate ports, so the client
+rate limits them separately like the real ones), then runs the crawlers
+against them into a scratch data directory:
+- api: get_raw_data.py, the applist, news and achievements
+- store: scrape_game_pages.py, over the same applist
+
+Reports apps/sec for each crawl, what the server did to it (responses,
+injected 5xx and 429s), what the client did about it (retries, throttling,
+breaker trips), and how much of the data came through intact, checked
+against what the mock serves.
+
+    python crawl_harness.py [--apps 2000] [--latency 0.02] [--error-rate 0.02]
+        [--throttle-rate 0.005] [--home-page-rate 0.1] [--crawls api store] [--out results.json]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from constants import SRC_DIR
+from mock_steam import MockSteam
+from synthetic_data import app_rng, game_record
+
+CRAWLS = {
+    "api": ["get_raw_data.py"],
+    "store": ["scrape_game_pages.py"],
+}
+
+def client_stats(output: str) -> Dict[str, float]:
+    """
+    The counters from the "requests: ..." line the crawlers print at the end.
+    """
+    stats = {}
+    for line in output.splitlines():
+        if line.startswith("requests: "):
+            for pair in line[len("requests: "):].split(", "):
+                if "=" in pair:
+                    name, value = pair.split("=", 1)
+                    stats[name] = float(value)
+    return stats
+
+def load(data_dir: str, name: str) -> Any:
+    fh = os.path.join(data_dir, name)
+    if not os.path.exists(fh):
+        return None
+    with open(fh, "r") as f:
+        return json.loads(f.read())
+
+def check_api(mock: MockSteam, data_dir: str) -> Dict[str, float]:
+    """
+    Fraction of apps whose applist entry, news and achievements came through
+    exactly as served.
+    """
+    applist = load(data_dir, "applist.json") or []
+    news = {
+        items[0]["appid"]: [item["gid"] for item in items]
+        for items in load(data_dir, "newsitems.json") or [] if items
+    }
+    achievements = load(data_dir, "achievements.json") or []
+    with_stats = [appid for appid in range(mock.apps) if mock.has_stats(appid)]
+    news_ok = sum(
+        news.get(appid) == [item["gid"] for item in mock.news(appid)[:20]]
+        for appid in range(mock.apps)
+    )
+    # achievements.json has one list per app with stats, in applist order
+    achievements_ok = sum(
+        got == mock.achievements(appid) for appid, got in zip(with_stats, achievements)
+    )
+    return {
+        "applist": float(applist == mock.applist()),
+        "news": news_ok / mock.apps,
+        "achievements": achievements_ok / max(1, len(with_stats)) if len(achievements) == len(with_stats) else 0.0,
+    }
+
+def check_store(mock: MockSteam, data_dir: str) -> Dict[str, float]:
+    """
+    Fraction of store pages parsed into exactly the served game, and of the
+    apps without a page that were recorded as skipped.
+    """
+    def normalize(page_data):
+        return {
+            key: sorted(value) if isinstance(value, list) else value
+            for key, value in page_data.items()
+        }
+    games = {game["appid"]: game for game in load(data_dir, "gamedetails.json") or []}
+    skipped = set()
+    checkpoint_fh = os.path.join(data_dir, "gamedetails.jsonl")
+    if os.path.exists(checkpoint_fh):
+        with open(checkpoint_fh, "r") as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get("skipped"):
+                    skipped.add(record["appid"])
+    with_page = [appid for appid in range(mock.apps) if mock.has_page(appid)]
+    pages_ok = sum(
+        appid in games
+        and normalize(games[appid]) == normalize(game_record(app_rng(mock.seed, appid), appid, mock.apps))
+        for appid in with_page
+    )
+    without_page = mock.apps - len(with_page)
+    return {
+        "pages": pages_ok / max(1, len(with_page)),
+        "skipped": len(skipped) / max(1, without_page),
+    }
+
+def run_crawl(
+    name: str,
+    mock: MockSteam,
+    data_dir: str,
+    env: Dict[str, str],
+) -> Dict[str, Any]:
+    before = dict(mock.stats)
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, *CRAWLS[name]],
+        cwd=SRC_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    seconds = time.perf_counter() - start
+    server = {
+        key: value - before.get(key, 0) for key, value in mock.stats.items()
+        if value - before.get(key, 0)
+    }
+    check = check_api if name == "api" else check_store
+    return {
+        "seconds": seconds,
+        "apps_per_sec": mock.apps / seconds,
+        "exit_status": result.returncode,
+        "server": server,
+        "client": client_stats(result.stdout),
+        "complete": check(mock, data_dir),
+        # the end of the output, for when a crawl fails
+        "output_tail": (result.stdout + result.stderr).splitlines()[-10:] if result.returncode else [],
+    }
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--apps", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--throttle-rate", type=float, default=0.005)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--server-max-rate", type=float, help="requests/sec the mock serves before 429s")
+    parser.add_argument("--home-page-rate", type=float, default=0.1)
+    parser.add_argument(
+        "--client-max-rate",
+        type=float,
+        help="STEAM_MAX_RATE for the crawlers; the default is the crawlers' own",
+    )
+    parser.add_argument("--crawls", nargs="+", choices=list(CRAWLS), default=list(CRAWLS))
+    parser.add_argument("--out", help="also write the results here as JSON")
+    args = parser.parse_args(argv)
+
+    mock = MockSteam(
+        apps=args.apps,
+        seed=args.seed,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        max_rate=args.server_max_rate,
+        home_page_rate=args.home_page_rate,
+    )
+    api_server = mock.serve()
+    store_server = mock.serve()
+    results: Dict[str, Any] = {"params": vars(args), "crawls": {}}
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = dict(
+            os.environ,
+            STEAM_DATA_DIR=data_dir,
+            STEAM_API_BASE=f"http://127.0.0.1:{api_server.server_address[1]}",
+            STEAM_STORE_BASE=f"http://127.0.0.1:{store_server.server_address[1]}",
+        )
+        if args.client_max_rate is not None:
+            env["STEAM_MAX_RATE"] = str(args.client_max_rate)
+        if "store" in args.crawls and "api" not in args.crawls:
+            # the scrape works off the applist
+            with open(os.path.join(data_dir, "applist.json"), "w") as f:
+                f.write(json.dumps(mock.applist()))
+        for name in args.crawls:
+            print(f"crawling {name}")
+            crawl = results["crawls"][name] = run_crawl(name, mock, data_dir, env)
+            print(
+                f"  {crawl['seconds']:.1f}s, {crawl['apps_per_sec']:.1f} apps/sec, "
+                f"exit status {crawl['exit_status']}"
+            )
+            print(f"  server: {', '.join(f'{k}={v}' for k, v in sorted(crawl['server'].items()))}")
+            print(f"  client: {', '.join(f'{k}={v:g}' for k, v in sorted(crawl['client'].items()))}")
+            print(f"  complete: {', '.join(f'{k} {v:.1%}' for k, v in crawl['complete'].items())}")
+            for line in crawl["output_tail"]:
+                print(f"  | {line}")
+    api_server.shutdown()
+    store_server.shutdown()
+
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(json.dumps(results, indent=2))
+    incomplete = any(
+        crawl["exit_status"] or min(crawl["complete"].values()) < 1
+        for crawl in results["crawls"].values()
+    )
+    return 1 if incomplete else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
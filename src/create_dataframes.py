@@ -1,82 +1,220 @@
-import json
+import argparse
+from itertools import chain
+from operator import itemgetter
 import os
+from typing import Any, Dict, Iterable, List, Optional, Set
+import numpy as np
 import pandas as pd
 
 from constants import DATA_DIR
+from dataframe_store import ColumnarWriter, missing_dependency, TABLE_DTYPES
+from json_stream import batched, iter_apps, iter_gamedetails, iter_newsitems
+import metrics
+import profiling
 
-applist_fh = os.path.join(DATA_DIR, "applist.json")
-with open(applist_fh, "r") as f:
-    applist = json.loads(f.read())
-
-newsitems_fh = os.path.join(DATA_DIR, "newsitems.json")
-with open(newsitems_fh, "r") as f:
-    newsitems = json.loads(f.read())
-
-gamedetails_fh = os.path.join(DATA_DIR, "gamedetails.json")
-with open(gamedetails_fh, "r") as f:
-    gamedetails = json.loads(f.read())
-
-final_ids = (
-    {x["appid"] for x in applist} &
-    {x["appid"] for x in gamedetails}
-)
-
-# newsitems needs to be flattened
-# the tags need to be pulled into a separate table
-newsitems_data = []
-newsitem_tags = []
-for newslist in newsitems:
-    for row in newslist:
-        appid = row["appid"]
-        if appid in final_ids:
-            tags = row.pop("tags", [])
-            newsitems_data.append(row)
-            newsitem_tags.extend([{"gid": row["gid"], "tag": tag} for tag in tags])
-newsitems_df = pd.DataFrame(newsitems_data)
-newsitems_df.to_csv(os.path.join(DATA_DIR, "newsitems.csv"))
-newsitem_tags_df = pd.DataFrame(newsitem_tags)
-newsitem_tags_df.to_csv(os.path.join(DATA_DIR, "newsitem_tags.csv"))
-del newsitems_data, newsitem_tags, newsitems_df, newsitem_tags_df, newsitems
-
-# add the name from applist to gamedetails
-details = {}
-for app in applist:
-    appid = app["appid"]
-    if appid in final_ids:
-        details[appid] = app
-
-# developers, publishers, tags, and features should be pulled out of gamedetails into separate dataframes
-developers = []
-publishers = []
-tags = []
-features = []
-for game in gamedetails:
-    appid = game["appid"]
-    if not appid in final_ids:
-        continue
-    developers.extend([
-        {"appid": appid, "developer": x} for x in game.pop("developers", [])
-    ])
-    publishers.extend([
-        {"appid": appid, "publisher": x} for x in game.pop("publishers", [])
-    ])
+# source records turned into frames at a time
+CHUNK_ROWS = 10000
+
+# the per-game lists that become their own tables, and the column each one's
+# values go in
+GAME_LINKS = {
+    "developers": "developer",
+    "publishers": "publisher",
+    "tags": "tag",
+    "features": "feature",
+}
+
+Frames = Dict[str, pd.DataFrame]
+
+class CsvWriter:
+    """
+    Builds a csv a chunk at a time, so the whole table never has to be in
+    memory. The index keeps counting up across chunks, as if the table had
+    been written in one go. The header is written with the first chunk (or
+    comes from `columns`), so a column that only turns up later, e.g. a new
+    field in the Steam API's responses, can't be added to it; it is left
+    out of the file, with a warning the first time it's seen.
+    """
+    def __init__(self, fh: str, columns: Optional[List[str]] = None):
+        self.fh = fh
+        self.columns = columns
+        self.count = 0
+        self.dropped: Set[str] = set()
+
+    def add_frame(self, df: pd.DataFrame) -> None:
+        if self.columns is None:
+            # the first chunk decides the columns
+            self.columns = list(df.columns)
+        extra = [
+            column for column in df.columns
+            if column not in self.columns and column not in self.dropped
+        ]
+        if extra:
+            print(f"Warning: {self.fh}: leaving out columns {extra}, which aren't in the header")
+            self.dropped.update(extra)
+        df = df.reindex(columns=self.columns)
+        df.index = range(self.count, self.count + len(df))
+        df.to_csv(self.fh, mode="a" if self.count else "w", header=not self.count)
+        self.count += len(df)
+
+    def flush(self) -> None:
+        if not self.count:
+            # still leave a file behind for an empty table
+            self.add_frame(pd.DataFrame(columns=self.columns))
+
+def same_keys(records: List[Dict[str, Any]]) -> Optional[List[str]]:
+    """
+    The keys of the records, in order, if they all have the same ones. Given
+    the columns up front, DataFrame(records) skips collecting them row by row.
+    """
+    if not records:
+        return None
+    first = records[0].keys()
+    if all(record.keys() == first for record in records):
+        return list(first)
+    return None
+
+def link_frame(keys: np.ndarray, lists: List[List[Any]], key: str, name: str) -> pd.DataFrame:
+    """
+    One row per element of `lists`, next to the key of the list it's from.
+    """
+    lengths = np.fromiter(map(len, lists), dtype=np.int64, count=len(lists))
+    values = np.empty(int(lengths.sum()), dtype=object)
+    values[:] = list(chain.from_iterable(lists))
+    return pd.DataFrame({key: np.repeat(keys, lengths), name: values})
+
+def build_news_frames(items: List[Dict[str, Any]], final_ids: Set[int]) -> Frames:
+    """
+    The newsitems and newsitem_tags frames for a chunk of news items. The
+    source records aren't changed.
+    """
+    items = [item for item in items if item["appid"] in final_ids]
+    columns = same_keys(items)
+    if columns is not None and "tags" in columns:
+        columns.remove("tags")
+    newsitems = pd.DataFrame(items, columns=columns)
+    if "tags" in newsitems.columns:
+        del newsitems["tags"]
+    gids = newsitems["gid"].to_numpy(dtype=object) if items else np.empty(0, dtype=object)
+    return {
+        "newsitems": newsitems,
+        "newsitem_tags": link_frame(gids, [item.get("tags", ()) for item in items], "gid", "tag"),
+    }
+
+def build_game_frames(games: List[Dict[str, Any]], names: Dict[int, str]) -> Frames:
+    """
+    The details frame and one frame per GAME_LINKS table for a chunk of
+    (deduplicated) games. The source records aren't changed.
+    """
+    appids = np.fromiter(map(itemgetter("appid"), games), dtype=np.int64, count=len(games))
+    frames = {
+        table: link_frame(appids, [game.get(table, ()) for game in games], "appid", column)
+        for table, column in GAME_LINKS.items()
+    }
     # the steam page for games has a "+" button to add tags; I should have filtered it out in
     # the web scraping, but I will do it here since I missed it before
-    tags.extend([
-        {"appid": appid, "tag": x} for x in game.pop("tags", []) if x != "+"
-    ])
-    features.extend([
-        {"appid": appid, "feature": x} for x in game.pop("features", [])
-    ])
-    details[appid].update(game)
-details_df = pd.DataFrame(details.values())
-details_df.to_csv(os.path.join(DATA_DIR, "details.csv"))
-developers_df = pd.DataFrame(developers)
-developers_df.to_csv(os.path.join(DATA_DIR, "developers.csv"))
-publishers_df = pd.DataFrame(publishers)
-publishers_df.to_csv(os.path.join(DATA_DIR, "publishers.csv"))
-tags_df = pd.DataFrame(tags)
-tags_df.to_csv(os.path.join(DATA_DIR, "tags.csv"))
-features_df = pd.DataFrame(features)
-features_df.to_csv(os.path.join(DATA_DIR, "features.csv"))
+    tags = frames["tags"]
+    frames["tags"] = tags[tags["tag"].to_numpy() != "+"].reset_index(drop=True)
+
+    columns = same_keys(games)
+    if columns is None:
+        columns = list(dict.fromkeys(chain.from_iterable(games)))
+    details = pd.DataFrame(games, columns=[column for column in columns if column not in GAME_LINKS])
+    # the name from the applist, unless the page data has its own
+    app_names = [names[appid] for appid in appids.tolist()]
+    if "name" in details.columns:
+        has_name = np.fromiter(("name" in game for game in games), dtype=bool, count=len(games))
+        app_names = np.where(has_name, details.pop("name").to_numpy(), np.array(app_names, dtype=object))
+    details.insert(1, "name", app_names)
+    return {"details": details, **frames}
+
+def new_games(games: Iterable[Dict[str, Any]], final_ids: Set[int]) -> Iterable[Dict[str, Any]]:
+    # accidentally created some duplicate entries
+    seen_appids = set()
+    for game in games:
+        appid = game["appid"]
+        if appid in final_ids and appid not in seen_appids:
+            seen_appids.add(appid)
+            yield game
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Flatten the collected data into tables.")
+    parser.add_argument(
+        "--format",
+        choices=["csv", "parquet", "feather", "pickle"],
+        default="csv",
+        help="csv files, or a directory of part files per table (see dataframe_store.py); "
+        "parquet and feather are columnar, pickle is for when pyarrow isn't installed",
+    )
+    parser.add_argument("--out-dir", default=DATA_DIR)
+    # every chunk is written as soon as it is built, so there is nothing to
+    # flush early
+    profiling.add_arguments(parser, memory_budget=False)
+    args = parser.parse_args(argv)
+    problem = missing_dependency(args.format)
+    if problem is not None:
+        parser.error(problem)
+    metrics.start("create_dataframes")
+    profiling.start("create_dataframes", args.profile)
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    def add_frame(table: str, df: pd.DataFrame) -> None:
+        writers[table].add_frame(df)
+        metrics.counter("dataframes_rows_total", "Rows written", table=table).inc(len(df))
+
+    def add_frames(frames: Frames) -> None:
+        # popped as they're written, so each frame is freed right after
+        while frames:
+            add_frame(*frames.popitem())
+
+    def writer(table: str, columns: Optional[List[str]] = None):
+        if args.format == "csv":
+            return CsvWriter(os.path.join(args.out_dir, f"{table}.csv"), columns)
+        return ColumnarWriter(args.out_dir, table, args.format, columns, chunk_rows=CHUNK_ROWS)
+
+    # the files are streamed rather than loaded whole; only the ids and app
+    # names are kept around
+    names = {app["appid"]: app["name"] for app in iter_apps()}
+    final_ids = set()
+    # every row needs the same columns; collect them up front, in the order
+    # pandas would have put them
+    detail_columns = {"appid": None, "name": None}
+    for game in iter_gamedetails():
+        if game["appid"] in names:
+            final_ids.add(game["appid"])
+            detail_columns.update(dict.fromkeys(game))
+    for column in GAME_LINKS:
+        detail_columns.pop(column, None)
+
+    # newsitems needs to be flattened
+    # the tags need to be pulled into a separate table
+    writers = {
+        # the news items aren't read twice, so their columns come from the
+        # schema rather than from the data
+        "newsitems": writer("newsitems", list(TABLE_DTYPES["newsitems"])),
+        "newsitem_tags": writer("newsitem_tags", ["gid", "tag"]),
+    }
+    for items in batched(iter_newsitems(), CHUNK_ROWS):
+        frames = build_news_frames(items, final_ids)
+        # the records aren't needed once the frames are built; dropped here,
+        # they are freed before the next chunk is read
+        del items
+        add_frames(frames)
+
+    # developers, publishers, tags, and features should be pulled out of gamedetails into separate dataframes
+    writers.update({
+        "details": writer("details", list(detail_columns)),
+        **{
+            table: writer(table, ["appid", column])
+            for table, column in GAME_LINKS.items()
+        },
+    })
+    for games in batched(new_games(iter_gamedetails(), final_ids), CHUNK_ROWS):
+        frames = build_game_frames(games, names)
+        del games
+        add_frames(frames)
+    for out in writers.values():
+        out.flush()
 
+if __name__ == "__main__":
+    main()
@@ -1,72 +1,152 @@
+import argparse
 from datetime import datetime
-import json
-import os
+from sqlalchemy import select
 from tqdm import tqdm
 
-from constants import DATA_DIR
+from bulk_load import content_hash, ContentLoader, flush_parallel, LinkLoader, TableLoader
+from constants import CONTENT_STORE, DB_BACKEND, LOAD_BATCH_SIZE, LOAD_WORKERS
 from database import (
-    Author,
-    Company,
+    begin_bulk_load,
     create_all,
     Developer,
+    disable_checks,
+    enable_checks,
+    end_bulk_load,
     Game,
     GameFeature,
     GameTag,
-    GameTagEnumeration,
-    get_session,
-    FeatureEnumeration,
-    Feedlabel,
-    Feedname,
+    get_engine,
     Newsitem,
-    NewsitemTagEnumeration,
     NewsitemTags,
     Publisher,
 )
+from dimensions import dimension_caches
+from json_stream import iter_apps, iter_gamedetails, iter_newsitems
+import metrics
+import profiling
 
-applist_fh = os.path.join(DATA_DIR, "applist.json")
-with open(applist_fh, "r") as f:
-    applist = json.loads(f.read())
-
-newsitems_fh = os.path.join(DATA_DIR, "newsitems.json")
-with open(newsitems_fh, "r") as f:
-    newsitems = json.loads(f.read())
-
-gamedetails_fh = os.path.join(DATA_DIR, "gamedetails.json")
-with open(gamedetails_fh, "r") as f:
-    gamedetails = json.loads(f.read())
-
-final_ids = (
-    {x["appid"] for x in applist} &
-    {x["appid"] for x in gamedetails}
+parser = argparse.ArgumentParser(description="Load the scraped data into the database.")
+parser.add_argument(
+    "--incremental",
+    action="store_true",
+    help="upsert new and changed rows into the existing database instead of rebuilding it",
+)
+parser.add_argument(
+    "--force",
+    action="store_true",
+    help="with --incremental, rewrite every row even if its content hash is unchanged",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    # sqlite only has one writer at a time anyway
+    default=1 if DB_BACKEND == "sqlite" else LOAD_WORKERS,
+    help="tables (or shards of the newsitems table) written at once",
 )
+parser.add_argument(
+    "--no-checks",
+    action="store_true",
+    help="turn off foreign key and unique checks during the load and validate everything at the end",
+)
+parser.add_argument(
+    "--fulltext",
+    action="store_true",
+    help="also build the full text indexes on newsitems and games",
+)
+profiling.add_arguments(parser)
+args = parser.parse_args()
+metrics.start("create_tables")
+profiling.start("create_tables", args.profile, args.memory_budget)
+
+# the data files are streamed rather than loaded whole; only the ids and app
+# names are kept around
+print("reading applist")
+names = {app["appid"]: app for app in iter_apps()}
+final_ids = names.keys() & {game["appid"] for game in iter_gamedetails()}
 
 print("creating tables")
-create_all()
+create_all(drop=not args.incremental)
 
-print("getting session")
-SESSION = get_session()
+print("getting engine")
+ENGINE = get_engine()
+if args.no_checks:
+    disable_checks(ENGINE)
+begin_bulk_load(ENGINE, incremental=args.incremental)
+
+# content hashes of what is already loaded; rows whose hash hasn't changed are
+# skipped. Rows that have disappeared from the input are left alone.
+stored_games = {}
+stored_newsitems = {}
+if args.incremental:
+    with ENGINE.connect() as conn:
+        stored_games = dict(conn.execute(select(Game.appid, Game.content_hash)).all())
+        stored_newsitems = dict(conn.execute(select(Newsitem.gid, Newsitem.content_hash)).all())
+    print(f"{len(stored_games)} games and {len(stored_newsitems)} newsitems already loaded")
+if args.force:
+    stored_games = dict.fromkeys(stored_games)
+    stored_newsitems = dict.fromkeys(stored_newsitems)
+unchanged_games = 0
+unchanged_newsitems = 0
 
 # add the name from applist to gamedetails
-details = {}
-for app in applist:
-    appid = app["appid"]
-    if appid in final_ids:
-        details[appid] = app
+details = {appid: names[appid] for appid in final_ids}
+del names
+
+# every row in an executemany needs the same keys
+game_columns = [column.name for column in Game.__table__.columns]
+newsitem_columns = [column.name for column in Newsitem.__table__.columns]
+
+# ids for the lookup tables, shared by the games and newsitems below
+dimensions = dimension_caches(ENGINE)
+companies = dimensions["companies"]
+game_tag_enumerations = dimensions["game_tag_enumerations"]
+feature_enumerations = dimensions["feature_enumerations"]
+authors = dimensions["authors"]
+feedlabels = dimensions["feedlabels"]
+feednames = dimensions["feednames"]
+newsitem_tag_enumerations = dimensions["newsitem_tag_enumerations"]
+
+# with the content store, news contents and game descriptions go in their
+# own table, each distinct body once
+contents = ContentLoader(ENGINE, incremental=args.incremental) if CONTENT_STORE else None
+content_loaders = [contents] if CONTENT_STORE else []
+
+games = TableLoader(ENGINE, Game, upsert=args.incremental)
+developer_rows = LinkLoader(ENGINE, Developer, "appid")
+publisher_rows = LinkLoader(ENGINE, Publisher, "appid")
+game_tags = LinkLoader(ENGINE, GameTag, "appid")
+game_features = LinkLoader(ENGINE, GameFeature, "appid")
+game_link_loaders = [developer_rows, publisher_rows, game_tags, game_features]
+game_loaders = [
+    # dimensions, then games, then the link tables
+    companies,
+    game_tag_enumerations,
+    feature_enumerations,
+    *content_loaders,
+    games,
+    developer_rows,
+    publisher_rows,
+    game_tags,
+    game_features,
+]
 
 # developers, publishers, tags, and features should be pulled out of gamedetails into separate dataframes
-developers = set()
-publishers = set()
-company_map = {}
-tag_map = {}
-feature_map = {}
 # accidentally created some duplicate entries
 seen_appids = set()
 print("parsing gamedetails")
-for game in tqdm(gamedetails):
+for game in tqdm(iter_gamedetails()):
     appid = game["appid"]
     if not appid in final_ids or appid in seen_appids:
         continue
     seen_appids.add(appid)
+    game["content_hash"] = content_hash({**details[appid], **game})
+    if appid in stored_games:
+        if stored_games[appid] == game["content_hash"]:
+            unchanged_games += 1
+            continue
+        # the game's links are rebuilt from scratch
+        for loader in game_link_loaders:
+            loader.replace(appid)
     release_date = game.get("release_date", "").strip()
     game["coming_soon"] = False
     if release_date == "Coming soon":
@@ -80,43 +160,14 @@ for game in tqdm(gamedetails):
             # I don't really feel like dealing with that nuance at this time
             release_date = None
     game["release_date"] = release_date
-    items_to_add = []
     for company in game.pop("developers", []):
-        company = company.strip()
-        if company in company_map:
-            company_id = company_map[company]
-        else:
-            company_id = len(company_map) + 1
-            company_map[company] = company_id
-            SESSION.add(Company(
-                company_id=company_id,
-                company=company,
-                is_developer=False,
-                is_publisher=False,
-            ))
-        developers.add(company_id)
-        items_to_add.append(Developer(
-            company_id=company_id,
-            # developer_id=developer_id,
+        developer_rows.add(dict(
+            company_id=companies.developer(company.strip()),
             appid=appid,
         ))
     for company in game.pop("publishers", []):
-        company = company.strip()
-        if company in company_map:
-            company_id = company_map[company]
-        else:
-            company_id = len(company_map) + 1
-            company_map[company] = company_id
-            SESSION.add(Company(
-                company_id=company_id,
-                company=company,
-                is_developer=False,
-                is_publisher=False,
-            ))
-        publishers.add(company_id)
-        items_to_add.append(Publisher(
-            company_id=company_id,
-            # publisher_id=publisher_id,
+        publisher_rows.add(dict(
+            company_id=companies.publisher(company.strip()),
             appid=appid,
         ))
     for tag in game.pop("tags", []):
@@ -126,134 +177,91 @@ for game in tqdm(gamedetails):
         # missed it before
         if tag == "+":
             continue
-        if tag in tag_map:
-            tag_id = tag_map[tag]
-        else:
-            tag_id = len(tag_map) + 1
-            tag_map[tag] = tag_id
-            SESSION.add(GameTagEnumeration(
-                game_tag_enumeration_id=tag_id,
-                tag=tag,
-            ))
-        items_to_add.append(GameTag(
+        game_tags.add(dict(
             appid=appid,
-            game_tag_enumeration_id=tag_id,
+            game_tag_enumeration_id=game_tag_enumerations.get_id(tag),
         ))
     for feature in game.pop("features", []):
-        feature = feature.strip()
-        if feature in feature_map:
-            feature_id = feature_map[feature]
-        else:
-            feature_id = len(feature_map) + 1
-            feature_map[feature] = feature_id
-            SESSION.add(FeatureEnumeration(
-                feature_enumeration_id=feature_id,
-                feature=feature,
-            ))
-        items_to_add.append(GameFeature(
+        game_features.add(dict(
             appid=appid,
-            feature_enumeration_id=feature_id,
+            feature_enumeration_id=feature_enumerations.get_id(feature.strip()),
         ))
 
+    row = {**details[appid], **game}
+    if CONTENT_STORE:
+        row["description_id"] = contents.ref(row.get("description"))
+    games.add({column: row.get(column) for column in game_columns})
+    if any(loader.full for loader in game_loaders) or profiling.over_budget():
+        flush_parallel(*game_loaders, workers=args.workers)
+
+print("loading games")
+flush_parallel(*game_loaders, workers=args.workers)
+del details
 
-    details[appid].update(game)
-    SESSION.add(Game(**details[appid]))
-    SESSION.commit()
-    SESSION.add_all(items_to_add)
-    try:
-        SESSION.commit()
-    except Exception as e:
-        print(e)
-        import ipdb; ipdb.set_trace()
-(
-    SESSION.query(Company)
-    .filter(Company.company_id in developers)
-    .update({"is_developer": True})
-)
-(
-    SESSION.query(Company)
-    .filter(Company.company_id in publishers)
-    .update({"is_publisher": True})
-)
-SESSION.commit()
-del details, publishers, developers, applist, gamedetails, feature_map, tag_map, company_map
 
+# newsitems are written in appid ranges side by side, so let enough pile up
+# to give every worker a few batches
+newsitem_rows = TableLoader(ENGINE, Newsitem, upsert=args.incremental, shard_key="appid")
+newsitem_tags = LinkLoader(ENGINE, NewsitemTags, "gid")
+news_loaders = [
+    # dimensions, then newsitems, then their tags
+    newsitem_tag_enumerations,
+    authors,
+    feedlabels,
+    feednames,
+    *content_loaders,
+    newsitem_rows,
+    newsitem_tags,
+]
 
 # newsitems needs to be flattened
 # date needs to be converted from unix epoch timestamp to date
 # the tags need to be pulled into a separate table
-tag_map = {}
-author_map = {}
-feedlabel_map = {}
-feedname_map = {}
 # accidentally created some duplicate entries
 seen_gids = set()
-print("parsing newsitems")
-for newslist in tqdm(newsitems):
-    for row in newslist:
-        appid = row["appid"]
-        gid = row["gid"] = int(row["gid"])
-        if appid not in final_ids or gid in seen_gids:
+print("parsing and loading newsitems")
+for row in tqdm(iter_newsitems()):
+    appid = row["appid"]
+    gid = row["gid"] = int(row["gid"])
+    if appid not in final_ids or gid in seen_gids:
+        continue
+    seen_gids.add(gid)
+    row["content_hash"] = content_hash(row)
+    if gid in stored_newsitems:
+        if stored_newsitems[gid] == row["content_hash"]:
+            unchanged_newsitems += 1
             continue
-        seen_gids.add(gid)
-        row["date"] = datetime.fromtimestamp(row["date"])
-        tags = row.pop("tags", [])
-        newsitem_tags = []
-        for tag in tags:
-            tag = tag.strip()
-            if tag in tag_map:
-                tag_id = tag_map[tag]
-            else:
-                tag_id = len(tag_map) + 1
-                tag_map[tag] = tag_id
-                SESSION.add(NewsitemTagEnumeration(
-                    newsitem_tag_enumeration_id=tag_id,
-                    tag=tag,
-                ))
-            newsitem_tags.append(NewsitemTags(
-                gid=gid,
-                newsitem_tag_enumeration_id=tag_id,
-            ))
-        author = row.pop("author", "").strip() or None
-        if author in author_map:
-            author_id = author_map[author]
-        elif author is None:
-            author_id = None
-        else:
-            author_id = len(author_map) + 1
-            author_map[author] = author_id
-            SESSION.add(Author(
-                author_id=author_id,
-                author=author,
-            ))
-        feedlabel = row.pop("feedlabel", "").strip() or None
-        if feedlabel in feedlabel_map:
-            feedlabel_id = feedlabel_map[feedlabel]
-        elif feedlabel is None:
-            feedlabel_id = None
-        else:
-            feedlabel_id = len(feedlabel_map) + 1
-            feedlabel_map[feedlabel] = feedlabel_id
-            SESSION.add(Feedlabel(
-                feedlabel_id=feedlabel_id,
-                feedlabel=feedlabel,
-            ))
-        feedname = row.pop("feedname", "").strip() or None
-        if feedname in feedname_map:
-            feedname_id = feedname_map[feedname]
-        elif feedname is None:
-            feedname_id = None
-        else:
-            feedname_id = len(feedname_map) + 1
-            feedname_map[feedname] = feedname_id
-            SESSION.add(Feedname(
-                feedname_id=feedname_id,
-                feedname=feedname,
-            ))
-        SESSION.commit()
-        SESSION.add(Newsitem(**row))
-        SESSION.commit()
-        SESSION.add_all(newsitem_tags)
-        SESSION.commit()
+        newsitem_tags.replace(gid)
+    row["date"] = datetime.fromtimestamp(row["date"])
+    for tag in row.pop("tags", []):
+        newsitem_tags.add(dict(
+            gid=gid,
+            newsitem_tag_enumeration_id=newsitem_tag_enumerations.get_id(tag.strip()),
+        ))
+    row["author_id"] = authors.get_id(row.pop("author", "").strip() or None)
+    row["feedlabel_id"] = feedlabels.get_id(row.pop("feedlabel", "").strip() or None)
+    row["feedname_id"] = feednames.get_id(row.pop("feedname", "").strip() or None)
+    if CONTENT_STORE:
+        row["contents_id"] = contents.ref(row.pop("contents", None))
+    newsitem_rows.add({column: row.get(column) for column in newsitem_columns})
+    if (
+        max(len(newsitem_rows.rows), len(newsitem_tags.rows)) >= args.workers * LOAD_BATCH_SIZE
+        or profiling.over_budget()
+    ):
+        flush_parallel(*news_loaders, workers=args.workers)
+flush_parallel(*news_loaders, workers=args.workers)
+if args.incremental and CONTENT_STORE:
+    # replaced rows leave their old bodies behind; a full load starts empty
+    print(f"{contents.collect_garbage()} unreferenced contents deleted")
+if args.no_checks:
+    # before the unique indexes are built, so duplicates are reported as
+    # such rather than as a failed CREATE INDEX
+    print("validating constraints")
+    enable_checks(ENGINE)
+print("creating indexes")
+end_bulk_load(ENGINE, fulltext=args.fulltext)
 
-SESSION.close()
+for loader in game_loaders + [loader for loader in news_loaders if loader not in content_loaders]:
+    print(loader.report())
+if args.incremental:
+    print(f"{unchanged_games} games and {unchanged_newsitems} newsitems unchanged")
@@ -1,26 +1,42 @@
 import datetime
+import os
+import time
+from typing import Dict, List, NamedTuple, Set, Tuple
 from sqlalchemy import (
     BigInteger,
     Column,
     Date,
     create_engine,
+    Engine,
+    event,
     ForeignKey,
+    func,
+    select,
+    String,
     text,
 )
-from sqlalchemy.dialects.mysql import FLOAT, LONGTEXT
+from sqlalchemy.dialects.mysql import FLOAT, LONGBLOB, LONGTEXT
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import (
     DeclarativeBase,
     Mapped,
     mapped_column,
+    relationship,
     Session,
 )
 from typing_extensions import Annotated
 
+from blob_codec import decompress
+from constants import CONTENT_STORE, DB_BACKEND, DB_POOL_SIZE, SQLITE_FH
+
 DATABASE = "steam_project"
 HOST = "localhost"
 USER = "user"
 
 bigint = Annotated[int, "bigint"]
+# strings compared byte for byte, like the interning caches in dimensions.py
+# do; MySQL's default collation would treat "RPG" and "rpg" as the same tag
+exact_str = Annotated[str, mapped_column(LONGTEXT(collation="utf8mb4_bin"))]
 
 class Base(DeclarativeBase):
     type_annotation_map = {
@@ -28,6 +44,34 @@ class Base(DeclarativeBase):
         bigint: BigInteger(),
     } 
 
+class Content(Base):
+    """
+    A news item's contents or a game's description, compressed, and stored
+    once however many rows share it; syndicated press releases show up
+    under many apps. Only used with CONTENT_STORE.
+    """
+    __tablename__ = "contents"
+
+    # sha1 of the uncompressed text
+    content_id = Column("content_id", String(40), primary_key=True)
+    codec = Column("codec", String(8), nullable=False)
+    raw_length = Column("raw_length", BigInteger(), nullable=False)
+    body = Column("body", LONGBLOB(), nullable=False)
+
+    @property
+    def text(self) -> str:
+        return decompress(self.body, self.codec).decode("utf-8")
+
+    def __repr__(self):
+        return f"Content(content_id={self.content_id!r}, raw_length={self.raw_length!r})"
+
+def _stored_text(relationship_name: str) -> property:
+    # the text behind a content store reference, read on first access
+    def get(self):
+        content = getattr(self, relationship_name)
+        return None if content is None else content.text
+    return property(get)
+
 class Game(Base):
     __tablename__ = "games"
 
@@ -37,11 +81,20 @@ class Game(Base):
     release_date = Column("release_date", Date(), nullable=True)
     coming_soon: Mapped[bool]
     price = Column("price", FLOAT(scale=2), nullable=True)
-    description = Column("description", LONGTEXT(), nullable=True)
+    if CONTENT_STORE:
+        description_id = Column("description_id", String(40), ForeignKey("contents.content_id"), nullable=True)
+        # loaded only when the description is asked for
+        description_content = relationship(Content, foreign_keys=[description_id], lazy="select")
+        description = _stored_text("description_content")
+    else:
+        description = Column("description", LONGTEXT(), nullable=True)
     all_positive_review_pct = Column("all_positive_review_pct", BigInteger(), nullable=True)
     total_num_reviews = Column("total_num_reviews", BigInteger(), nullable=True)
     recent_positive_review_pct = Column("recent_positive_review_pct", BigInteger(), nullable=True)
     recent_num_reviews = Column("recent_num_reviews", BigInteger(), nullable=True)
+    # hash of the scraped data the row was built from; lets incremental loads
+    # skip games that haven't changed
+    content_hash = Column("content_hash", String(40), nullable=True)
     
     def __repr__(self):
         return f"Game(appid={self.appid!r}, name={self.name!r})"
@@ -54,7 +107,7 @@ class Company(Base):
     __tablename__ = "companies"
 
     company_id: Mapped[int] = mapped_column(primary_key=True)
-    company: Mapped[str]
+    company: Mapped[exact_str]
     is_developer: Mapped[bool]
     is_publisher: Mapped[bool]
 
@@ -85,7 +138,7 @@ class GameTagEnumeration(Base):
     __tablename__ = "game_tag_enumerations"
 
     game_tag_enumeration_id: Mapped[int] = mapped_column(primary_key=True)
-    tag: Mapped[str]
+    tag: Mapped[exact_str]
 
     def __repr__(self):
         return f"GameTagEnumeration(game_tag_enumeration_id={self.game_tag_enumeration_id!r}, tag={self.tag!r})"
@@ -104,7 +157,7 @@ class FeatureEnumeration(Base):
     __tablename__ = "feature_enumerations"
 
     feature_enumeration_id: Mapped[int] = mapped_column(primary_key=True)
-    feature: Mapped[str]
+    feature: Mapped[exact_str]
 
     def __repr__(self):
         return f"FeatureEnumeration(feature_enumeration_id={self.feature_enumeration_id!r}, feature={self.feature!r})"
@@ -123,7 +176,7 @@ class Author(Base):
     __tablename__ = "authors"
 
     author_id: Mapped[int] = mapped_column(primary_key=True)
-    author: Mapped[str]
+    author: Mapped[exact_str]
 
     def __repr__(self):
         return f"Author(author_id={self.author_id}, author={self.author!r})"
@@ -132,7 +185,7 @@ class Feedlabel(Base):
     __tablename__ = "feedlabels"
 
     feedlabel_id: Mapped[int] = mapped_column(primary_key=True)
-    feedlabel: Mapped[str]
+    feedlabel: Mapped[exact_str]
 
     def __repr__(self):
         return f"Feedlabel(feedlabel_id={self.feedlabel_id}, feedlabel={self.feedlabel!r})"
@@ -141,7 +194,7 @@ class Feedname(Base):
     __tablename__ = "feednames"
 
     feedname_id: Mapped[int] = mapped_column(primary_key=True)
-    feedname: Mapped[str]
+    feedname: Mapped[exact_str]
 
     def __repr__(self):
         return f"Feedname(feedname_id={self.feedname_id}, feedname={self.feedname!r})"
@@ -154,12 +207,19 @@ class Newsitem(Base):
     url: Mapped[str]
     is_external_url: Mapped[bool]
     author_id: Mapped[str] = mapped_column(ForeignKey("authors.author_id"), nullable=True)
-    contents: Mapped[str]
+    if CONTENT_STORE:
+        contents_id = Column("contents_id", String(40), ForeignKey("contents.content_id"), nullable=True)
+        contents_content = relationship(Content, foreign_keys=[contents_id], lazy="select")
+        contents = _stored_text("contents_content")
+    else:
+        contents: Mapped[str]
     feedlabel_id: Mapped[str] = mapped_column(ForeignKey("feedlabels.feedlabel_id"), nullable=True)
     date: Mapped[datetime.date]
     feedname_id: Mapped[str] = mapped_column(ForeignKey("feednames.feedname_id"), nullable=True)
     feed_type: Mapped[int]
     appid: Mapped[int] = mapped_column(ForeignKey("games.appid"))
+    # same as Game.content_hash
+    content_hash = Column("content_hash", String(40), nullable=True)
 
     def __repr__(self) -> str:
         return f"Newsitems(gid={self.gid!r}, title={self.title!r})"
@@ -168,7 +228,7 @@ class NewsitemTagEnumeration(Base):
     __tablename__ = "newsitem_tag_enumerations"
 
     newsitem_tag_enumeration_id: Mapped[int] = mapped_column(primary_key=True)
-    tag: Mapped[str]
+    tag: Mapped[exact_str]
 
     def __repr__(self):
         return f"NewsitemTagEnumeration(newsitem_tag_enumeration_id={self.newsitem_tag_enumeration_id!r}, tag={self.tag!r})"
@@ -183,20 +243,329 @@ class NewsitemTags(Base):
     def __repr__(self):
         return f"NewsitemTags(newsitem_tag_id={self.newsitem_tag_id!r}, gid={self.gid!r}, newsitem_tag_enumeration_id={self.newsitem_tag_enumeration_id!r})"
 
+# the MySQL column types, as SQLite spells them
+@compiles(LONGTEXT, "sqlite")
+def _longtext_sqlite(type_, compiler, **kw):
+    return "TEXT"
+
+@compiles(FLOAT, "sqlite")
+def _float_sqlite(type_, compiler, **kw):
+    return "REAL"
+
+@compiles(LONGBLOB, "sqlite")
+def _longblob_sqlite(type_, compiler, **kw):
+    return "BLOB"
+
+# set on every SQLite connection: WAL so the file can be read while it is
+# being loaded, a 256 MiB page cache, and foreign keys enforced like InnoDB
+SQLITE_PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -262144",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA foreign_keys = ON",
+]
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for statement in SQLITE_PRAGMAS:
+        cursor.execute(statement)
+    cursor.close()
+
+_ENGINES: Dict[str, Engine] = {}
+
 def get_engine(database=DATABASE):
+    """
+    The engine for `database`, created once per process so everything shares
+    one connection pool. With the sqlite backend there is only the one
+    database, in SQLITE_FH.
+    """
+    if DB_BACKEND == "sqlite":
+        url = f"sqlite:///{SQLITE_FH}"
+        if url not in _ENGINES:
+            _ENGINES[url] = create_engine(
+                url,
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_POOL_SIZE,
+                # writers queue up on the file lock rather than fail
+                connect_args={"timeout": 600},
+            )
+            event.listen(_ENGINES[url], "connect", _sqlite_pragmas)
+        return _ENGINES[url]
     url = f"mysql+mysqlconnector://{USER}@{HOST}"
     if database:
-        url += f"/{DATABASE}"
-    return create_engine(url)
+        url += f"/{database}"
+    if url not in _ENGINES:
+        _ENGINES[url] = create_engine(
+            url,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_POOL_SIZE,
+            # long loads can leave connections idle past the server's
+            # wait_timeout; check them before handing them out
+            pool_pre_ping=True,
+            pool_recycle=3600,
+        )
+    return _ENGINES[url]
 
 def get_session(database=DATABASE):
     return Session(get_engine(database=database))
 
-def create_all():
+def create_all(drop=True):
+    """
+    Create the database and its tables. With `drop`, any existing database
+    is thrown away first; without it, only what is missing gets created.
+    """
+    if DB_BACKEND == "sqlite":
+        if drop:
+            get_engine().dispose()
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(SQLITE_FH + suffix):
+                    os.remove(SQLITE_FH + suffix)
+        Base.metadata.create_all(get_engine())
+        return
     engine = get_engine(database=None)
     with engine.connect() as conn:
-        conn.execute(text(f"DROP DATABASE IF EXISTS {DATABASE}"))
-        conn.commit()
-        conn.execute(text(f"CREATE DATABASE {DATABASE}"))
+        if drop:
+            conn.execute(text(f"DROP DATABASE IF EXISTS {DATABASE}"))
+            conn.commit()
+        conn.execute(text(f"CREATE DATABASE IF NOT EXISTS {DATABASE}"))
         conn.commit()
     Base.metadata.create_all(get_engine())
+
+class ConstraintViolation(Exception):
+    pass
+
+# statements that turn constraint checking off for a connection
+CHECKS_OFF = {
+    "mysql": ["SET SESSION foreign_key_checks = 0", "SET SESSION unique_checks = 0"],
+    "sqlite": ["PRAGMA foreign_keys = OFF"],
+}
+_CHECKOUT_LISTENERS = {}
+
+def _run_on_checkout(engine: Engine, name: str, statements: List[str]) -> None:
+    # session settings have to be applied to each pooled connection as it is
+    # handed out; `_stop_on_checkout` undoes this
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        cursor = dbapi_connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
+
+    event.listen(engine, "checkout", on_checkout)
+    _CHECKOUT_LISTENERS[engine, name] = on_checkout
+
+def _stop_on_checkout(engine: Engine, name: str) -> None:
+    event.remove(engine, "checkout", _CHECKOUT_LISTENERS.pop((engine, name)))
+    # the pooled connections still have the settings applied
+    engine.dispose()
+
+def disable_checks(engine: Engine) -> None:
+    """
+    Skip foreign key and unique checks on every connection `engine` hands
+    out until `enable_checks`. Only for bulk loads of data that gets
+    validated afterwards.
+    """
+    _run_on_checkout(engine, "checks_off", CHECKS_OFF[engine.dialect.name])
+
+def enable_checks(engine: Engine) -> None:
+    """
+    Undo `disable_checks` and validate what was loaded in the meantime.
+    """
+    _stop_on_checkout(engine, "checks_off")
+    validate_constraints(engine)
+
+def validate_constraints(engine: Engine) -> None:
+    """
+    Raise ConstraintViolation if any foreign key points at a missing row or
+    any column set with a unique index in INDEX_PLAN has duplicates. Works
+    whether or not the indexes have been built yet.
+    """
+    problems = []
+    with engine.connect() as conn:
+        for table in Base.metadata.sorted_tables:
+            for fk in table.foreign_keys:
+                orphans = conn.execute(
+                    select(func.count())
+                    .select_from(table.outerjoin(fk.column.table, fk.parent == fk.column))
+                    .where(fk.parent.is_not(None), fk.column.is_(None))
+                ).scalar()
+                if orphans:
+                    problems.append(f"{orphans} rows of {fk.parent} point at a missing {fk.column}")
+        for index in INDEX_PLAN:
+            if not index.unique:
+                continue
+            columns = [Base.metadata.tables[index.table].c[column] for column in index.columns]
+            duplicates = conn.execute(
+                select(func.count()).select_from(
+                    select(*columns)
+                    .group_by(*columns)
+                    .having(func.count() > 1)
+                    .subquery()
+                )
+            ).scalar()
+            if duplicates:
+                names = ", ".join(str(column) for column in columns)
+                problems.append(f"{duplicates} values of ({names}) appear more than once")
+    if problems:
+        raise ConstraintViolation("; ".join(problems))
+
+class IndexSpec(NamedTuple):
+    table: str
+    columns: Tuple[str, ...]
+    unique: bool = False
+    fulltext: bool = False
+
+    @property
+    def name(self) -> str:
+        prefix = "ft" if self.fulltext else "ux" if self.unique else "ix"
+        return f"{prefix}_{self.table}_{'_'.join(self.columns)}"
+
+# Secondary indexes. They aren't declared on the models, so that create_all()
+# leaves them out and they get built once, after the bulk load, by
+# create_indexes().
+INDEX_PLAN = [
+    # link tables, from either side
+    IndexSpec("developers", ("appid", "company_id")),
+    IndexSpec("developers", ("company_id", "appid")),
+    IndexSpec("publishers", ("appid", "company_id")),
+    IndexSpec("publishers", ("company_id", "appid")),
+    IndexSpec("game_tags", ("appid", "game_tag_enumeration_id")),
+    IndexSpec("game_tags", ("game_tag_enumeration_id", "appid")),
+    IndexSpec("game_features", ("appid", "feature_enumeration_id")),
+    IndexSpec("game_features", ("feature_enumeration_id", "appid")),
+    IndexSpec("newsitem_tags", ("gid", "newsitem_tag_enumeration_id")),
+    IndexSpec("newsitem_tags", ("newsitem_tag_enumeration_id", "gid")),
+    # an app's news by date
+    IndexSpec("newsitems", ("appid", "date")),
+    # every lookup string appears once
+    IndexSpec("companies", ("company",), unique=True),
+    IndexSpec("game_tag_enumerations", ("tag",), unique=True),
+    IndexSpec("feature_enumerations", ("feature",), unique=True),
+    IndexSpec("authors", ("author",), unique=True),
+    IndexSpec("feedlabels", ("feedlabel",), unique=True),
+    IndexSpec("feednames", ("feedname",), unique=True),
+    IndexSpec("newsitem_tag_enumerations", ("tag",), unique=True),
+]
+# text search; these are big and slow to build, so they're opt-in. Compressed
+# bodies can't be indexed, so with the content store only the titles are.
+FULLTEXT_PLAN = [
+    IndexSpec("newsitems", ("title",) if CONTENT_STORE else ("title", "contents"), fulltext=True),
+]
+if not CONTENT_STORE:
+    FULLTEXT_PLAN.append(IndexSpec("games", ("description",), fulltext=True))
+# MySQL can only index the start of a LONGTEXT; the lookup strings are all
+# much shorter than this
+TEXT_PREFIX_LENGTH = 255
+
+def index_plan(dialect: str, fulltext: bool = False) -> List[IndexSpec]:
+    """
+    INDEX_PLAN, plus FULLTEXT_PLAN with `fulltext`. On SQLite, which unlike
+    InnoDB doesn't index foreign keys by itself, foreign key columns not
+    already leading an index in the plan get one of their own.
+    """
+    plan = INDEX_PLAN + (FULLTEXT_PLAN if fulltext else [])
+    if dialect != "sqlite":
+        return plan
+    leading = {(index.table, index.columns[0]) for index in plan}
+    for table in Base.metadata.sorted_tables:
+        for fk in table.foreign_keys:
+            if (table.name, fk.parent.name) not in leading:
+                plan.append(IndexSpec(table.name, (fk.parent.name,)))
+    return plan
+
+def _index_ddl(engine: Engine, index: IndexSpec) -> List[str]:
+    table = Base.metadata.tables[index.table]
+    if engine.dialect.name == "sqlite":
+        if index.fulltext:
+            # an external content FTS5 table over the rows of `table`; it is
+            # not kept up to date by triggers, create_indexes rebuilds it
+            return [
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {index.name} USING fts5("
+                f"{', '.join(index.columns)}, content='{index.table}')",
+                f"INSERT INTO {index.name}({index.name}) VALUES ('rebuild')",
+            ]
+        unique = "UNIQUE " if index.unique else ""
+        return [
+            f"CREATE {unique}INDEX IF NOT EXISTS {index.name} "
+            f"ON {index.table} ({', '.join(index.columns)})"
+        ]
+    if index.fulltext:
+        return [f"CREATE FULLTEXT INDEX {index.name} ON {index.table} ({', '.join(index.columns)})"]
+    columns = ", ".join(
+        f"{column}({TEXT_PREFIX_LENGTH})"
+        if isinstance(table.c[column].type, LONGTEXT) else column
+        for column in index.columns
+    )
+    unique = "UNIQUE " if index.unique else ""
+    return [f"CREATE {unique}INDEX {index.name} ON {index.table} ({columns})"]
+
+def existing_indexes(engine: Engine) -> Set[str]:
+    with engine.connect() as conn:
+        if engine.dialect.name == "sqlite":
+            query = "SELECT name FROM sqlite_master WHERE type IN ('index', 'table')"
+        else:
+            query = "SELECT index_name FROM information_schema.statistics WHERE table_schema = DATABASE()"
+        return {name for (name,) in conn.execute(text(query))}
+
+def create_indexes(engine: Engine, fulltext: bool = False) -> None:
+    """
+    Build whatever part of the index plan doesn't exist yet. SQLite full
+    text indexes are rebuilt every time.
+    """
+    existing = existing_indexes(engine)
+    for index in index_plan(engine.dialect.name, fulltext):
+        if index.name in existing and not (index.fulltext and engine.dialect.name == "sqlite"):
+            continue
+        start = time.perf_counter()
+        with engine.begin() as conn:
+            for statement in _index_ddl(engine, index):
+                conn.execute(text(statement))
+        print(f"created {index.name} in {time.perf_counter() - start:.1f}s")
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE" if engine.dialect.name == "sqlite" else
+                          f"ANALYZE TABLE {', '.join(Base.metadata.tables)}"))
+
+def drop_indexes(engine: Engine) -> None:
+    """
+    Drop every index in the plan. MySQL won't drop an index a foreign key
+    needs, so there this only works on tables that have another one.
+    """
+    existing = existing_indexes(engine)
+    with engine.begin() as conn:
+        for index in index_plan(engine.dialect.name, fulltext=True):
+            if index.name not in existing:
+                continue
+            if engine.dialect.name == "sqlite":
+                kind = "TABLE" if index.fulltext else "INDEX"
+                conn.execute(text(f"DROP {kind} {index.name}"))
+            else:
+                conn.execute(text(f"DROP INDEX {index.name} ON {index.table}"))
+
+def begin_bulk_load(engine: Engine, incremental: bool = False) -> None:
+    """
+    Tune a SQLite database for loading until `end_bulk_load`: commits stop
+    waiting on fsync. A crash mid-load can then leave the file unusable, so
+    that is only done for full loads, which would be rerun from scratch
+    anyway; an incremental load is into a database that can't be rebuilt,
+    and keeps the usual durability.
+
+    No indexes need dropping here: a full load starts from tables
+    create_all() made without any secondary indexes (the foreign key ones
+    SQLite needs included), and end_bulk_load builds them once at the end;
+    incremental loads keep the ones they already have.
+    """
+    if engine.dialect.name == "sqlite" and not incremental:
+        _run_on_checkout(engine, "bulk_load", ["PRAGMA synchronous = OFF"])
+
+def end_bulk_load(engine: Engine, fulltext: bool = False) -> None:
+    """
+    Undo `begin_bulk_load` and build the secondary indexes, which is much
+    cheaper once than row by row during the load.
+    """
+    if (engine, "bulk_load") in _CHECKOUT_LISTENERS:
+        _stop_on_checkout(engine, "bulk_load")
+    create_indexes(engine, fulltext=fulltext)
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as conn:
+            # fold the write-ahead log back into the database file
+            conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
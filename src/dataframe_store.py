@@ -0,0 +1,203 @@
+"""
+Columnar output for create_dataframes.py, and a reader for it.
+
+Each table is a directory of part files, written a chunk of rows at a time,
+as Parquet (pyarrow or fastparquet) or Feather (pyarrow). Columns get compact
+dtypes, with the repeated strings
+(tags, companies, feed names, ...) stored as categoricals. newsitems is
+partitioned by year, as newsitems/year=2020/part-00000.parquet and so on, so
+readers can skip the years they don't need as well as the columns.
+
+Pickle parts are there for machines without pyarrow, and only written when
+asked for: they aren't columnar, so a reader still loads every column of a
+part to get at the ones it wants, and only the year partitions help.
+"""
+
+import glob
+import importlib.util
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# column dtypes for each table; anything not listed is kept as pandas infers
+# it, except that text becomes the "string" dtype
+TABLE_DTYPES: Dict[str, Dict[str, str]] = {
+    "newsitems": {
+        "gid": "uint64",
+        "title": "string",
+        "url": "string",
+        "is_external_url": "bool",
+        "author": "category",
+        "contents": "string",
+        "feedlabel": "category",
+        "date": "datetime64[s]",
+        "feedname": "category",
+        "feed_type": "uint8",
+        "appid": "uint32",
+    },
+    "newsitem_tags": {"gid": "uint64", "tag": "category"},
+    "details": {
+        "appid": "uint32",
+        "name": "string",
+        "description_snippet": "string",
+        "description": "string",
+        "release_date": "string",
+        "price": "float32",
+        "all_positive_review_pct": "UInt8",
+        "total_num_reviews": "UInt32",
+        "recent_positive_review_pct": "UInt8",
+        "recent_num_reviews": "UInt32",
+    },
+    "developers": {"appid": "uint32", "developer": "category"},
+    "publishers": {"appid": "uint32", "publisher": "category"},
+    "tags": {"appid": "uint32", "tag": "category"},
+    "features": {"appid": "uint32", "feature": "category"},
+}
+# tables split into one directory per value of a column derived from a row
+PARTITIONS = {"newsitems": "year"}
+
+EXTENSIONS = {"parquet": "parquet", "feather": "feather", "pickle": "pkl"}
+
+def missing_dependency(fmt: str) -> Optional[str]:
+    """
+    What has to be installed to write `fmt`, or None if it can be written.
+    """
+    have_pyarrow = importlib.util.find_spec("pyarrow") is not None
+    have_fastparquet = importlib.util.find_spec("fastparquet") is not None
+    if fmt == "parquet" and not (have_pyarrow or have_fastparquet):
+        return "parquet needs pyarrow or fastparquet; install one, or pass --format pickle"
+    if fmt == "feather" and not have_pyarrow:
+        return "feather needs pyarrow; install it, or pass --format pickle"
+    return None
+
+def compact(df: pd.DataFrame, table: str) -> pd.DataFrame:
+    dtypes = TABLE_DTYPES.get(table, {})
+    for column in df.columns:
+        dtype = dtypes.get(column)
+        if dtype is None:
+            if df[column].dtype == object:
+                df[column] = df[column].astype("string")
+        elif dtype.startswith("datetime64"):
+            # news dates are unix timestamps
+            df[column] = pd.to_datetime(df[column], unit="s").astype(dtype)
+        elif dtype in ("uint64", "uint32", "uint8") and df[column].dtype == object:
+            # gids come as strings
+            df[column] = pd.to_numeric(df[column]).astype(dtype)
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+def _write(df: pd.DataFrame, fh: str, fmt: str) -> None:
+    df = df.reset_index(drop=True)
+    if fmt == "parquet":
+        df.to_parquet(fh, index=False)
+    elif fmt == "feather":
+        df.to_feather(fh)
+    else:
+        df.to_pickle(fh)
+
+class ColumnarWriter:
+    """
+    Same interface as create_dataframes.CsvWriter: rows are added one at a
+    time and written out as a new part file every `chunk_rows` rows.
+    """
+    def __init__(
+        self,
+        out_dir: str,
+        table: str,
+        fmt: str,
+        columns: Optional[List[str]] = None,
+        chunk_rows: int = 10000,
+    ):
+        self.dir = os.path.join(out_dir, table)
+        self.table = table
+        self.fmt = fmt
+        self.columns = columns
+        self.chunk_rows = chunk_rows
+        self.rows: List[Dict[str, Any]] = []
+        self.count = 0
+        self.parts = 0
+        # start from a clean directory, old parts would be read back otherwise
+        for fh in glob.glob(os.path.join(self.dir, "**", "part-*"), recursive=True):
+            os.remove(fh)
+        os.makedirs(self.dir, exist_ok=True)
+
+    def add(self, row: Dict[str, Any]) -> None:
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_rows:
+            self.flush()
+
+    def add_frame(self, df: pd.DataFrame) -> None:
+        """
+        Write an already built chunk.
+        """
+        df = compact(df, self.table)
+        partition = PARTITIONS.get(self.table)
+        if partition is None:
+            self._write_part(df, self.dir)
+        else:
+            # only newsitems is partitioned, by the year of its date
+            for value, part in df.groupby(df["date"].dt.year, sort=True):
+                part_dir = os.path.join(self.dir, f"{partition}={value}")
+                os.makedirs(part_dir, exist_ok=True)
+                self._write_part(part, part_dir)
+        self.count += len(df)
+
+    def _write_part(self, df: pd.DataFrame, part_dir: str) -> None:
+        fh = os.path.join(part_dir, f"part-{self.parts:05d}.{EXTENSIONS[self.fmt]}")
+        _write(df, fh, self.fmt)
+        self.parts += 1
+
+    def flush(self) -> None:
+        if not self.rows and self.count:
+            return
+        df = pd.DataFrame(self.rows, columns=self.columns)
+        if self.columns is None:
+            self.columns = list(df.columns)
+        self.rows = []
+        self.add_frame(df[self.columns])
+
+def _concat(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    # every part has its own categories; pd.concat would fall back to object
+    # columns, so merge them first
+    if not frames:
+        return pd.DataFrame()
+    for column in frames[0].columns:
+        if isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+            merged = union_categoricals([frame[column] for frame in frames]).categories
+            frames = [
+                frame.assign(**{column: frame[column].cat.set_categories(merged)})
+                for frame in frames
+            ]
+    return pd.concat(frames, ignore_index=True)
+
+def read_table(
+    out_dir: str,
+    table: str,
+    columns: Optional[List[str]] = None,
+    years: Optional[Iterable[int]] = None,
+) -> pd.DataFrame:
+    """
+    Load `table` from a directory written by ColumnarWriter, reading only
+    `columns` and, for newsitems, only the partitions for `years`.
+    """
+    table_dir = os.path.join(out_dir, table)
+    parts = sorted(glob.glob(os.path.join(table_dir, "**", "part-*"), recursive=True))
+    if years is not None:
+        wanted = {f"year={year}" for year in years}
+        parts = [
+            fh for fh in parts
+            if os.path.basename(os.path.dirname(fh)) in wanted
+        ]
+    frames = []
+    for fh in parts:
+        if fh.endswith(".parquet"):
+            frames.append(pd.read_parquet(fh, columns=columns))
+        elif fh.endswith(".feather"):
+            frames.append(pd.read_feather(fh, columns=columns))
+        else:
+            df = pd.read_pickle(fh)
+            frames.append(df if columns is None else df[columns])
+    return _concat(frames)
@@ -0,0 +1,177 @@
+"""
+Interning caches for the lookup ("dimension") tables.
+
+Each cache maps a string (a company name, tag, author, ...) to its id in one
+lookup table. It is warmed from the table in a single query, so ids stay
+stable across loads; new strings get the next free id and are written out in
+bulk on `flush`. Caches have the same flushing interface as `TableLoader`,
+so they can be flushed alongside the tables that refer to them.
+"""
+
+import sys
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from sqlalchemy import Engine, bindparam, select, update
+
+from bulk_load import TableLoader
+from constants import LOAD_BATCH_SIZE
+from database import (
+    Author,
+    Base,
+    Company,
+    FeatureEnumeration,
+    Feedlabel,
+    Feedname,
+    GameTagEnumeration,
+    NewsitemTagEnumeration,
+)
+
+class DimensionCache:
+    # name of the string column; the id column is the table's primary key
+    value_column: str = ""
+
+    def __init__(
+        self,
+        engine: Engine,
+        model: Type[Base],
+        value_column: Optional[str] = None,
+        batch_size: int = LOAD_BATCH_SIZE,
+    ):
+        self.engine = engine
+        self.model = model
+        self.table = model.__table__
+        if value_column is not None:
+            self.value_column = value_column
+        (self.id_column,) = [column.name for column in self.table.primary_key]
+        self.loader = TableLoader(engine, model, batch_size=batch_size)
+        self.ids: Dict[str, int] = {}
+        self.next_id = 1
+
+    def warm(self) -> "DimensionCache":
+        """
+        Load every existing member of the table.
+        """
+        query = select(self.table.c[self.id_column], self.table.c[self.value_column])
+        with self.engine.connect() as conn:
+            for id_, value in conn.execute(query):
+                self.ids[sys.intern(value)] = id_
+                self.next_id = max(self.next_id, id_ + 1)
+        return self
+
+    def new_row(self, id_: int, value: str) -> Dict[str, Any]:
+        return {self.id_column: id_, self.value_column: value}
+
+    def get_id(self, value: Optional[str]) -> Optional[int]:
+        """
+        The id for `value`, assigning a new one if it hasn't been seen. None
+        has no id.
+        """
+        if value is None:
+            return None
+        id_ = self.ids.get(value)
+        if id_ is None:
+            # lots of rows share a handful of values; keep one copy of each
+            value = sys.intern(value)
+            id_ = self.ids[value] = self.next_id
+            self.next_id += 1
+            self.loader.add(self.new_row(id_, value))
+        return id_
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def full(self) -> bool:
+        return self.loader.full
+
+    def flush(self) -> None:
+        self.loader.flush()
+
+    def flush_tasks(self, shards: int) -> List[Callable[[], None]]:
+        return [self.flush]
+
+    def report(self) -> str:
+        return self.loader.report()
+
+class CompanyCache(DimensionCache):
+    """
+    Companies also carry is_developer / is_publisher flags. They are tracked
+    here as games are parsed, so new companies are inserted with the right
+    flags and existing ones only get an UPDATE when a flag flips on.
+    """
+    value_column = "company"
+
+    def __init__(self, engine: Engine, batch_size: int = LOAD_BATCH_SIZE):
+        super().__init__(engine, Company, batch_size=batch_size)
+        # company_id -> [is_developer, is_publisher]
+        self.flags: Dict[int, List[bool]] = {}
+        self.stored_flags: Dict[int, Tuple[bool, bool]] = {}
+
+    def warm(self) -> "CompanyCache":
+        query = select(
+            Company.company_id,
+            Company.company,
+            Company.is_developer,
+            Company.is_publisher,
+        )
+        with self.engine.connect() as conn:
+            for id_, value, is_developer, is_publisher in conn.execute(query):
+                self.ids[sys.intern(value)] = id_
+                self.next_id = max(self.next_id, id_ + 1)
+                self.flags[id_] = [bool(is_developer), bool(is_publisher)]
+                self.stored_flags[id_] = (bool(is_developer), bool(is_publisher))
+        return self
+
+    def new_row(self, id_: int, value: str) -> Dict[str, Any]:
+        # the flags are filled in when the row is flushed
+        self.flags[id_] = [False, False]
+        return {"company_id": id_, "company": value}
+
+    def developer(self, value: str) -> Optional[int]:
+        id_ = self.get_id(value)
+        if id_ is not None:
+            self.flags[id_][0] = True
+        return id_
+
+    def publisher(self, value: str) -> Optional[int]:
+        id_ = self.get_id(value)
+        if id_ is not None:
+            self.flags[id_][1] = True
+        return id_
+
+    def flush(self) -> None:
+        for row in self.loader.rows:
+            row["is_developer"], row["is_publisher"] = self.flags[row["company_id"]]
+            self.stored_flags[row["company_id"]] = (row["is_developer"], row["is_publisher"])
+        self.loader.flush()
+        changed = [
+            {"id_": id_, "dev": flags[0], "pub": flags[1]}
+            for id_, flags in self.flags.items()
+            if id_ in self.stored_flags and self.stored_flags[id_] != tuple(flags)
+        ]
+        if not changed:
+            return
+        statement = (
+            update(Company.__table__)
+            .where(Company.__table__.c.company_id == bindparam("id_"))
+            .values(is_developer=bindparam("dev"), is_publisher=bindparam("pub"))
+        )
+        with self.engine.begin() as conn:
+            conn.execute(statement, changed)
+        for row in changed:
+            self.stored_flags[row["id_"]] = (row["dev"], row["pub"])
+
+def dimension_caches(engine: Engine) -> Dict[str, DimensionCache]:
+    """
+    A warmed cache for every lookup table, keyed by table name.
+    """
+    caches = [
+        CompanyCache(engine),
+        DimensionCache(engine, GameTagEnumeration, "tag"),
+        DimensionCache(engine, FeatureEnumeration, "feature"),
+        DimensionCache(engine, Author, "author"),
+        DimensionCache(engine, Feedlabel, "feedlabel"),
+        DimensionCache(engine, Feedname, "feedname"),
+        DimensionCache(engine, NewsitemTagEnumeration, "tag"),
+    ]
+    return {cache.table.name: cache.warm() for cache in caches}
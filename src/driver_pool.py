@@ -0,0 +1,79 @@
+"""
+A pool of long-lived headless Chrome instances for scraping store pages.
+
+Starting Chrome costs more than loading a page, so drivers are handed out to
+worker threads and put back when the page is done. A driver is quit and
+replaced after `max_pages` pages, or as soon as anything goes wrong while it
+is checked out, since a crashed or wedged browser can't be trusted again.
+"""
+
+from contextlib import contextmanager
+from queue import Queue
+from typing import Iterator, Optional, Tuple
+
+from selenium import webdriver
+
+from constants import PAGES_PER_DRIVER, SCRAPE_WORKERS
+
+def new_driver() -> webdriver.Chrome:
+    options = webdriver.ChromeOptions()
+    options.add_argument("--log-level=3")
+    options.add_argument("--ignore-certificate-errors")
+    options.add_argument("--incognito")
+    options.add_argument("--headless")
+    return webdriver.Chrome(options)
+
+def _quit(driver: webdriver.Chrome) -> None:
+    try:
+        driver.quit()
+    except Exception:
+        # the browser may already be gone if it crashed
+        pass
+
+class DriverPool:
+    def __init__(
+        self,
+        size: int = SCRAPE_WORKERS,
+        max_pages: int = PAGES_PER_DRIVER,
+    ):
+        self.size = size
+        self.max_pages = max_pages
+        # slots hold (driver, pages loaded); drivers are started lazily, so an
+        # empty slot is (None, 0)
+        self._slots: Queue[Tuple[Optional[webdriver.Chrome], int]] = Queue()
+        for _ in range(size):
+            self._slots.put((None, 0))
+
+    @contextmanager
+    def driver(self) -> Iterator[webdriver.Chrome]:
+        """
+        Check out a driver, blocking until one is free.
+        """
+        driver, pages = self._slots.get()
+        try:
+            if driver is None:
+                driver, pages = new_driver(), 0
+            yield driver
+        except BaseException:
+            if driver is not None:
+                _quit(driver)
+            self._slots.put((None, 0))
+            raise
+        pages += 1
+        if pages >= self.max_pages:
+            _quit(driver)
+            self._slots.put((None, 0))
+        else:
+            self._slots.put((driver, pages))
+
+    def close(self) -> None:
+        for _ in range(self.size):
+            driver, _ = self._slots.get()
+            if driver is not None:
+                _quit(driver)
+
+    def __enter__(self) -> "DriverPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
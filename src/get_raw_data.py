@@ -1,65 +1,106 @@
-
+import argparse
 import json
 import os
-import requests
 from tqdm import tqdm
+from typing import Any, Dict, List, Optional, Tuple
 
-from constants import DATA_DIR
+from concurrent_fetch import fetch_json
+from constants import API_BASE, DATA_DIR
+from http_client import SteamClient
+import metrics
+import profiling
+from raw_store import newest, RawStore
 
-API_BASE = "https://api.steampowered.com"
+# each endpoint can be fetched on its own, e.g. news and achievements in
+# separate processes once the applist exists
+ENDPOINTS = ["applist", "news", "achievements"]
 
-if not os.path.exists(DATA_DIR):
-  os.makedirs(DATA_DIR)
+# shared by both of the per-app loops below so connections are kept alive and
+# both are held to the same rate limit
+CLIENT = SteamClient()
 
-# Gets the complete list of public apps.
-# List[Dict[str, Union[str, int]]]
-# keys:
-#   appid: int
-#   name: str
-fh = os.path.join(DATA_DIR, "applist.json")
-if not os.path.exists(fh):
-    print("Using API to get applist")
-    applist = requests.get(
-        f"{API_BASE}/ISteamApps/GetAppList/v2/",
-    ).json()["applist"]["apps"]
-    with open(fh, "w") as f:
-        f.write(json.dumps(applist))
-else:
-    print(f"Found {fh}")
-    with open(fh, "r") as f:
-        applist = json.loads(f.read())
+def get_applist(update: bool = False) -> List[Dict[str, Any]]:
+    # Gets the complete list of public apps.
+    # List[Dict[str, Union[str, int]]]
+    # keys:
+    #   appid: int
+    #   name: str
+    fh = os.path.join(DATA_DIR, "applist.json")
+    if update or not os.path.exists(fh):
+        print("Using API to get applist")
+        applist = CLIENT.get_json(
+            f"{API_BASE}/ISteamApps/GetAppList/v2/",
+        )["applist"]["apps"]
+        with open(fh, "w") as f:
+            f.write(json.dumps(applist))
+    else:
+        print(f"Found {fh}")
+        with open(fh, "r") as f:
+            applist = json.loads(f.read())
+    return applist
 
-# need to iterate over appid
-# appnews is a dict with
-#   appid: int
-#   count: int
-#   newsitems: Dict[List[str, Any]]
-fh = os.path.join(DATA_DIR, "newsitems.json")
-if os.path.exists(fh):
-    print(f"Found {fh}")
-    with open(fh, "r") as f:
-        all_newsitems = json.loads(f.read())
-else:
-    all_newsitems = []
-    max_idx = -1
-    for name in os.listdir(DATA_DIR):
-        if not name.startswith("appnews_"):
-            continue
-        with open(os.path.join(DATA_DIR, name), "r") as f:
-            all_newsitems.append(json.loads(f.read()))
+def import_legacy_shards(
+    store: RawStore,
+    applist: List[Dict[str, Any]],
+    endpoint: str,
+    prefix: str,
+) -> None:
+    # responses used to be written to one {prefix}{idx}.json file per app
+    names = [name for name in os.listdir(DATA_DIR) if name.startswith(prefix)]
+    if not names:
+        return
+    print(f"Importing {len(names)} {prefix}*.json files into {store.path}")
+    for name in tqdm(names):
         idx = int(name.split("_", 1)[1].rsplit(".", 1)[0])
-        max_idx = max(max_idx, idx)
-    print(f"Starting from idx {max_idx}")
-    for idx in tqdm(range(max_idx + 1, len(applist))):
+        with open(os.path.join(DATA_DIR, name), "r") as f:
+            s = f.read()
         try:
-            appid = applist[idx]["appid"]
+            value = json.loads(s)
         except Exception as e:
-            continue
-        appnews = requests.get(
-            f"{API_BASE}/ISteamNews/GetNewsForApp/v2/",
-            params={"appid": appid},
-        ).json()
+            # partially written before a crash; it will be fetched again
+            value = None
+        if value is not None:
+            store.put(endpoint, applist[idx]["appid"], idx, value)
+    store.commit()
+    for name in names:
+        os.remove(os.path.join(DATA_DIR, name))
+
+def missing_jobs(
+    store: RawStore,
+    applist: List[Dict[str, Any]],
+    endpoint: str,
+    param: str,
+) -> List[Tuple[int, Dict[str, int]]]:
+    fetched = store.fetched_appids(endpoint)
+    return [
+        (idx, {param: app["appid"]})
+        for idx, app in enumerate(applist)
+        if "appid" in app and app["appid"] not in fetched
+    ]
+
+def get_news(store: RawStore, applist: List[Dict[str, Any]], update: bool = False) -> None:
+    # need to iterate over appid
+    # appnews is a dict with
+    #   appid: int
+    #   count: int
+    #   newsitems: Dict[List[str, Any]]
+    # with update, whatever isn't stored yet is fetched and the file is
+    # written again from the store
+    fh = os.path.join(DATA_DIR, "newsitems.json")
+    if os.path.exists(fh) and not update:
+        print(f"Found {fh}")
+        return
+    import_legacy_shards(store, applist, "news", "appnews_")
+    jobs = missing_jobs(store, applist, "news", "appid")
+    print(f"{len(jobs)} apps left to fetch news for")
+    for idx, appnews in tqdm(
+        fetch_json(f"{API_BASE}/ISteamNews/GetNewsForApp/v2/", jobs, client=CLIENT),
+        total=len(jobs),
+    ):
+        appid = applist[idx]["appid"]
         if not "appnews" in appnews:
+            metrics.counter("steam_skipped_total", "Apps without data", reason="no_appnews").inc()
+            store.put("news", appid, idx, None)
             continue
         appnews = appnews['appnews']
         # newsitems is a dict with the keys
@@ -75,60 +116,79 @@ else:
         #   feed_type: int
         #   appid: int
         #   tags: List[str]
-        newsitems = appnews["newsitems"]
-        with open(os.path.join(DATA_DIR, f"appnews_{idx}.json"), "w") as f:
-            f.write(json.dumps(newsitems))
-        all_newsitems.append(newsitems)
-    with open(fh, "w") as f:
-        f.write(json.dumps(all_newsitems))
+        store.put("news", appid, idx, appnews["newsitems"])
+        # where refresh_news.py picks up from
+        mark = newest(appnews["newsitems"])
+        if mark is not None:
+            store.set_high_water_mark("news", appid, *mark)
+    store.commit()
+    store.export_json("news", fh)
 
-for name in os.listdir(DATA_DIR):
-    if name.startswith("appnews_"):
-        os.remove(os.path.join(DATA_DIR, name))
-
-# List[Dict[str, str]]
-#   name: str
-#   percent: str (ex: '24.2')
-fh = os.path.join(DATA_DIR, "achievements.json")
-if os.path.exists(fh):
-    print(f"Found {fh}")
-    with open(fh, "r") as f:
-        all_achievements = json.loads(f.read())
-else:
-    all_achievements = []
-    max_idx = -1
-    for name in os.listdir(DATA_DIR):
-        if not name.startswith("achievements_"):
-            continue
-        with open(os.path.join(DATA_DIR, name), "r") as f:
-            s = f.read()
-        try:
-            value = json.loads(s)
-        except Exception as e:
-            os.remove(os.path.join(DATA_DIR, name))
-            continue
-        all_achievements.append(value)
-        idx = int(name.split("_", 1)[1].rsplit(".", 1)[0])
-        max_idx = max(max_idx, idx)
-    print(f"Starting from idx {max_idx}")
-    for idx in tqdm(range(max_idx + 1, len(applist))):
-        try:
-            appid = applist[idx]["appid"]
-        except Exception as e:
-            continue
-        achievements = requests.get(
+def get_achievements(store: RawStore, applist: List[Dict[str, Any]], update: bool = False) -> None:
+    # List[Dict[str, str]]
+    #   name: str
+    #   percent: str (ex: '24.2')
+    fh = os.path.join(DATA_DIR, "achievements.json")
+    if os.path.exists(fh) and not update:
+        print(f"Found {fh}")
+        return
+    import_legacy_shards(store, applist, "achievements", "achievements_")
+    jobs = missing_jobs(store, applist, "achievements", "gameid")
+    print(f"{len(jobs)} apps left to fetch achievements for")
+    for idx, achievements in tqdm(
+        fetch_json(
             f"{API_BASE}/ISteamUserStats/GetGlobalAchievementPercentagesForApp/v2/",
-            params={"gameid": appid},
-        ).json()
+            jobs,
+            client=CLIENT,
+        ),
+        total=len(jobs),
+    ):
+        appid = applist[idx]["appid"]
         if not "achievementpercentages" in achievements:
+            metrics.counter("steam_skipped_total", "Apps without data", reason="no_achievements").inc()
+            store.put("achievements", appid, idx, None)
             continue
         achievements = achievements['achievementpercentages']['achievements']
-        with open(os.path.join(DATA_DIR, f"achievements_{idx}.json"), "w") as f:
-            f.write(json.dumps(achievements))
-        all_achievements.append(achievements)
-    with open(os.path.join(DATA_DIR, "achievements.json"), "w") as f:
-        f.write(json.dumps(all_achievements))
+        store.put("achievements", appid, idx, achievements)
+    store.commit()
+    store.export_json("achievements", fh)
 
-for name in os.listdir(DATA_DIR):
-    if name.startswith("achievements_"):
-        os.remove(os.path.join(DATA_DIR, name))
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Fetch the raw data from the Steamworks API.")
+    parser.add_argument(
+        "--only",
+        dest="endpoints",
+        action="append",
+        choices=ENDPOINTS,
+        help="fetch just this (can be repeated); everything by default",
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="fetch the applist again, fetch whatever isn't stored yet and "
+        "rewrite the output files even if they exist",
+    )
+    profiling.add_arguments(parser, memory_budget=False)
+    args = parser.parse_args(argv)
+    endpoints = args.endpoints or ENDPOINTS
+    # the pipeline fetches news and achievements in separate processes
+    stage = "_".join(["get_raw_data", *(args.endpoints or [])])
+    metrics.start(stage)
+    profiling.start(stage, args.profile)
+
+    if not os.path.exists(DATA_DIR):
+        os.makedirs(DATA_DIR)
+    # only the applist stage asks for a fresh applist; the others fetch for
+    # the one it wrote
+    applist = get_applist(args.update and "applist" in endpoints)
+    # closing commits, so whatever was fetched before an error is kept and
+    # isn't fetched again on the next run
+    with RawStore() as store:
+        if "news" in endpoints:
+            get_news(store, applist, args.update)
+        if "achievements" in endpoints:
+            get_achievements(store, applist, args.update)
+    print(f"requests: {CLIENT.summary()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Compressed, content-addressed cache of every store page the scraper fetched.
+
+Page bodies are compressed (see blob_codec.py) and appended to a single
+pack file. A SQLite index maps content hashes to their spot in the pack, and
+records every (appid, fetch time) pair with the hash of what was fetched, so
+identical pages are only stored once. Readers memory-map the pack file.
+"""
+
+import hashlib
+import mmap
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterator, Optional, Tuple
+
+from blob_codec import compress, decompress
+from constants import DATA_DIR
+
+HTML_CACHE_DIR = os.path.join(DATA_DIR, "html_cache")
+
+# (appid, fetched_at, offset, length, codec) of one cached page
+CacheEntry = Tuple[int, float, int, int, str]
+
+class HtmlCache:
+    def __init__(self, path: str = HTML_CACHE_DIR):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.pack_fh = os.path.join(path, "pages.pack")
+        self._lock = threading.Lock()
+        self._pack = open(self.pack_fh, "ab")
+        self._mmap: Optional[mmap.mmap] = None
+        self._mmap_size = 0
+        # written to from the scraper's fetch threads, hence the lock and
+        # check_same_thread=False
+        self.conn = sqlite3.connect(
+            os.path.join(path, "index.sqlite"), check_same_thread=False
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                codec TEXT NOT NULL,
+                raw_length INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS fetches (
+                appid INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                hash TEXT NOT NULL REFERENCES blobs (hash),
+                PRIMARY KEY (appid, fetched_at)
+            );
+            """
+        )
+        self.conn.commit()
+
+    def put(self, appid: int, html: str, fetched_at: Optional[float] = None) -> str:
+        """
+        Cache one fetched page and return its content hash.
+        """
+        if fetched_at is None:
+            fetched_at = time.time()
+        raw = html.encode("utf-8")
+        digest = hashlib.sha256(raw).hexdigest()
+        with self._lock:
+            known = self.conn.execute(
+                "SELECT 1 FROM blobs WHERE hash = ?", (digest,)
+            ).fetchone()
+            if known is None:
+                data, codec = compress(raw)
+                offset = self._pack.tell()
+                self._pack.write(data)
+                # the blob has to be on disk before the index points at it
+                self._pack.flush()
+                self.conn.execute(
+                    "INSERT INTO blobs (hash, offset, length, codec, raw_length) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (digest, offset, len(data), codec, len(raw)),
+                )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO fetches (appid, fetched_at, hash) "
+                "VALUES (?, ?, ?)",
+                (appid, fetched_at, digest),
+            )
+            self.conn.commit()
+        return digest
+
+    def latest(self) -> Iterator[CacheEntry]:
+        """
+        The most recent fetch of every cached appid, in appid order.
+        """
+        # fetched all at once, since the connection is shared with the
+        # writers and can't be held for as long as the caller iterates
+        with self._lock:
+            rows = self.conn.execute(
+            """
+            SELECT f.appid, f.fetched_at, b.offset, b.length, b.codec
+            FROM fetches f
+            JOIN blobs b ON b.hash = f.hash
+            WHERE f.fetched_at = (
+                SELECT MAX(fetched_at) FROM fetches WHERE appid = f.appid
+            )
+            ORDER BY f.appid
+            """
+            ).fetchall()
+        yield from rows
+
+    def read(self, offset: int, length: int, codec: str) -> str:
+        return read_blob(self.pack_fh, offset, length, codec, self)
+
+    def get(self, appid: int) -> Optional[str]:
+        """
+        The page source from the most recent fetch of `appid`, if cached.
+        """
+        with self._lock:
+            row = self.conn.execute(
+                """
+                SELECT b.offset, b.length, b.codec
+                FROM fetches f
+                JOIN blobs b ON b.hash = f.hash
+                WHERE f.appid = ?
+                ORDER BY f.fetched_at DESC
+                LIMIT 1
+                """,
+                (appid,),
+            ).fetchone()
+        # read takes the lock itself
+        if row is None:
+            return None
+        return self.read(*row)
+
+    def stats(self) -> Tuple[int, int, int, int]:
+        """
+        (fetches, distinct pages, uncompressed bytes, compressed bytes)
+        """
+        with self._lock:
+            fetches = self.conn.execute("SELECT COUNT(*) FROM fetches").fetchone()[0]
+            pages, raw, stored = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(raw_length), 0), COALESCE(SUM(length), 0) "
+                "FROM blobs"
+            ).fetchone()
+        return fetches, pages, raw, stored
+
+    def _view(self, end: int) -> mmap.mmap:
+        # the pack only ever grows, so the map is redone when a read goes
+        # past the end of the current one
+        if self._mmap is None or end > self._mmap_size:
+            if self._mmap is not None:
+                self._mmap.close()
+            self._pack.flush()
+            with open(self.pack_fh, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mmap_size = len(self._mmap)
+        return self._mmap
+
+    def close(self) -> None:
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+            self._pack.close()
+            self.conn.close()
+
+    def __enter__(self) -> "HtmlCache":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+# read only views of pack files, one per process
+_views = {}
+
+def read_blob(
+    pack_fh: str,
+    offset: int,
+    length: int,
+    codec: str,
+    cache: Optional[HtmlCache] = None,
+) -> str:
+    """
+    Decompress one page from `pack_fh`. Safe to call from worker processes,
+    which map the pack file once and reuse it.
+    """
+    if cache is not None:
+        with cache._lock:
+            data = cache._view(offset + length)[offset:offset + length]
+    else:
+        view = _views.get(pack_fh)
+        if view is None or offset + length > len(view):
+            # the pack file grew since it was mapped; map it again, and let
+            # go of the old map rather than keeping one per size it had
+            if view is not None:
+                view.close()
+            with open(pack_fh, "rb") as f:
+                view = _views[pack_fh] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = view[offset:offset + length]
+    return decompress(data, codec).decode("utf-8")
@@ -0,0 +1,380 @@
+"""
+The one place outbound requests to Steam go through.
+
+Every host gets its own token bucket and circuit breaker:
+- the bucket starts at `initial_rate` requests/sec, creeps up towards
+  `max_rate` while requests succeed, halves on every 429, and stops handing
+  out tokens until a `Retry-After` has passed
+- the breaker opens after `failure_threshold` failed attempts in a row (429s
+  don't count, they only slow the bucket down); while
+  it is open callers wait instead of hammering the host, then a single trial
+  request decides whether it closes again
+
+Failed attempts (connection errors, timeouts, 429s and 5xx) are retried
+with exponential backoff and full jitter. Other client errors and bodies
+that aren't JSON are the final answer for that request, and raise
+PermanentError straight away. Counters of what happened are kept in
+`SteamClient.stats`.
+"""
+
+from collections import Counter
+import random
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from constants import CONCURRENCY, MAX_RATE, MAX_RETRIES
+import metrics
+
+# statuses worth trying again; anything else is the final answer
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class RetryableStatus(Exception):
+    def __init__(self, response: requests.Response):
+        super().__init__(f"HTTP {response.status_code} from {response.url}")
+        self.response = response
+
+class RetriesExceeded(Exception):
+    pass
+
+class PermanentError(Exception):
+    """
+    A request that trying again won't fix, e.g. a 403 or a body that isn't
+    JSON. `status` is the HTTP status, if that was the problem.
+    """
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+def endpoint(url: str) -> str:
+    """
+    The path of `url` with ids taken out, e.g. /app/{id}, for metric labels.
+    """
+    return re.sub(r"/\d+", "/{id}", urlsplit(url).path) or "/"
+
+def make_session(pool_size: int = CONCURRENCY) -> requests.Session:
+    # the default adapter only keeps 10 connections per host around, which
+    # would force most of the workers to reconnect on every request
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def retry_after(response: requests.Response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        # the HTTP-date form; not worth parsing, back off a while instead
+        return 60.0
+
+class TokenBucket:
+    def __init__(
+        self,
+        initial_rate: float,
+        max_rate: float,
+        min_rate: float = 0.2,
+        increase: float = 0.1,
+    ):
+        self.rate = initial_rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Block until a request may be made; returns the seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                # never bank more than a second's worth of requests
+                self.tokens = min(
+                    max(self.rate, 1.0),
+                    self.tokens + (now - self.updated) * self.rate,
+                )
+                self.updated = now
+                if now >= self.blocked_until and self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return waited
+                delay = max(self.blocked_until - now, (1.0 - self.tokens) / self.rate)
+            time.sleep(delay)
+            waited += delay
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttled(self, retry_after: Optional[float]) -> None:
+        with self._lock:
+            now = time.monotonic()
+            # requests already in flight tend to get throttled together; that
+            # is one signal to slow down, not one per request
+            if now - self.last_decrease >= 1.0:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.last_decrease = now
+            self.tokens = 0.0
+            if retry_after is not None:
+                self.blocked_until = max(
+                    self.blocked_until, now + retry_after
+                )
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 10, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self._cond = threading.Condition()
+
+    def wait(self) -> Tuple[float, bool]:
+        """
+        Block while the breaker is open. Once `reset_timeout` has passed one
+        caller at a time is let through as a trial. Returns the seconds spent
+        waiting, and whether the caller is the trial; only the trial's
+        outcome decides whether a breaker that isn't closed closes again.
+        """
+        start = time.monotonic()
+        with self._cond:
+            while True:
+                if self.state == "closed":
+                    break
+                if self.state == "open":
+                    remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                    if remaining > 0:
+                        self._cond.wait(remaining)
+                        continue
+                    self.state = "half_open"
+                if not self.trial_in_flight:
+                    self.trial_in_flight = True
+                    return time.monotonic() - start, True
+                self._cond.wait()
+        return time.monotonic() - start, False
+
+    def on_success(self, trial: bool = False) -> None:
+        with self._cond:
+            if self.state != "closed" and not trial:
+                # a request let through before the breaker opened; the
+                # trial decides
+                return
+            self.failures = 0
+            self.state = "closed"
+            if trial:
+                self.trial_in_flight = False
+            self._cond.notify_all()
+
+    def on_failure(self, trial: bool = False) -> bool:
+        """
+        Record a failed attempt; returns True if that opened the breaker.
+        """
+        with self._cond:
+            self.failures += 1
+            opened = False
+            if trial or (self.state == "closed" and self.failures >= self.failure_threshold):
+                opened = True
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            if trial:
+                self.trial_in_flight = False
+            self._cond.notify_all()
+            return opened
+
+    def release(self, trial: bool) -> None:
+        """
+        Give up a trial that ended without an answer either way, so the next
+        caller gets to try.
+        """
+        if not trial:
+            return
+        with self._cond:
+            self.trial_in_flight = False
+            self._cond.notify_all()
+
+class SteamClient:
+    def __init__(
+        self,
+        pool_size: int = CONCURRENCY,
+        initial_rate: float = 10.0,
+        max_rate: float = MAX_RATE,
+        max_retries: int = MAX_RETRIES,
+        backoff_base: float = 1.0,
+        backoff_max: float = 120.0,
+        timeout: float = 30.0,
+    ):
+        self.session = make_session(pool_size)
+        self.initial_rate = initial_rate
+        self.max_rate = max_rate
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        self._hosts: Dict[str, Tuple[TokenBucket, CircuitBreaker]] = {}
+        self._hosts_lock = threading.Lock()
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self._stats_lock:
+            self.stats[name] += value
+        metrics.counter(
+            "steam_client_events_total",
+            "Requests, retries, throttling and breaker trips, and seconds spent waiting",
+            event=name,
+        ).inc(value)
+
+    def summary(self) -> str:
+        with self._stats_lock:
+            return ", ".join(f"{name}={value:g}" for name, value in sorted(self.stats.items()))
+
+    def host(self, host: str) -> Tuple[TokenBucket, CircuitBreaker]:
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = (
+                    TokenBucket(self.initial_rate, self.max_rate),
+                    CircuitBreaker(),
+                )
+            return self._hosts[host]
+
+    def call(
+        self,
+        host: str,
+        fn: Callable[..., Any],
+        *args,
+        retry_on: Tuple[Type[BaseException], ...] = (),
+        **kwargs,
+    ) -> Any:
+        """
+        Run `fn(*args, **kwargs)` as one request to `host`: rate limited,
+        guarded by the host's circuit breaker, and retried when it raises one
+        of `retry_on` (or a RetryableStatus).
+        """
+        bucket, breaker = self.host(host)
+        retry_on = retry_on + (RetryableStatus,)
+        for attempt in range(self.max_retries + 1):
+            waited, trial = breaker.wait()
+            if waited > 0.001:
+                self.count("breaker_wait_seconds", waited)
+            waited = bucket.acquire()
+            if waited > 0.001:
+                self.count("throttle_wait_seconds", waited)
+            self.count("requests")
+            try:
+                result = fn(*args, **kwargs)
+            except retry_on as e:
+                delay = self.backoff(attempt)
+                if isinstance(e, RetryableStatus) and e.response.status_code == 429:
+                    # throttling is the bucket's job; the host itself is fine
+                    self.count("throttled")
+                    wait = retry_after(e.response)
+                    bucket.on_throttled(wait)
+                    breaker.on_success(trial)
+                    if wait is not None:
+                        # the bucket already holds everyone back until then
+                        delay = 0.0
+                else:
+                    self.count("failures")
+                    if breaker.on_failure(trial):
+                        self.count("breaker_opened")
+                if attempt == self.max_retries:
+                    raise RetriesExceeded(
+                        f"gave up on {host} after {attempt + 1} tries: {e}"
+                    ) from e
+                self.count("retries")
+                time.sleep(delay)
+            except Exception:
+                # not something retrying fixes, but the host did answer
+                breaker.on_success(trial)
+                raise
+            except BaseException:
+                # e.g. KeyboardInterrupt; says nothing about the host
+                breaker.release(trial)
+                raise
+            else:
+                bucket.on_success()
+                breaker.on_success(trial)
+                return result
+
+    def backoff(self, attempt: int) -> float:
+        # "full jitter": anywhere between no wait and the exponential cap
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _get(self, url: str, params: Optional[Dict[str, Any]], **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        labels = {"host": urlsplit(url).netloc, "endpoint": endpoint(url)}
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, params=params, **kwargs)
+        except requests.RequestException as e:
+            metrics.counter(
+                "steam_request_errors_total",
+                "Requests that got no response at all",
+                error=type(e).__name__,
+                **labels,
+            ).inc()
+            raise
+        metrics.histogram(
+            "steam_request_seconds", "Time until the whole response was read", **labels,
+        ).observe(time.perf_counter() - start)
+        metrics.counter(
+            "steam_responses_total", "Responses by status", status=response.status_code, **labels,
+        ).inc()
+        metrics.counter(
+            "steam_response_bytes_total", "Size of the response bodies", **labels,
+        ).inc(len(response.content))
+        if response.status_code in RETRY_STATUSES:
+            raise RetryableStatus(response)
+        return response
+
+    def get(self, url: str, params: Optional[Dict[str, Any]] = None, **kwargs) -> requests.Response:
+        return self.call(
+            urlsplit(url).netloc,
+            self._get,
+            url,
+            params,
+            retry_on=(requests.ConnectionError, requests.Timeout),
+            **kwargs,
+        )
+
+    def _get_json(self, url: str, params: Optional[Dict[str, Any]], **kwargs) -> Any:
+        response = self._get(url, params, **kwargs)
+        if response.status_code >= 400:
+            # e.g. a 403 for an app that has no stats; nothing to retry
+            self.count(f"http_{response.status_code}")
+            raise PermanentError(
+                f"HTTP {response.status_code} from {response.url}", response.status_code,
+            )
+        try:
+            return response.json()
+        except ValueError as e:
+            self.count("not_json")
+            raise PermanentError(f"{response.url} didn't return JSON: {e}") from e
+
+    def get_json(self, url: str, params: Optional[Dict[str, Any]] = None, **kwargs) -> Any:
+        """
+        GET `url` and parse the response as JSON. Statuses that aren't
+        retried and bodies that aren't JSON raise PermanentError.
+        """
+        return self.call(
+            urlsplit(url).netloc,
+            self._get_json,
+            url,
+            params,
+            retry_on=(requests.ConnectionError, requests.Timeout),
+            **kwargs,
+        )
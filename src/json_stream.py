@@ -0,0 +1,113 @@
+"""
+Streaming readers for the collected data files.
+
+applist.json, gamedetails.json and newsitems.json are each one big JSON list,
+and newsitems.json in particular holds the full body of every article. Rather
+than `json.loads` a whole file, the readers here decode one element of the
+top-level list at a time from a small sliding buffer, so memory use depends on
+the largest single element instead of the size of the file. JSON lines files
+(one element per line) are read as well.
+"""
+
+from itertools import islice
+import json
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from constants import DATA_DIR
+
+CHUNK_SIZE = 1 << 16
+_DECODER = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+def iter_json_array(fh: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """
+    Yield the elements of the JSON list in `fh` one at a time.
+    """
+    with open(fh, "r", encoding="utf-8") as f:
+        buf = f.read(chunk_size).lstrip(_WHITESPACE)
+        if not buf.startswith("["):
+            raise ValueError(f"{fh} does not contain a JSON list")
+        pos = 1
+        eof = False
+        expect_comma = False
+        while True:
+            # skip to the start of the next element
+            while True:
+                while pos < len(buf) and buf[pos] in _WHITESPACE:
+                    pos += 1
+                if pos < len(buf) or eof:
+                    break
+                buf, pos = f.read(chunk_size), 0
+                eof = not buf
+            if pos == len(buf):
+                raise ValueError(f"{fh} ends in the middle of a JSON list")
+            if buf[pos] == "]":
+                return
+            if expect_comma:
+                if buf[pos] != ",":
+                    raise ValueError(f"expected ',' in {fh}, got {buf[pos]!r}")
+                pos += 1
+                expect_comma = False
+                continue
+            try:
+                value, end = _DECODER.raw_decode(buf, pos)
+                # a number cut off by the end of the buffer still decodes
+                # ("1.5e3" read as far as "1."), so only trust what is followed
+                # by the end of the element
+                complete = eof or (end < len(buf) and buf[end] in _WHITESPACE + ",]")
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+            if not complete:
+                # read at least as much again as is buffered, so an element
+                # that spans many chunks isn't decoded over and over
+                more = f.read(max(chunk_size, len(buf) - pos))
+                eof = not more
+                buf, pos = buf[pos:] + more, 0
+                continue
+            yield value
+            pos = end
+            expect_comma = True
+            if pos > chunk_size:
+                buf, pos = buf[pos:], 0
+
+def iter_jsonl(fh: str) -> Iterator[Any]:
+    with open(fh, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def iter_records(fh: str) -> Iterator[Any]:
+    """
+    Yield the records in `fh`, either a JSON list or, for .jsonl files, one
+    JSON value per line.
+    """
+    if fh.endswith(".jsonl"):
+        return iter_jsonl(fh)
+    return iter_json_array(fh)
+
+def iter_apps(fh: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    return iter_records(fh or os.path.join(DATA_DIR, "applist.json"))
+
+def iter_gamedetails(fh: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    return iter_records(fh or os.path.join(DATA_DIR, "gamedetails.json"))
+
+def iter_newsitems(fh: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Yield single news items; newsitems.json is a list of per-app lists.
+    """
+    for newslist in iter_records(fh or os.path.join(DATA_DIR, "newsitems.json")):
+        yield from newslist
+
+def batched(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+        # let go of it before reading the next one, so a caller that has
+        # dropped it too never holds two batches at once
+        del batch
@@ -0,0 +1,188 @@
+"""
+Append-only JSON lines log used for checkpointing long running crawls.
+
+Each record is written as one line as soon as it is available and the file
+is fsync'd every `fsync_every` records, so a crash loses at most that many
+records. A line cut short by a crash is dropped the next time the log is
+opened for appending.
+"""
+
+import json
+import os
+import re
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Set, Tuple
+
+class JsonlLog:
+    def __init__(self, path: str, fsync_every: int = 100):
+        self.path = path
+        self.fsync_every = fsync_every
+        self._f = None
+        self._unsynced = 0
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # partial line from a crash mid-write
+                    continue
+
+    def keys(self, key: str = "appid") -> Set[Hashable]:
+        """
+        The set of `key` values already in the log. Records written with `key`
+        first (as the scraper's are) only have that field read; any other
+        line is decoded in full. A line cut short by a crash has no newline
+        and doesn't count.
+        """
+        # a number or a string right at the start of the line
+        pattern = re.compile(
+            rb'\{' + re.escape(json.dumps(key).encode()) + rb': (-?\d+|"(?:[^"\\]|\\.)*")[,}]'
+        )
+        keys: Set[Hashable] = set()
+        if not os.path.exists(self.path):
+            return keys
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    continue
+                match_ = pattern.match(line)
+                if match_ is not None:
+                    keys.add(json.loads(match_.group(1)))
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if key in record:
+                    keys.add(record[key])
+        return keys
+
+    def _truncate_partial_line(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            # walk back to the end of the last complete line
+            pos = size
+            while pos > 0:
+                step = min(4096, pos)
+                pos -= step
+                f.seek(pos)
+                chunk = f.read(step)
+                newline = chunk.rfind(b"\n")
+                if newline != -1:
+                    f.truncate(pos + newline + 1)
+                    return
+            f.truncate(0)
+
+    def append(self, record: Dict[str, Any]) -> None:
+        if self._f is None:
+            self._truncate_partial_line()
+            self._f = open(self.path, "a")
+        self._f.write(json.dumps(record) + "\n")
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self) -> None:
+        if self._f is None or not self._unsynced:
+            return
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._unsynced = 0
+
+    def close(self) -> None:
+        if self._f is None:
+            return
+        self.sync()
+        self._f.close()
+        self._f = None
+
+    def __enter__(self) -> "JsonlLog":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def compact(
+        self,
+        out_path: str,
+        key: str = "appid",
+        keep: Optional[Callable[[Dict[str, Any]], bool]] = None,
+        order: Optional[Iterable[Hashable]] = None,
+    ) -> int:
+        """
+        Write the log out as a single JSON list to `out_path`, keeping only
+        the last record for each `key` and dropping records for which `keep`
+        returns False. Records without `key` can't be told apart, so they are
+        dropped too, with a warning. Records come out in log order, or in the
+        order of their keys in `order` when given (keys not in it follow, in
+        log order). Records are streamed out one at a time. Returns the
+        number of records written.
+        """
+        # first pass: find where the line that wins for each key starts
+        last_line: Dict[Hashable, int] = {}
+        missing_key = 0
+        for offset, record in self._offsets():
+            if record is None:
+                continue
+            if key not in record:
+                missing_key += 1
+                continue
+            last_line[record[key]] = offset
+        if missing_key:
+            print(f"{self.path}: dropping {missing_key} records without {key!r}")
+        offsets = []
+        if order is not None:
+            for value in order:
+                offset = last_line.pop(value, None)
+                if offset is not None:
+                    offsets.append(offset)
+        offsets.extend(sorted(last_line.values()))
+        del last_line
+        count = 0
+        tmp_path = out_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("[")
+            for record in self._read_at(offsets):
+                if keep is not None and not keep(record):
+                    continue
+                if count:
+                    f.write(", ")
+                f.write(json.dumps(record))
+                count += 1
+            f.write("]")
+        os.replace(tmp_path, out_path)
+        return count
+
+    def _read_at(self, offsets: List[int]) -> Iterator[Dict[str, Any]]:
+        if not offsets:
+            return
+        with open(self.path, "rb") as f:
+            for offset in offsets:
+                f.seek(offset)
+                yield json.loads(f.readline())
+
+    def _offsets(self) -> Iterator[Tuple[int, Optional[Dict[str, Any]]]]:
+        # like __iter__, but with where each line starts, and None for bad
+        # lines
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                yield offset, record
+                offset += len(line)
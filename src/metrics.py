@@ -0,0 +1,270 @@
+"""
+Counters, gauges and histograms for watching the long running stages.
+
+Metrics live in one process-wide registry and are looked up by name and
+labels, e.g.
+
+    metrics.counter("steam_responses_total", "...", host=host, status="200").inc()
+
+Once a stage calls `start(stage)`, a background thread writes everything
+every METRICS_INTERVAL seconds (and once more at exit) to METRICS_DIR:
+- {stage}.json, the latest snapshot, with the per-second rate of every
+  counter since the previous one
+- {stage}.jsonl, the rates and gauges of every snapshot so far, to see
+  throughput change over a run
+- {stage}.prom, the Prometheus text format, for node_exporter's textfile
+  collector; every series gets a stage label so stages don't collide
+
+Nothing is written, and the metrics cost next to nothing, in a process that
+never calls `start`.
+"""
+
+import atexit
+from bisect import bisect_left
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from constants import METRICS_DIR, METRICS_INTERVAL
+
+# seconds; from a cached page to a request stuck behind a Retry-After
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# seconds spent parsing one store page
+PARSE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class Counter:
+    type = "counter"
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1) -> None:
+        with self._lock:
+            self.value += value
+
+    def snapshot(self) -> float:
+        return self.value
+
+class Gauge:
+    type = "gauge"
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def snapshot(self) -> float:
+        return self.value
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        # the last one is +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "buckets": dict(zip([*map(str, self.buckets), "+Inf"], self.counts)),
+                "sum": self.sum,
+                "count": self.count,
+            }
+
+class Registry:
+    def __init__(self):
+        # name -> (type, help, labels -> metric)
+        self.metrics: Dict[str, Tuple[str, str, Dict[Labels, object]]] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, help: str, labels: Dict[str, object], *args):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = (cls.type, help, {})
+            kind, _, series = self.metrics[name]
+            if kind != cls.type:
+                raise ValueError(f"{name} is a {kind}, not a {cls.type}")
+            if key not in series:
+                series[key] = cls(*args)
+            return series[key]
+
+    def counter(self, name: str, help: str = "", **labels) -> Counter:
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str = "", **labels) -> Gauge:
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(
+        self,
+        name: str,
+        help: str = "",
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        **labels,
+    ) -> Histogram:
+        return self._get(Histogram, name, help, labels, buckets)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            metrics = {name: (kind, help, dict(series)) for name, (kind, help, series) in self.metrics.items()}
+        return {
+            name: {
+                "type": kind,
+                "help": help,
+                "series": [
+                    {"labels": dict(labels), "value": metric.snapshot()}
+                    for labels, metric in series.items()
+                ],
+            }
+            for name, (kind, help, series) in metrics.items()
+        }
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(labels: Dict[str, str], **extra: str) -> str:
+    labels = {**labels, **extra}
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+def prometheus_text(snapshot: Dict[str, Dict], stage: str) -> str:
+    lines = []
+    for name, metric in sorted(snapshot.items()):
+        if metric["help"]:
+            lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for series in metric["series"]:
+            labels = {"stage": stage, **series["labels"]}
+            value = series["value"]
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_labels(labels)} {float(value)!r}")
+                continue
+            # prometheus buckets are cumulative
+            total = 0
+            for le, count in value["buckets"].items():
+                total += count
+                lines.append(f"{name}_bucket{_labels(labels, le=le)} {total}")
+            lines.append(f"{name}_sum{_labels(labels)} {float(value['sum'])!r}")
+            lines.append(f"{name}_count{_labels(labels)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+def _write(fh: str, text: str) -> None:
+    # moved into place whole, so readers never see half a file
+    tmp_fh = fh + ".tmp"
+    with open(tmp_fh, "w") as f:
+        f.write(text)
+    os.replace(tmp_fh, fh)
+
+class Exporter:
+    """
+    Writes the registry out for `stage` every `interval` seconds.
+    """
+    def __init__(self, stage: str, interval: float = METRICS_INTERVAL, out_dir: str = METRICS_DIR):
+        self.stage = stage
+        self.interval = interval
+        self.out_dir = out_dir
+        self.started = time.time()
+        self.previous: Optional[Tuple[float, Dict[str, Dict]]] = None
+        self._stop = threading.Event()
+        # the final export at exit can race the thread's
+        self._export_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> "Exporter":
+        os.makedirs(self.out_dir, exist_ok=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.export()
+
+    def stop(self) -> None:
+        if not self._stop.is_set():
+            self._stop.set()
+            self.export()
+
+    def rates(self, now: float, snapshot: Dict[str, Dict]) -> Dict[str, List[Dict]]:
+        """
+        Per-second increase of every counter since the previous export.
+        """
+        if self.previous is None:
+            then, before = self.started, {}
+        else:
+            then, before = self.previous
+        elapsed = max(now - then, 1e-9)
+        rates = {}
+        for name, metric in snapshot.items():
+            if metric["type"] != "counter":
+                continue
+            old = {
+                tuple(sorted(s["labels"].items())): s["value"]
+                for s in before.get(name, {}).get("series", [])
+            }
+            rates[name] = [
+                {
+                    "labels": s["labels"],
+                    "per_sec": (s["value"] - old.get(tuple(sorted(s["labels"].items())), 0)) / elapsed,
+                }
+                for s in metric["series"]
+            ]
+        return rates
+
+    def export(self) -> None:
+        with self._export_lock:
+            self._export()
+
+    def _export(self) -> None:
+        now = time.time()
+        snapshot = REGISTRY.snapshot()
+        record = {
+            "stage": self.stage,
+            "time": now,
+            "uptime": now - self.started,
+            "metrics": snapshot,
+            "rates": self.rates(now, snapshot),
+        }
+        self.previous = (now, snapshot)
+        _write(os.path.join(self.out_dir, f"{self.stage}.json"), json.dumps(record))
+        # the history only keeps what changes over a run, to stay small over
+        # days of snapshots
+        history = {
+            "time": now,
+            "uptime": record["uptime"],
+            "rates": record["rates"],
+            "gauges": {
+                name: metric["series"] for name, metric in snapshot.items()
+                if metric["type"] == "gauge"
+            },
+        }
+        with open(os.path.join(self.out_dir, f"{self.stage}.jsonl"), "a") as f:
+            f.write(json.dumps(history) + "\n")
+        _write(os.path.join(self.out_dir, f"{self.stage}.prom"), prometheus_text(snapshot, self.stage))
+
+def start(stage: str, interval: float = METRICS_INTERVAL) -> Exporter:
+    """
+    Start exporting this process's metrics as `stage`.
+    """
+    return Exporter(stage, interval).start()
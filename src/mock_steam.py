@@ -0,0 +1,276 @@
+"""
+A local stand-in for the Steamworks API and the store, to crawl against
+instead of the real thing.
+
+Serves the endpoints the crawlers use, with data from synthetic_data.py:
+- /ISteamApps/GetAppList/v2/
+- /ISteamNews/GetNewsForApp/v2/ (with count and enddate)
+- /ISteamUserStats/GetGlobalAchievementPercentagesForApp/v2/, a 403 for apps
+  without stats like the real one
+- /app/{appid} store pages, redirecting to /agecheck/app/{appid} without the
+  age gate cookies, and to the home page for apps that have no page
+
+Every app's data is generated from (seed, appid), so a crawl can be checked
+against what the server would have sent. Responses are delayed by about
+`latency` seconds, and a fraction of requests fail with a 5xx or a 429
+(with a Retry-After) before any data is sent. With `max_rate` set, requests
+over that many per second get a 429 as well.
+
+    python mock_steam.py [--port 8080] [--apps 10000] [--latency 0.05] [--error-rate 0.02] ...
+
+and point the crawlers at it with STEAM_API_BASE and STEAM_STORE_BASE.
+"""
+
+import argparse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from http.cookies import SimpleCookie
+import json
+import random
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from synthetic_data import app_record, app_rng, game_record, news_records, store_page
+
+HOME_PAGE = (
+    "<html><head><title>Welcome to Steam</title></head><body>"
+    '<div class="home_page_col_wrapper"><div class="home_page_content">'
+    "Featured &amp; Recommended</div></div></body></html>"
+)
+AGE_GATE_PAGE = (
+    "<html><head><title>Site Error</title></head><body>"
+    '<div class="agegate_birthday_selector">Please enter your birth date to continue</div>'
+    "</body></html>"
+)
+
+class MockSteam:
+    def __init__(
+        self,
+        apps: int = 10000,
+        seed: int = 0,
+        news_per_app: int = 5,
+        contents_words: Tuple[int, int] = (20, 200),
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after: float = 1.0,
+        max_rate: Optional[float] = None,
+        home_page_rate: float = 0.1,
+        no_stats_rate: float = 0.5,
+    ):
+        self.apps = apps
+        self.seed = seed
+        self.news_per_app = news_per_app
+        self.contents_words = contents_words
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.max_rate = max_rate
+        self.home_page_rate = home_page_rate
+        self.no_stats_rate = no_stats_rate
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        # requests seen in the current second, for max_rate
+        self._second = 0
+        self._this_second = 0
+
+    # the data; the same for a given seed and appid however it is asked for
+
+    def has_page(self, appid: int) -> bool:
+        return appid < self.apps and random.Random(f"{self.seed}:page:{appid}").random() >= self.home_page_rate
+
+    def has_stats(self, appid: int) -> bool:
+        return appid < self.apps and random.Random(f"{self.seed}:stats:{appid}").random() >= self.no_stats_rate
+
+    def applist(self) -> List[Dict[str, Any]]:
+        return [app_record(appid) for appid in range(self.apps)]
+
+    def news(self, appid: int) -> List[Dict[str, Any]]:
+        """
+        Every news item of the app, newest first.
+        """
+        if appid >= self.apps:
+            return []
+        rng = app_rng(self.seed, appid)
+        # the game is drawn first so news_records sees the same rng state as
+        # in synthetic_data.write_dataset
+        game_record(rng, appid, self.apps)
+        items = news_records(
+            rng, appid, appid * self.news_per_app + 1, self.news_per_app, self.contents_words,
+        )
+        return items[::-1]
+
+    def achievements(self, appid: int) -> Optional[List[Dict[str, str]]]:
+        if not self.has_stats(appid):
+            return None
+        rng = random.Random(f"{self.seed}:achievements:{appid}")
+        return [
+            {"name": f"ACH_{i}", "percent": f"{rng.uniform(0, 100):.1f}"}
+            for i in range(rng.randint(1, 30))
+        ]
+
+    def page(self, appid: int) -> str:
+        game = game_record(app_rng(self.seed, appid), appid, self.apps)
+        return store_page(game, app_record(appid)["name"])
+
+    # serving
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    def fault(self) -> Optional[int]:
+        """
+        The status to fail the current request with, if any.
+        """
+        with self._lock:
+            if self.max_rate is not None:
+                second = int(time.monotonic())
+                if second != self._second:
+                    self._second, self._this_second = second, 0
+                self._this_second += 1
+                if self._this_second > self.max_rate:
+                    self.stats["rate_limited"] += 1
+                    return 429
+            roll = self._rng.random()
+            if roll < self.throttle_rate:
+                self.stats["injected_429"] += 1
+                return 429
+            if roll < self.throttle_rate + self.error_rate:
+                self.stats["injected_5xx"] += 1
+                return self._rng.choice([500, 502, 503])
+            jitter = self._rng.uniform(0.5, 1.5)
+        if self.latency:
+            time.sleep(self.latency * jitter)
+        return None
+
+    def serve(self, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+        """
+        Start serving on a background thread; port 0 picks a free port.
+        """
+        mock = self
+
+        class Handler(_Handler):
+            pass
+        Handler.mock = mock
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive, like the real thing; the crawlers pool their connections
+    protocol_version = "HTTP/1.1"
+    mock: MockSteam
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def send(self, status: int, body: str, content_type: str, headers: Dict[str, str] = {}) -> None:
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, value: Any, status: int = 200) -> None:
+        self.send(status, json.dumps(value), "application/json")
+
+    def redirect(self, location: str) -> None:
+        self.send(302, "", "text/html", {"Location": location})
+
+    def do_GET(self) -> None:
+        mock = self.mock
+        url = urlsplit(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        if url.path == "/_stats":
+            with mock._lock:
+                return self.send_json(dict(mock.stats))
+        route = url.path.rstrip("/").split("/")
+        mock.count("requests")
+        status = mock.fault()
+        if status == 429:
+            return self.send(429, "", "text/html", {"Retry-After": f"{mock.retry_after:g}"})
+        if status is not None:
+            return self.send(status, "<html>Internal Server Error</html>", "text/html")
+
+        if url.path.startswith("/ISteamApps/GetAppList/v2"):
+            mock.count("applist")
+            return self.send_json({"applist": {"apps": mock.applist()}})
+        if url.path.startswith("/ISteamNews/GetNewsForApp/v2"):
+            mock.count("news")
+            appid = int(params["appid"])
+            items = mock.news(appid)
+            if "enddate" in params:
+                items = [item for item in items if item["date"] <= int(params["enddate"])]
+            items = items[:int(params.get("count", 20))]
+            return self.send_json({
+                "appnews": {"appid": appid, "newsitems": items, "count": len(items)},
+            })
+        if url.path.startswith("/ISteamUserStats/GetGlobalAchievementPercentagesForApp/v2"):
+            mock.count("achievements")
+            achievements = mock.achievements(int(params["gameid"]))
+            if achievements is None:
+                return self.send_json({}, status=403)
+            return self.send_json({
+                "achievementpercentages": {"achievements": achievements},
+            })
+        if len(route) == 3 and route[1] == "app" and route[2].isdigit():
+            mock.count("store_page")
+            appid = int(route[2])
+            cookies = SimpleCookie(self.headers.get("Cookie", ""))
+            if "birthtime" not in cookies:
+                return self.redirect(f"/agecheck/app/{appid}")
+            if not mock.has_page(appid):
+                return self.redirect("/")
+            return self.send(200, mock.page(appid), "text/html; charset=UTF-8")
+        if url.path.startswith("/agecheck/"):
+            return self.send(200, AGE_GATE_PAGE, "text/html; charset=UTF-8")
+        if url.path in ("", "/"):
+            return self.send(200, HOME_PAGE, "text/html; charset=UTF-8")
+        self.send(404, "<html>Not Found</html>", "text/html")
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--apps", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per response, +/-50%%")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 5xx responses")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of 429 responses")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--max-rate", type=float, help="requests/sec before answering with 429s")
+    parser.add_argument("--home-page-rate", type=float, default=0.1, help="fraction of apps without a store page")
+    args = parser.parse_args(argv)
+
+    mock = MockSteam(
+        apps=args.apps,
+        seed=args.seed,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        max_rate=args.max_rate,
+        home_page_rate=args.home_page_rate,
+    )
+    server = mock.serve(args.host, args.port)
+    base = f"http://{args.host}:{server.server_address[1]}"
+    print(f"serving {args.apps} apps on {base}")
+    print(f"export STEAM_API_BASE={base} STEAM_STORE_BASE={base}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
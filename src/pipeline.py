@@ -0,0 +1,350 @@
+"""
+Run the collection and loading scripts as one pipeline.
+
+Each stage is one of the scripts, with the data files it reads and writes.
+A stage depends on whichever stages write its inputs, and stages that don't
+depend on each other run side by side (the API fetches alongside the store
+page scrape, the csv export alongside the database load). Stages that share
+a rate-limited host or a store file are still run one at a time: the news
+and achievements fetches both call api.steampowered.com, whose rate limit
+each process would otherwise be spending on its own, and both write
+raw_responses.sqlite.
+
+A stage is skipped when nothing it depends on has changed since it last
+finished: its fingerprint covers its arguments, the source of its script and
+every module of this repo the script imports, and the contents of its input
+files. Its outputs also have to still be there, unchanged. Because inputs are
+compared by content, a stage that is rerun but writes the same output again
+doesn't invalidate the stages after it. The collection stages are run so
+that they write their outputs again rather than keep the ones they find:
+the API fetches with --update, which re-exports from the raw store. The
+scrape is only given --reparse, which parses every cached page again, when
+the parser (store_page.py or what it imports) has changed since the scrape
+last finished. What each stage last ran with is kept in pipeline_state.json
+in DATA_DIR, and each run's output goes to logs/<stage>.log.
+
+    python pipeline.py [STAGE ...] [--force STAGE ...] [--dry-run] [--jobs 4]
+"""
+
+import argparse
+import ast
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from constants import DATA_DIR, SRC_DIR
+
+STATE_FH = os.path.join(DATA_DIR, "pipeline_state.json")
+LOG_DIR = os.path.join(DATA_DIR, "logs")
+
+class Stage(NamedTuple):
+    script: str
+    args: Tuple[str, ...]
+    # file names in DATA_DIR
+    inputs: Tuple[str, ...]
+    outputs: Tuple[str, ...]
+    # environment variables that change what the stage writes (e.g. the
+    # database schema); the stage is rerun when one of them changes
+    settings: Tuple[str, ...] = ()
+    # (argument, modules): the argument is only passed when one of the
+    # modules in SRC_DIR, or what they import, changed since the stage last
+    # finished
+    when_changed: Tuple[Tuple[str, Tuple[str, ...]], ...] = ()
+    # stages sharing any of these (a rate-limited host, a store file) never
+    # run at the same time
+    exclusive: Tuple[str, ...] = ()
+
+DATAFRAME_TABLES = (
+    "newsitems", "newsitem_tags", "details", "developers", "publishers", "tags", "features",
+)
+
+# what the API fetches share
+API_FETCH = ("api.steampowered.com", "raw_responses.sqlite")
+
+STAGES: Dict[str, Stage] = {
+    "applist": Stage(
+        "get_raw_data.py", ("--only", "applist", "--update"), (), ("applist.json",),
+    ),
+    "news": Stage(
+        "get_raw_data.py",
+        ("--only", "news", "--update"),
+        ("applist.json",),
+        ("newsitems.json",),
+        exclusive=API_FETCH,
+    ),
+    "achievements": Stage(
+        "get_raw_data.py",
+        ("--only", "achievements", "--update"),
+        ("applist.json",),
+        ("achievements.json",),
+        exclusive=API_FETCH,
+    ),
+    "scrape": Stage(
+        "scrape_game_pages.py",
+        (),
+        ("applist.json",),
+        ("gamedetails.json",),
+        when_changed=(("--reparse", ("store_page.py",)),),
+    ),
+    "dataframes": Stage(
+        "create_dataframes.py",
+        (),
+        ("applist.json", "gamedetails.json", "newsitems.json"),
+        tuple(f"{table}.csv" for table in DATAFRAME_TABLES),
+    ),
+    # writes to the database rather than to files, so it only reruns when its
+    # inputs or code change
+    "tables": Stage(
+        "create_tables.py", (), ("applist.json", "gamedetails.json", "newsitems.json"), (),
+        ("STEAM_DB_BACKEND", "STEAM_SQLITE_FH", "STEAM_CONTENT_STORE"),
+    ),
+}
+
+def dependencies(stages: Dict[str, Stage]) -> Dict[str, Set[str]]:
+    """
+    stage -> the stages that write its inputs.
+    """
+    writers = {fh: name for name, stage in stages.items() for fh in stage.outputs}
+    return {
+        name: {writers[fh] for fh in stage.inputs if fh in writers}
+        for name, stage in stages.items()
+    }
+
+def local_modules(script: str) -> List[str]:
+    """
+    `script` and every module in SRC_DIR it imports, directly or not.
+    """
+    seen: Set[str] = set()
+    todo = [script]
+    while todo:
+        fh = todo.pop()
+        if fh in seen:
+            continue
+        seen.add(fh)
+        with open(os.path.join(SRC_DIR, fh), "r") as f:
+            tree = ast.parse(f.read(), fh)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                modules = [node.module]
+            else:
+                continue
+            for module in modules:
+                module_fh = module.split(".")[0] + ".py"
+                if os.path.exists(os.path.join(SRC_DIR, module_fh)):
+                    todo.append(module_fh)
+    return sorted(seen)
+
+class FileHashes:
+    """
+    sha1 of file contents, remembered by path, size and mtime so big data
+    files are only read again after they change.
+    """
+    def __init__(self, known: Optional[Dict[str, List]] = None):
+        self.known = {} if known is None else known
+
+    def __call__(self, fh: str) -> Optional[str]:
+        if not os.path.exists(fh):
+            return None
+        st = os.stat(fh)
+        known = self.known.get(fh)
+        if known is not None and known[:2] == [st.st_size, st.st_mtime_ns]:
+            return known[2]
+        h = hashlib.sha1()
+        with open(fh, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        self.known[fh] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+        return h.hexdigest()
+
+def fingerprint(stage: Stage, file_hash: FileHashes) -> str:
+    h = hashlib.sha1()
+    h.update(json.dumps([stage.script, stage.args]).encode())
+    if stage.settings:
+        h.update(json.dumps([os.environ.get(name) for name in stage.settings]).encode())
+    for fh in local_modules(stage.script):
+        h.update(f"{fh}:{file_hash(os.path.join(SRC_DIR, fh))}".encode())
+    for fh in stage.inputs:
+        h.update(f"{fh}:{file_hash(os.path.join(DATA_DIR, fh))}".encode())
+    return h.hexdigest()
+
+def output_hashes(stage: Stage, file_hash: FileHashes) -> Dict[str, Optional[str]]:
+    return {fh: file_hash(os.path.join(DATA_DIR, fh)) for fh in stage.outputs}
+
+def watched_hashes(stage: Stage, file_hash: FileHashes) -> Dict[str, Optional[str]]:
+    """
+    The hashes of the modules the stage's `when_changed` arguments watch.
+    """
+    return {
+        fh: file_hash(os.path.join(SRC_DIR, fh))
+        for _, modules in stage.when_changed
+        for module in modules
+        for fh in local_modules(module)
+    }
+
+def stage_args(stage: Stage, record: Optional[Dict], file_hash: FileHashes) -> Tuple[str, ...]:
+    """
+    The stage's arguments, plus those of its `when_changed` arguments whose
+    modules changed since `record`. With no record of the modules, e.g. the
+    first run, they are all passed.
+    """
+    known = (record or {}).get("watched", {})
+    args = list(stage.args)
+    for arg, modules in stage.when_changed:
+        for module in modules:
+            if any(
+                fh not in known or known[fh] != file_hash(os.path.join(SRC_DIR, fh))
+                for fh in local_modules(module)
+            ):
+                args.append(arg)
+                break
+    return tuple(args)
+
+def up_to_date(stage: Stage, record: Optional[Dict], file_hash: FileHashes) -> bool:
+    if record is None or record["fingerprint"] != fingerprint(stage, file_hash):
+        return False
+    outputs = output_hashes(stage, file_hash)
+    return None not in outputs.values() and outputs == record["outputs"]
+
+def load_state() -> Dict:
+    if not os.path.exists(STATE_FH):
+        return {"files": {}, "stages": {}}
+    with open(STATE_FH, "r") as f:
+        return json.loads(f.read())
+
+def save_state(state: Dict) -> None:
+    # written to the side and moved into place, so a crash never leaves a
+    # half-written state file behind
+    tmp_fh = STATE_FH + ".tmp"
+    with open(tmp_fh, "w") as f:
+        f.write(json.dumps(state, indent=2, sort_keys=True))
+    os.replace(tmp_fh, STATE_FH)
+
+def run_stage(name: str, stage: Stage, args: Tuple[str, ...]) -> float:
+    """
+    Run the stage's script with `args`, with its output going to its log.
+    Returns the seconds it took.
+    """
+    start = time.perf_counter()
+    with open(os.path.join(LOG_DIR, f"{name}.log"), "w") as log:
+        subprocess.run(
+            [sys.executable, stage.script, *args],
+            cwd=SRC_DIR,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            check=True,
+        )
+    return time.perf_counter() - start
+
+def selected(targets: List[str], deps: Dict[str, Set[str]]) -> Set[str]:
+    """
+    `targets` and everything upstream of them.
+    """
+    wanted: Set[str] = set()
+    todo = list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in wanted:
+            wanted.add(name)
+            todo.extend(deps[name])
+    return wanted
+
+def run(targets: List[str], force: Set[str], jobs: int, dry_run: bool = False) -> None:
+    deps = dependencies(STAGES)
+    wanted = selected(targets, deps)
+    state = load_state()
+    file_hash = FileHashes(state["files"])
+    os.makedirs(LOG_DIR, exist_ok=True)
+
+    waiting = {name: deps[name] & wanted for name in STAGES if name in wanted}
+    done: Set[str] = set()
+    # stages that will (or, for a dry run, would) run this time
+    reran: Set[str] = set()
+    futures: Dict[Future, str] = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while waiting or futures:
+            held = {resource for name in futures.values() for resource in STAGES[name].exclusive}
+            for name in [name for name, parents in waiting.items() if parents <= done]:
+                stage = STAGES[name]
+                if held.intersection(stage.exclusive):
+                    # picked up again once the stage holding it finishes
+                    continue
+                del waiting[name]
+                if dry_run and deps[name] & reran:
+                    # can't tell until the stages before it have run
+                    print(f"{name}: would run if the output of {', '.join(sorted(deps[name] & reran))} changes")
+                    reran.add(name)
+                    done.add(name)
+                elif name not in force and up_to_date(stage, state["stages"].get(name), file_hash):
+                    print(f"{name}: up to date")
+                    done.add(name)
+                elif dry_run:
+                    print(f"{name}: would run")
+                    reran.add(name)
+                    done.add(name)
+                else:
+                    args = stage_args(stage, state["stages"].get(name), file_hash)
+                    print(f"{name}: running {stage.script} {' '.join(args)}".rstrip())
+                    reran.add(name)
+                    held.update(stage.exclusive)
+                    futures[executor.submit(run_stage, name, stage, args)] = name
+            if not futures:
+                continue
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = futures.pop(future)
+                stage = STAGES[name]
+                try:
+                    elapsed = future.result()
+                except subprocess.CalledProcessError:
+                    # the stages already running are left to finish, and
+                    # recorded if they succeed; nothing new is started
+                    print(f"{name}: failed, see {os.path.join(LOG_DIR, name + '.log')}")
+                    waiting.clear()
+                    continue
+                state["stages"][name] = {
+                    "fingerprint": fingerprint(stage, file_hash),
+                    "outputs": output_hashes(stage, file_hash),
+                    "watched": watched_hashes(stage, file_hash),
+                    "finished": time.strftime("%Y-%m-%d %H:%M:%S"),
+                }
+                save_state(state)
+                print(f"{name}: done in {elapsed:.1f}s")
+                done.add(name)
+    if not dry_run:
+        # keeps the file hashes of stages that were up to date, too
+        save_state(state)
+    if not done >= wanted:
+        sys.exit(1)
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "stages",
+        nargs="*",
+        metavar="STAGE",
+        help=f"run these and whatever they need, out of {', '.join(STAGES)}; all by default",
+    )
+    parser.add_argument(
+        "--force",
+        nargs="+",
+        default=[],
+        metavar="STAGE",
+        help="rerun these even if they are up to date",
+    )
+    parser.add_argument("--jobs", type=int, default=4, help="stages run at once")
+    parser.add_argument("--dry-run", action="store_true", help="only show what would run")
+    args = parser.parse_args(argv)
+    for name in args.stages + args.force:
+        if name not in STAGES:
+            parser.error(f"unknown stage {name!r}, expected one of {', '.join(STAGES)}")
+    run(args.stages or list(STAGES), set(args.force), args.jobs, args.dry_run)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
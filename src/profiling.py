@@ -0,0 +1,243 @@
+"""
+Opt-in profiling and a memory budget for the long running stages.
+
+A stage calls `start(stage)` once it knows its arguments. What gets
+profiled is picked with STEAM_PROFILE (comma separated) or a stage's
+--profile flag:
+- cpu: cProfile of the main thread, written as {stage}.pstats plus the top
+  functions by cumulative time in {stage}.cpu.txt
+- sample: samples the stacks of every thread SAMPLE_INTERVAL seconds apart,
+  written in the folded format flamegraph.pl and speedscope read, as
+  {stage}.folded; unlike cpu it sees the fetcher and loader threads
+- memory: tracemalloc's top allocators, in {stage}.tracemalloc.txt; with
+  STEAM_TRACEMALLOC_FRAMES over 1, also where the biggest were called from
+- rss: the resident set size every RSS_INTERVAL seconds, in {stage}.rss.jsonl
+Everything is written to PROFILE_DIR when the process exits.
+
+With a memory budget (STEAM_MEMORY_BUDGET_MB or --memory-budget), RSS is
+sampled in the background, and `over_budget()` turns True once it goes
+over. Stages check it where they would otherwise wait for a full batch and
+flush what they hold early instead.
+"""
+
+import atexit
+import cProfile
+from collections import Counter
+import io
+import json
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Iterable, List, Optional
+
+from constants import MEMORY_BUDGET_MB, PROFILE, PROFILE_DIR, TRACEMALLOC_FRAMES
+import metrics
+
+MODES = ["cpu", "sample", "memory", "rss"]
+# seconds between stack samples, and between RSS samples
+SAMPLE_INTERVAL = 0.01
+RSS_INTERVAL = 1.0
+# allocators written out
+TOP = 40
+
+def current_rss() -> int:
+    """
+    Resident set size of this process, in bytes.
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # no /proc (e.g. macOS); the peak is the closest there is
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+def add_arguments(parser, memory_budget: bool = True) -> None:
+    """
+    The --profile flag, and --memory-budget for stages that can flush early.
+    """
+    parser.add_argument(
+        "--profile",
+        action="append",
+        choices=MODES,
+        help=f"profile this run (can be repeated); written to {PROFILE_DIR}",
+    )
+    if memory_budget:
+        parser.add_argument(
+            "--memory-budget",
+            type=float,
+            metavar="MB",
+            help="flush batches early once the process's RSS goes over this",
+        )
+
+def _modes(value: str) -> List[str]:
+    modes = [mode.strip() for mode in value.split(",") if mode.strip()]
+    if modes == ["all"]:
+        return list(MODES)
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        raise ValueError(f"unknown STEAM_PROFILE modes {sorted(unknown)}; expected some of {MODES}")
+    return modes
+
+class Profiler:
+    def __init__(
+        self,
+        stage: str,
+        modes: Iterable[str] = (),
+        memory_budget_mb: float = 0,
+        out_dir: str = PROFILE_DIR,
+    ):
+        self.stage = stage
+        self.modes = set(modes)
+        self.budget = int(memory_budget_mb * 2**20)
+        self.out_dir = out_dir
+        self.profile: Optional[cProfile.Profile] = None
+        self.stacks = Counter()
+        self.trips = 0
+        self._over = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def fh(self, suffix: str) -> str:
+        return os.path.join(self.out_dir, f"{self.stage}.{suffix}")
+
+    def start(self) -> "Profiler":
+        if self.modes:
+            os.makedirs(self.out_dir, exist_ok=True)
+        if "memory" in self.modes:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        if "sample" in self.modes:
+            self._threads.append(threading.Thread(target=self._sample_stacks, daemon=True))
+        if "rss" in self.modes or self.budget:
+            self._threads.append(threading.Thread(target=self._sample_rss, daemon=True))
+        for thread in self._threads:
+            thread.start()
+        if "cpu" in self.modes:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        atexit.register(self.stop)
+        return self
+
+    def _sample_stacks(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def _sample_rss(self) -> None:
+        gauge = metrics.gauge("process_rss_bytes", "Resident set size")
+        log = open(self.fh("rss.jsonl"), "a") if "rss" in self.modes else None
+        started = time.time()
+        try:
+            while True:
+                rss = current_rss()
+                gauge.set(rss)
+                if log is not None:
+                    log.write(json.dumps({"uptime": time.time() - started, "rss_mb": rss / 2**20}) + "\n")
+                    log.flush()
+                if self.budget and rss > self.budget:
+                    self._over.set()
+                if self._stop.wait(RSS_INTERVAL):
+                    break
+        finally:
+            if log is not None:
+                log.close()
+
+    def over_budget(self) -> bool:
+        """
+        True once per RSS sample that went over the budget, so a stage that
+        flushes on it (and doesn't get its memory back from the allocator)
+        flushes at most about once a second.
+        """
+        if not self._over.is_set():
+            return False
+        self._over.clear()
+        self.trips += 1
+        metrics.counter("memory_budget_flushes_total", "Early flushes for the memory budget").inc()
+        if self.trips == 1:
+            print(
+                f"{self.stage}: RSS over the {self.budget / 2**20:,.0f} MB memory budget, "
+                "flushing early"
+            )
+            if "memory" in self.modes:
+                # what had piled up by then is the interesting part
+                self.write_allocators("tracemalloc-budget.txt")
+        return True
+
+    def write_allocators(self, suffix: str) -> None:
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ])
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [
+            f"traced: {current / 2**20:,.1f} MB now, {peak / 2**20:,.1f} MB peak; "
+            f"RSS {current_rss() / 2**20:,.1f} MB",
+            "",
+            f"top {TOP} allocating lines:",
+            *map(str, snapshot.statistics("lineno")[:TOP]),
+        ]
+        if TRACEMALLOC_FRAMES > 1:
+            lines += ["", "where the top 5 were allocated from:"]
+            for stat in snapshot.statistics("traceback")[:5]:
+                lines.append(f"{stat.size / 2**20:,.1f} MB in {stat.count} blocks")
+                lines.extend(f"    {line}" for line in stat.traceback.format())
+        with open(self.fh(suffix), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def stop(self) -> None:
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.fh("pstats"))
+            out = io.StringIO()
+            pstats.Stats(self.profile, stream=out).sort_stats("cumulative").print_stats(TOP)
+            with open(self.fh("cpu.txt"), "w") as f:
+                f.write(out.getvalue())
+        for thread in self._threads:
+            thread.join()
+        if "sample" in self.modes:
+            with open(self.fh("folded"), "w") as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        if "memory" in self.modes:
+            self.write_allocators("tracemalloc.txt")
+            tracemalloc.stop()
+        if self.modes:
+            print(f"profiles written to {self.out_dir}")
+
+# the running stage's profiler; a stage that never calls start is never
+# over budget
+_profiler = Profiler("")
+
+def start(
+    stage: str,
+    modes: Optional[Iterable[str]] = None,
+    memory_budget_mb: Optional[float] = None,
+) -> Profiler:
+    """
+    Start profiling this process as `stage`; `modes` and `memory_budget_mb`
+    default to STEAM_PROFILE and STEAM_MEMORY_BUDGET_MB.
+    """
+    global _profiler
+    _profiler = Profiler(
+        stage,
+        _modes(PROFILE) if modes is None else modes,
+        MEMORY_BUDGET_MB if memory_budget_mb is None else memory_budget_mb,
+    ).start()
+    return _profiler
+
+def over_budget() -> bool:
+    return _profiler.over_budget()
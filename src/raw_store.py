@@ -0,0 +1,230 @@
+"""
+Raw Steamworks API responses, kept in a single SQLite file.
+
+Replaces the appnews_{idx}.json / achievements_{idx}.json shards. Every
+fetched appid gets a row per endpoint, including the ones the API had no data
+for (body is NULL), so a resume only refetches appids that really are
+missing, gaps included.
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import sqlite3
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from constants import DATA_DIR
+
+RAW_STORE_FH = os.path.join(DATA_DIR, "raw_responses.sqlite")
+
+# (date, gid) of the newest item of a list-like response
+Mark = Tuple[int, str]
+
+def newest(items: List[Dict[str, Any]]) -> Optional[Mark]:
+    if not items:
+        return None
+    item = max(items, key=lambda item: item["date"])
+    return item["date"], item["gid"]
+
+class RawStore:
+    def __init__(self, path: str = RAW_STORE_FH, commit_every: int = 100):
+        self.path = path
+        self.commit_every = commit_every
+        self._uncommitted = 0
+        self._in_transaction = False
+        # pipeline.py runs the news and achievements fetches one after the
+        # other, but run by hand they may be writing at the same time from
+        # separate processes; wait out the other one's commits
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                endpoint TEXT NOT NULL,
+                appid INTEGER NOT NULL,
+                idx INTEGER NOT NULL,
+                body TEXT,
+                PRIMARY KEY (endpoint, appid)
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_endpoint_idx "
+            "ON responses (endpoint, idx)"
+        )
+        # newest item seen per app, for refreshing list-like endpoints
+        # (news) incrementally
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS high_water_marks (
+                endpoint TEXT NOT NULL,
+                appid INTEGER NOT NULL,
+                date INTEGER NOT NULL,
+                gid TEXT NOT NULL,
+                PRIMARY KEY (endpoint, appid)
+            )
+            """
+        )
+        self.conn.commit()
+
+    def fetched_appids(self, endpoint: str) -> Set[int]:
+        """
+        All appids with a stored response for `endpoint`; membership checks
+        against the returned set are O(1).
+        """
+        return {
+            appid for (appid,) in self.conn.execute(
+                "SELECT appid FROM responses WHERE endpoint = ?", (endpoint,)
+            )
+        }
+
+    def put(self, endpoint: str, appid: int, idx: int, value: Optional[Any]) -> None:
+        """
+        Store the response for `appid`. `value` is None when the API had no
+        data for the app, which still counts as fetched.
+        """
+        body = None if value is None else json.dumps(value)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (endpoint, appid, idx, body) "
+            "VALUES (?, ?, ?, ?)",
+            (endpoint, appid, idx, body),
+        )
+        self._wrote()
+
+    def replace(self, endpoint: str, appid: int, value: Optional[Any]) -> None:
+        """
+        Overwrite the stored response for an appid that is already in the
+        store, keeping its applist idx.
+        """
+        body = None if value is None else json.dumps(value)
+        self.conn.execute(
+            "UPDATE responses SET body = ? WHERE endpoint = ? AND appid = ?",
+            (body, endpoint, appid),
+        )
+        self._wrote()
+
+    def high_water_marks(self, endpoint: str) -> Dict[int, Mark]:
+        """
+        appid -> (date, gid) of the newest item stored for each app.
+        """
+        return {
+            appid: (date, gid) for appid, date, gid in self.conn.execute(
+                "SELECT appid, date, gid FROM high_water_marks WHERE endpoint = ?",
+                (endpoint,),
+            )
+        }
+
+    def set_high_water_mark(self, endpoint: str, appid: int, date: int, gid: str) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO high_water_marks (endpoint, appid, date, gid) "
+            "VALUES (?, ?, ?, ?)",
+            (endpoint, appid, date, gid),
+        )
+        self._wrote()
+
+    def iter_unmarked(self, endpoint: str) -> Iterator[Tuple[int, Any]]:
+        """
+        (appid, response) for every non-empty response for `endpoint` that
+        has no high-water mark yet.
+        """
+        cursor = self.conn.execute(
+            "SELECT r.appid, r.body FROM responses r "
+            "LEFT JOIN high_water_marks m ON m.endpoint = r.endpoint AND m.appid = r.appid "
+            "WHERE r.endpoint = ? AND r.body IS NOT NULL AND m.appid IS NULL",
+            (endpoint,),
+        )
+        for appid, body in cursor.fetchall():
+            yield appid, json.loads(body)
+
+    def iter_responses(self, endpoint: str) -> Iterator[Tuple[int, Any]]:
+        """
+        (appid, response) for every non-empty response for `endpoint`.
+        """
+        cursor = self.conn.execute(
+            "SELECT appid, body FROM responses "
+            "WHERE endpoint = ? AND body IS NOT NULL ORDER BY idx",
+            (endpoint,),
+        )
+        for appid, body in cursor:
+            yield appid, json.loads(body)
+
+    def get(self, endpoint: str, appid: int) -> Optional[Any]:
+        row = self.conn.execute(
+            "SELECT body FROM responses WHERE endpoint = ? AND appid = ?",
+            (endpoint, appid),
+        ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def iter_bodies(self, endpoint: str) -> Iterator[str]:
+        """
+        The raw JSON text of every non-empty response for `endpoint`, in
+        applist order.
+        """
+        cursor = self.conn.execute(
+            "SELECT body FROM responses "
+            "WHERE endpoint = ? AND body IS NOT NULL ORDER BY idx",
+            (endpoint,),
+        )
+        for (body,) in cursor:
+            yield body
+
+    def export_json(self, endpoint: str, fh: str) -> int:
+        """
+        Write every non-empty response for `endpoint` to `fh` as one JSON list,
+        streaming rows straight from the database. Returns the number of
+        responses written.
+        """
+        count = 0
+        tmp_fh = fh + ".tmp"
+        with open(tmp_fh, "w") as f:
+            f.write("[")
+            for body in self.iter_bodies(endpoint):
+                if count:
+                    f.write(", ")
+                f.write(body)
+                count += 1
+            f.write("]")
+        os.replace(tmp_fh, fh)
+        return count
+
+    def _wrote(self) -> None:
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_every and not self._in_transaction:
+            self.commit()
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        Writes made in the block are committed together when it ends, or
+        all rolled back if it raises; the periodic commits wait until then.
+        Reads in the block see the uncommitted writes.
+        """
+        self.commit()
+        self._in_transaction = True
+        try:
+            yield
+        except BaseException:
+            self.conn.rollback()
+            self._uncommitted = 0
+            raise
+        else:
+            self.commit()
+        finally:
+            self._in_transaction = False
+
+    def commit(self) -> None:
+        self.conn.commit()
+        self._uncommitted = 0
+
+    def close(self) -> None:
+        self.commit()
+        self.conn.close()
+
+    def __enter__(self) -> "RawStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
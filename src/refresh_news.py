@@ -0,0 +1,172 @@
+"""
+Incrementally refresh the news stored by get_raw_data.py.
+
+The newest item (date, gid) seen for every app is kept as a high-water mark
+in the raw response store. Each app is probed for its latest few items; apps
+whose newest item is still the high-water mark are left alone, and for the
+rest only the items newer than the mark are requested, paging back through
+`enddate` if there are more of them than fit in one response. New items are
+merged into the app's stored response, and appended to newsitems.json as one
+more list per updated app, rather than rewriting the whole file.
+"""
+
+from collections import defaultdict
+import json
+import os
+from tqdm import tqdm
+from typing import Any, Dict, List, Optional, Tuple
+
+from concurrent_fetch import fetch_json
+from constants import API_BASE, DATA_DIR
+from http_client import SteamClient
+import metrics
+import profiling
+from raw_store import Mark, newest, RawStore
+
+NEWS_URL = f"{API_BASE}/ISteamNews/GetNewsForApp/v2/"
+# items requested per app in each round; most apps have at most a couple of
+# new posts a day, so the first round settles almost all of them
+PAGE_COUNT = 10
+
+def seed_high_water_marks(store: RawStore) -> Dict[int, Mark]:
+    """
+    Every app's high-water mark, working out the missing ones from the
+    stored responses first (e.g. responses imported from the old shards).
+    Without a mark an app's whole history would be paged through again.
+    """
+    seeded = 0
+    for appid, items in store.iter_unmarked("news"):
+        mark = newest(items)
+        if mark is not None:
+            store.set_high_water_mark("news", appid, *mark)
+            seeded += 1
+    store.commit()
+    if seeded:
+        print(f"Seeded news high-water marks for {seeded} apps from stored responses")
+    return store.high_water_marks("news")
+
+def append_export(fh: str, lists: List[List[Dict[str, Any]]]) -> None:
+    """
+    Add `lists` to the end of the JSON list in `fh` in place. Readers go
+    through json_stream, which doesn't care that an app's items are now
+    split over more than one list. If the append fails part way, the file
+    is cut back to what it was.
+    """
+    with open(fh, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        # find the closing bracket, past any trailing whitespace
+        pos = size
+        char = b""
+        while pos > 0:
+            f.seek(pos - 1)
+            char = f.read(1)
+            if not char.isspace():
+                break
+            pos -= 1
+        if char != b"]":
+            raise ValueError(f"{fh} doesn't end in a JSON list")
+        f.seek(pos - 2 if pos >= 2 else 0)
+        empty = f.read(2) == b"[]"
+        try:
+            f.seek(pos - 1)
+            f.truncate()
+            for i, items in enumerate(lists):
+                if i or not empty:
+                    f.write(b", ")
+                f.write(json.dumps(items).encode("utf-8"))
+            f.write(b"]")
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            f.seek(pos - 1)
+            f.truncate()
+            f.write(b"]")
+            raise
+
+def items_newer_than(
+    items: List[Dict[str, Any]],
+    mark: Optional[Mark],
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    The items in a response (newest first) that are newer than `mark`, and
+    whether there may be more of them past the end of the response.
+    """
+    if mark is None:
+        return items, len(items) >= PAGE_COUNT
+    date, gid = mark
+    new = []
+    for item in items:
+        if item["gid"] == gid or item["date"] < date:
+            return new, False
+        new.append(item)
+    return new, len(items) >= PAGE_COUNT
+
+def main() -> None:
+    metrics.start("refresh_news")
+    profiling.start("refresh_news")
+    store = RawStore()
+    marks = seed_high_water_marks(store)
+    appids = store.fetched_appids("news")
+
+    client = SteamClient()
+    found: Dict[int, Dict[str, Dict[str, Any]]] = defaultdict(dict)
+    pending = {appid: {"appid": appid, "count": PAGE_COUNT} for appid in appids}
+    round_ = 0
+    while pending:
+        round_ += 1
+        print(f"Round {round_}: checking {len(pending)} apps for new items")
+        next_pending = {}
+        for appid, response in tqdm(
+            fetch_json(NEWS_URL, pending.items(), client=client),
+            total=len(pending),
+        ):
+            items = response.get("appnews", {}).get("newsitems", [])
+            new, more = items_newer_than(items, marks.get(appid))
+            # paging by enddate can return items already seen in the
+            # previous round when several share a timestamp
+            new = [item for item in new if item["gid"] not in found[appid]]
+            for item in new:
+                found[appid][item["gid"]] = item
+            if more and new:
+                next_pending[appid] = {
+                    "appid": appid,
+                    "count": PAGE_COUNT,
+                    "enddate": items[-1]["date"],
+                }
+        pending = next_pending
+
+    updated = 0
+    new_items = 0
+    appended = []
+    fh = os.path.join(DATA_DIR, "newsitems.json")
+    # the merged responses, the new high-water marks and newsitems.json go
+    # together: if the export fails the marks aren't advanced, so the next
+    # run finds the same items again rather than leaving them out of the file
+    with store.transaction():
+        for appid, items in tqdm(found.items()):
+            if not items:
+                continue
+            existing = store.get("news", appid) or []
+            known = {item["gid"] for item in existing}
+            additions = [item for gid, item in items.items() if gid not in known]
+            if not additions:
+                continue
+            merged = sorted(additions + existing, key=lambda item: item["date"], reverse=True)
+            store.replace("news", appid, merged)
+            store.set_high_water_mark("news", appid, *newest(merged))
+            appended.append(sorted(additions, key=lambda item: item["date"], reverse=True))
+            updated += 1
+            new_items += len(additions)
+        if appended and os.path.exists(fh):
+            append_export(fh, appended)
+            print(f"Appended {new_items} items to {fh}")
+        elif appended:
+            store.export_json("news", fh)
+            print(f"Exported {fh}")
+    print(f"{new_items} new items for {updated} apps; {len(appids) - updated} apps unchanged")
+    print(f"requests: {client.summary()}")
+    store.close()
+
+if __name__ == "__main__":
+    main()
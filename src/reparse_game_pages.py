@@ -0,0 +1,31 @@
+"""
+Reparse the cached store pages without touching the network, and merge the
+results into the scraper's checkpoint log before rebuilding gamedetails.json
+from it. Run this after changing store_page.py to pick up new fields. Games
+without a cached page keep the record they were scraped with.
+
+`scrape_game_pages.py --reparse` does the same before scraping whatever
+isn't cached.
+"""
+
+import multiprocessing
+
+from constants import PARSE_WORKERS
+from html_cache import HtmlCache
+from jsonl_log import JsonlLog
+from scrape_game_pages import checkpoint_fh, reparse_cached, write_gamedetails
+
+def main() -> None:
+    with multiprocessing.Pool(PARSE_WORKERS) as pool, HtmlCache() as cache, JsonlLog(checkpoint_fh) as log:
+        fetches, pages, raw, stored = cache.stats()
+        print(
+            f"{fetches} cached fetches of {pages} distinct pages; "
+            f"{raw / 2**20:,.1f} MiB stored in {stored / 2**20:,.1f} MiB"
+        )
+        count = reparse_cached(pool, cache, log)
+    print(f"Reparsed {count} cached pages into {checkpoint_fh}")
+    count = write_gamedetails(log)
+    print(f"Wrote {count} games to gamedetails.json")
+
+if __name__ == "__main__":
+    main()
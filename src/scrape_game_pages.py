@@ -1,167 +1,374 @@
-from bs4 import BeautifulSoup
+import argparse
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
 import json
+import multiprocessing
+import multiprocessing.pool
 import os
-import re
-from selenium import webdriver
+import queue
+import requests
+from selenium.common.exceptions import WebDriverException
 from tqdm import tqdm
-from typing import Any, Dict, List
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
 import urllib3
 
-from constants import DATA_DIR
+from constants import DATA_DIR, MAX_PAGES_IN_FLIGHT, PARSE_WORKERS, SCRAPE_WORKERS, STORE_BASE
+from driver_pool import DriverPool
+from html_cache import CacheEntry, HtmlCache, read_blob
+from http_client import RetriesExceeded, SteamClient
+from jsonl_log import JsonlLog
+import metrics
+import profiling
+from store_page import parse_html
 
 applist_fh = os.path.join(DATA_DIR, "applist.json")
-with open(applist_fh, "r") as f:
-    applist = json.loads(f.read())
 
-checkpoint_fh = os.path.join(DATA_DIR, "gamedetails_chkpt.json")
-def save_checkpoint(gamedetails: List[Dict[str, Any]], idx: int) -> None:
-    with open(checkpoint_fh, "w") as f:
-        f.write(json.dumps({"gamedetails": gamedetails, "idx": idx}))
-    print(f"Saving checkpoint {idx} to {checkpoint_fh}; {len(gamedetails)=}")
+# one record per appid, appended as soon as the page is scraped; pages that
+# resolved to the home page get a {"appid": ..., "skipped": True} record so
+# they aren't fetched again on resume
+checkpoint_fh = os.path.join(DATA_DIR, "gamedetails.jsonl")
+# the old checkpoint format, which rewrote everything scraped so far
+legacy_checkpoint_fh = os.path.join(DATA_DIR, "gamedetails_chkpt.json")
 
-def load_checkpoint() -> tuple[List[Dict[str, Any]], int]:
-    with open(checkpoint_fh, "r") as f:
+def write_gamedetails(log: JsonlLog) -> int:
+    """
+    Compact the checkpoint log into gamedetails.json, in applist order.
+    """
+    with open(applist_fh, "r") as f:
+        order = [app["appid"] for app in json.loads(f.read()) if "appid" in app]
+    return log.compact(
+        os.path.join(DATA_DIR, "gamedetails.json"),
+        keep=lambda page_data: not page_data.get("skipped", False),
+        order=order,
+    )
+
+def migrate_legacy_checkpoint(log: JsonlLog, applist: List[Dict[str, Any]]) -> None:
+    # the old checkpoint only had the pages it kept and the applist idx it
+    # had got to; the apps before that idx without a page were the ones
+    # that resolved to the home page, and get skipped records so they
+    # aren't fetched again
+    with open(legacy_checkpoint_fh, "r") as f:
         data = json.loads(f.read())
-    idx = data["idx"]
-    print(f"Loaded checkpoint {idx} from {checkpoint_fh}")
-    return data["gamedetails"], idx
-
-def load_html(appid: int) -> BeautifulSoup:
-    url = f"https://store.steampowered.com/app/{appid}"
-
-    options = webdriver.ChromeOptions()
-    options.add_argument("--log-level=3")
-    options.add_argument("--ignore-certificate-errors")
-    options.add_argument("--incognito")
-    options.add_argument("--headless")
-
-    driver = webdriver.Chrome(options)
-    driver.get(url)
-    page_source = driver.page_source
-    driver.close()
-    return BeautifulSoup(page_source, "lxml")
-
-def parse_page(soup: BeautifulSoup) -> Dict[str, Any]:
-    page_data = {"appid": appid}
-
-    # reviews
-    pattern = re.compile(r"\((\d+)% of ([\d,]+)\)")
-    for review_desc in soup.find_all(class_="responsive_reviewdesc_short"):
-        match_ = pattern.search(review_desc.text)
-        if match_ is None:
-            continue
-        positive_review_pct, num_reviews = match_.groups()
-        positive_review_pct = int(positive_review_pct)
-        num_reviews = int(num_reviews.replace(",", ""))
-        if review_desc.span.text == "All Time":
-            page_data["all_positive_review_pct"] = positive_review_pct
-            page_data["total_num_reviews"] = num_reviews
-        elif review_desc.span.text == "Recent":
-            page_data["recent_positive_review_pct"] = positive_review_pct
-            page_data["recent_num_reviews"] = num_reviews
-
-    # short description
-    description = soup.find(class_="game_description_snippet")
-    if description is not None:
-        page_data["description_snippet"] = description.text.strip()
-
-    # publisher / developer
-    for dev_row in soup.find_all(class_="dev_row"):
-        subtitle = dev_row.find(class_="subtitle column")
-        if subtitle is None:
-            continue
-        row_type = subtitle.text.strip()
-        names = list({x.text.strip() for x in dev_row.find_all("a")})
-        if row_type == "Developer:":
-            page_data["developers"] = names
-        elif row_type == "Publisher:":
-            page_data["publishers"] = names
-
-
-    # release date
-    release_date = soup.find(class_="release_date")
-    if release_date:
-        page_data["release_date"] = (
-            release_date.find(class_="date").text.strip()
+    for page_data in data["gamedetails"]:
+        log.append(page_data)
+    scraped = {page_data["appid"] for page_data in data["gamedetails"]}
+    skipped = 0
+    for app in applist[:data["idx"]]:
+        if "appid" in app and app["appid"] not in scraped:
+            log.append({"appid": app["appid"], "skipped": True})
+            skipped += 1
+    log.sync()
+    os.remove(legacy_checkpoint_fh)
+    print(
+        f"Migrated {len(data['gamedetails'])} pages and {skipped} skipped apps "
+        f"from {legacy_checkpoint_fh}"
+    )
+
+# the host includes the port, if there is one; it is what the client's rate
+# limits are kept by
+STORE_HOST = urlsplit(STORE_BASE).netloc
+STORE_URL = f"{STORE_BASE}/app/{{appid}}"
+
+# pretend we already passed the age gate so mature games come back as normal
+# store pages instead of the birthday form
+AGE_GATE_COOKIES = {
+    "birthtime": "470703601",
+    "lastagecheckage": "1-January-1985",
+    "wants_mature_content": "1",
+    "mature_content": "1",
+}
+# parse_page pulls most of its fields out of these; a page missing them most
+# likely needed javascript to render and has to go through the browser
+PAGE_MARKERS = ("dev_row", "game_area_description")
+# failures in the browser worth another try; the pool has already thrown
+# away the driver that failed, so the next try gets a fresh browser
+BROWSER_RETRY_ON = (urllib3.exceptions.ReadTimeoutError, WebDriverException)
+
+def make_store_client() -> SteamClient:
+    client = SteamClient(pool_size=SCRAPE_WORKERS)
+    for name, value in AGE_GATE_COOKIES.items():
+        client.session.cookies.set(name, value, domain=urlsplit(STORE_BASE).hostname)
+    return client
+
+# how many pages were served by each path, to see how often the browser is
+# still needed
+path_counts = Counter()
+path_counts_lock = threading.Lock()
+
+def count_path(path: str) -> None:
+    with path_counts_lock:
+        path_counts[path] += 1
+    metrics.counter("scrape_pages_total", "Store pages loaded, by path", path=path).inc()
+
+def browser_fallback(reason: str) -> None:
+    metrics.counter(
+        "scrape_browser_fallbacks_total", "Pages the plain GET couldn't handle, by why", reason=reason,
+    ).inc()
+
+def load_html_http(appid: int, client: SteamClient) -> Optional[str]:
+    """
+    Fetch the store page with a plain GET. Returns None whenever the response
+    doesn't look like a fully rendered store page.
+    """
+    try:
+        response = client.get(STORE_URL.format(appid=appid))
+    except (requests.RequestException, RetriesExceeded) as e:
+        browser_fallback("request_failed")
+        return None
+    if response.status_code != 200:
+        browser_fallback(f"http_{response.status_code}")
+        return None
+    # age gated pages redirect to /agecheck/app/{appid}
+    if "/agecheck/" in response.url or "agegate" in response.text:
+        browser_fallback("age_gate")
+        return None
+    # so do the ones that resolve to the steam home page; after a redirect
+    # there the browser would only follow the same redirect, so the home page
+    # is the answer (parse_page_source marks it skipped)
+    if "home_page_col_wrapper" in response.text:
+        if response.history and urlsplit(response.url).path in ("", "/"):
+            return response.text
+        browser_fallback("home_page")
+        return None
+    if not all(marker in response.text for marker in PAGE_MARKERS):
+        browser_fallback("missing_markers")
+        return None
+    return response.text
+
+def load_html_webdriver(appid: int, pool: DriverPool) -> str:
+    with pool.driver() as driver:
+        driver.get(STORE_URL.format(appid=appid))
+        return driver.page_source
+
+def load_html(appid: int, pool: DriverPool, client: SteamClient) -> str:
+    page_source = load_html_http(appid, client)
+    if page_source is None:
+        # browser page loads count against the same per-host rate limit
+        page_source = client.call(
+            STORE_HOST,
+            load_html_webdriver,
+            appid,
+            pool,
+            retry_on=BROWSER_RETRY_ON,
+        )
+        count_path("webdriver")
+    else:
+        count_path("http")
+    return page_source
+
+def path_summary() -> str:
+    with path_counts_lock:
+        total = sum(path_counts.values()) or 1
+        return ", ".join(
+            f"{path}={path_counts[path]} ({path_counts[path] / total:.1%})"
+            for path in ("http", "webdriver")
         )
 
-    # popular tags
-    page_data["tags"] = list({
-        x.text.strip() for x in soup.find_all(class_="app_tag")
-    })
-
-    # price
-    # NOTE omitting bundles and sales to keep things a bit simpler
-    for purchase_action in soup.find_all(class_="game_purchase_action_bg"):
-        price = None
-        discount = purchase_action.find_all(class_="discount_original_price")
-        if discount:
-            price = discount[0]
-        else:
-            price = purchase_action.find(class_="game_purchase_price price")
-        if price:
-            price = price.text.strip()
-            if price == "Free To Play":
-                page_data["price"] = 0
-            else:
-                match_ = re.search("(\d+\.\d{2})", price)
-                if match_ is None:
-                    continue
-                page_data["price"] = float(match_.groups()[0])
-            break
-
-    # features
-    page_data["features"] = list({
-        x.text.strip()
-        for x in soup.find_all("a", class_="game_area_details_specs_ctn")
-    })
-
-    # long description
-    description = soup.find(class_="game_area_description")
-    if description:
-        page_data["description"] = description.text.strip()
+def fetch_page(idx: int, appid: int, pool: DriverPool, client: SteamClient) -> str:
+    try:
+        return load_html(appid, pool, client)
+    except RetriesExceeded:
+        print(f"retries exceeded on {idx=} {appid=}")
+        raise
+    except:
+        print(f"error on {idx=} {appid=}")
+        raise
+
+def parse_page_source(page_source: str, appid: int) -> Tuple[Dict[str, Any], float]:
+    """
+    The page's data, and the seconds it took to parse. Runs in the parse
+    worker processes, so the time goes back to the writer to be recorded.
+    """
+    start = time.perf_counter()
+    page_data = parse_html(page_source, appid)
+    seconds = time.perf_counter() - start
+    # some of the urls will resolve to the steam home page
+    if page_data is None:
+        return {"appid": appid, "skipped": True}, seconds
+    return page_data, seconds
 
+def reparse_page(pack_fh: str, entry: CacheEntry) -> Dict[str, Any]:
+    appid, fetched_at, offset, length, codec = entry
+    page_data, seconds = parse_page_source(read_blob(pack_fh, offset, length, codec), appid)
     return page_data
 
-if os.path.exists(checkpoint_fh):
-    gamedetails, starting_idx = load_checkpoint()
-else:
-    gamedetails = []
-    starting_idx = 0
+def _reparse_page(args) -> Dict[str, Any]:
+    return reparse_page(*args)
 
-for idx in tqdm(range(starting_idx, len(applist))):
-    if idx and idx % 100 == 0:
-        save_checkpoint(gamedetails, idx + 1)
-    try:
-        appid = applist[idx]["appid"]
-    except Exception as e:
-        continue
-    if int(appid) in (440810,):
-        continue
-
-    max_tries = 3
-    for try_count in range(max_tries):
+def reparse_cached(
+    parse_pool: multiprocessing.pool.Pool,
+    cache: HtmlCache,
+    log: JsonlLog,
+) -> int:
+    """
+    Parse the latest cached page of every app again and append the results
+    to `log`, where they win over the records scraped before. Games without
+    a cached page keep the record they have. Returns the pages reparsed.
+    """
+    entries = [(cache.pack_fh, entry) for entry in cache.latest()]
+    for page_data in tqdm(
+        parse_pool.imap(_reparse_page, entries, chunksize=64),
+        total=len(entries),
+    ):
+        log.append(page_data)
+    log.sync()
+    return len(entries)
+
+class Pipeline:
+    """
+    Fetcher threads hand raw page source to a pool of parser processes, and
+    the parsed pages come back to a single writer (the main thread) through
+    `results`. The writer never lets more than `max_in_flight` pages be
+    fetched or parsed at once, which keeps memory flat no matter which side
+    is the bottleneck.
+    """
+    def __init__(
+        self,
+        parse_pool: multiprocessing.pool.Pool,
+        executor: ThreadPoolExecutor,
+        pool: DriverPool,
+        client: SteamClient,
+        cache: HtmlCache,
+        max_in_flight: int = MAX_PAGES_IN_FLIGHT,
+    ):
+        self.parse_pool = parse_pool
+        self.executor = executor
+        self.pool = pool
+        self.client = client
+        self.cache = cache
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.results: queue.Queue[Tuple[bool, Any]] = queue.Queue()
+        self.in_flight_gauge = metrics.gauge(
+            "scrape_pages_in_flight", "Pages being fetched or parsed, or waiting to be written",
+        )
+        self.waiting_gauge = metrics.gauge(
+            "scrape_pages_waiting", "Pages parsed and waiting to be written",
+        )
+        self.parse_seconds = metrics.histogram(
+            "scrape_parse_seconds", "Time to parse one store page", buckets=metrics.PARSE_BUCKETS,
+        )
+
+    def submit(self, idx: int, appid: int) -> None:
+        future = self.executor.submit(fetch_page, idx, appid, self.pool, self.client)
+        future.add_done_callback(lambda future: self._on_fetched(future, appid))
+        self.in_flight += 1
+        self.in_flight_gauge.set(self.in_flight)
+
+    def _on_fetched(self, future: Future, appid: int) -> None:
         try:
-            soup = load_html(appid)
-        except urllib3.exceptions.ReadTimeoutError as e:
-            if try_count == max_tries - 1:
-                print(f"retries exceeded on {idx=} {appid=}")
-                save_checkpoint(gamedetails, idx)
-                raise
-            else:
-                print(f"retry count on {idx=} {appid=}: {try_count}")
-        except:
-            print(f"error on {idx=} {appid=}")
-            save_checkpoint(gamedetails, idx)
-            raise
-        else:
-            break
+            page_source = future.result()
+            # keep the raw page around so new fields can be parsed out of it
+            # later without scraping everything again
+            self.cache.put(appid, page_source)
+        except BaseException as e:
+            self.results.put((False, e))
+            return
+        self.parse_pool.apply_async(
+            parse_page_source,
+            (page_source, appid),
+            callback=self._on_parsed,
+            error_callback=lambda e: self.results.put((False, e)),
+        )
 
-    # some of the urls will resolve to the steam home page
-    if soup.find_all(class_="home_page_col_wrapper"):
-        continue
-    page_data = parse_page(soup)
-    gamedetails.append(page_data)
+    def _on_parsed(self, result: Tuple[Dict[str, Any], float]) -> None:
+        page_data, seconds = result
+        self.parse_seconds.observe(seconds)
+        if page_data.get("skipped"):
+            metrics.counter("steam_skipped_total", "Apps without data", reason="home_page").inc()
+        self.results.put((True, page_data))
+
+    def get(self) -> Dict[str, Any]:
+        """
+        Block until the next page is parsed; re-raises fetch or parse errors.
+        """
+        ok, value = self.results.get()
+        self.in_flight -= 1
+        self.in_flight_gauge.set(self.in_flight)
+        self.waiting_gauge.set(self.results.qsize())
+        if not ok:
+            raise value
+        return value
+
+    def full(self) -> bool:
+        return self.in_flight >= self.max_in_flight
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Scrape the store page of every app in the applist.")
+    parser.add_argument(
+        "--reparse",
+        action="store_true",
+        help="parse the cached pages again before scraping the rest, e.g. "
+        "after store_page.py changed",
+    )
+    profiling.add_arguments(parser)
+    args = parser.parse_args(argv)
+    with open(applist_fh, "r") as f:
+        applist = json.loads(f.read())
+
+    log = JsonlLog(checkpoint_fh)
+    if os.path.exists(legacy_checkpoint_fh) and not os.path.exists(checkpoint_fh):
+        migrate_legacy_checkpoint(log, applist)
+    # the parse processes are started before any threads or browsers so
+    # forking them is safe; that includes the metrics exporter's thread and
+    # the profiler's sampling threads and tracemalloc hooks
+    parse_pool = multiprocessing.Pool(PARSE_WORKERS)
+    metrics.start("scrape_game_pages")
+    profiling.start("scrape_game_pages", args.profile, args.memory_budget)
+    cache = HtmlCache()
+    if args.reparse:
+        count = reparse_cached(parse_pool, cache, log)
+        print(f"Reparsed {count} cached pages")
+    done_appids = log.keys("appid")
+    print(f"Found {len(done_appids)} scraped appids in {checkpoint_fh}")
+    todo = [
+        (idx, app["appid"]) for idx, app in enumerate(applist)
+        if "appid" in app
+        and app["appid"] not in done_appids
+        and int(app["appid"]) not in (440810,)
+    ]
+    del applist, done_appids
+
+    pool = DriverPool(SCRAPE_WORKERS)
+    client = make_store_client()
+    executor = ThreadPoolExecutor(max_workers=SCRAPE_WORKERS)
+    pipeline = Pipeline(parse_pool, executor, pool, client, cache)
+    pbar = tqdm(total=len(todo))
+
+    def write_next() -> None:
+        log.append(pipeline.get())
+        pbar.update()
+        if pbar.n % 100 == 0:
+            pbar.set_postfix_str(path_summary())
+
+    # pages are written to the log in whatever order they finish
+    try:
+        for idx, appid in todo:
+            while pipeline.full():
+                write_next()
+            if profiling.over_budget():
+                # let everything in flight be written before fetching more
+                while pipeline.in_flight:
+                    write_next()
+            pipeline.submit(idx, appid)
+        while pipeline.in_flight:
+            write_next()
+    finally:
+        pbar.close()
+        executor.shutdown(cancel_futures=True)
+        pool.close()
+        parse_pool.terminate()
+        parse_pool.join()
+        cache.close()
+        log.close()
+    print(f"pages loaded by path: {path_summary()}")
+    print(f"requests: {client.summary()}")
+
+    count = write_gamedetails(log)
+    print(f"Wrote {count} games to gamedetails.json")
 
-with open(os.path.join(DATA_DIR, "gamedetails.json"), "w") as f:
-    f.write(json.dumps(gamedetails))
+if __name__ == "__main__":
+    main()
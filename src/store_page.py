@@ -0,0 +1,252 @@
+"""
+Extracting game details from a store.steampowered.com/app/{appid} page.
+
+`parse_page` is the original BeautifulSoup implementation. `parse_html` does
+the same extraction straight off an lxml tree: one XPath pass picks out every
+element parse_page looks at, and the fields are filled in from that list.
+It returns exactly the same dict; tests/test_store_page.py and
+benchmark_parse_page.py check that.
+"""
+
+from bs4 import BeautifulSoup
+from lxml import etree
+import re
+from typing import Any, Dict, List, Optional
+
+REVIEW_PATTERN = re.compile(r"\((\d+)% of ([\d,]+)\)")
+PRICE_PATTERN = re.compile(r"(\d+\.\d{2})")
+
+def parse_page(soup: BeautifulSoup, appid: int) -> Dict[str, Any]:
+    page_data = {"appid": appid}
+
+    # reviews
+    for review_desc in soup.find_all(class_="responsive_reviewdesc_short"):
+        match_ = REVIEW_PATTERN.search(review_desc.text)
+        if match_ is None:
+            continue
+        positive_review_pct, num_reviews = match_.groups()
+        positive_review_pct = int(positive_review_pct)
+        num_reviews = int(num_reviews.replace(",", ""))
+        if review_desc.span.text == "All Time":
+            page_data["all_positive_review_pct"] = positive_review_pct
+            page_data["total_num_reviews"] = num_reviews
+        elif review_desc.span.text == "Recent":
+            page_data["recent_positive_review_pct"] = positive_review_pct
+            page_data["recent_num_reviews"] = num_reviews
+
+    # short description
+    description = soup.find(class_="game_description_snippet")
+    if description is not None:
+        page_data["description_snippet"] = description.text.strip()
+
+    # publisher / developer
+    for dev_row in soup.find_all(class_="dev_row"):
+        subtitle = dev_row.find(class_="subtitle column")
+        if subtitle is None:
+            continue
+        row_type = subtitle.text.strip()
+        names = list({x.text.strip() for x in dev_row.find_all("a")})
+        if row_type == "Developer:":
+            page_data["developers"] = names
+        elif row_type == "Publisher:":
+            page_data["publishers"] = names
+
+
+    # release date
+    release_date = soup.find(class_="release_date")
+    if release_date:
+        page_data["release_date"] = (
+            release_date.find(class_="date").text.strip()
+        )
+
+    # popular tags
+    page_data["tags"] = list({
+        x.text.strip() for x in soup.find_all(class_="app_tag")
+    })
+
+    # price
+    # NOTE omitting bundles and sales to keep things a bit simpler
+    for purchase_action in soup.find_all(class_="game_purchase_action_bg"):
+        price = None
+        discount = purchase_action.find_all(class_="discount_original_price")
+        if discount:
+            price = discount[0]
+        else:
+            price = purchase_action.find(class_="game_purchase_price price")
+        if price:
+            price = price.text.strip()
+            if price == "Free To Play":
+                page_data["price"] = 0
+            else:
+                match_ = PRICE_PATTERN.search(price)
+                if match_ is None:
+                    continue
+                page_data["price"] = float(match_.groups()[0])
+            break
+
+    # features
+    page_data["features"] = list({
+        x.text.strip()
+        for x in soup.find_all("a", class_="game_area_details_specs_ctn")
+    })
+
+    # long description
+    description = soup.find(class_="game_area_description")
+    if description:
+        page_data["description"] = description.text.strip()
+
+    return page_data
+
+# every class parse_page searches for at the top level; contains() is only a
+# cheap prefilter, the exact class tokens are checked in python
+_WANTED_CLASSES = (
+    "responsive_reviewdesc_short",
+    "game_description_snippet",
+    "dev_row",
+    "release_date",
+    "app_tag",
+    "game_purchase_action_bg",
+    "game_area_details_specs_ctn",
+    "game_area_description",
+    "home_page_col_wrapper",
+)
+_find_candidates = etree.XPath(
+    "//*[" + " or ".join(
+        f"contains(@class, '{name}')" for name in _WANTED_CLASSES
+    ) + "]"
+)
+# BeautifulSoup's .text leaves out comments and anything inside script, style
+# and template tags; text() already skips comments
+_find_text = etree.XPath(
+    ".//text()[not(ancestor::script or ancestor::style or ancestor::template)]",
+    smart_strings=False,
+)
+
+def _text(el: etree._Element) -> str:
+    return "".join(_find_text(el))
+
+def _classes(el: etree._Element) -> List[str]:
+    return el.get("class", "").split()
+
+def _has_class(el: etree._Element, name: str) -> bool:
+    # same rules as bs4's class_=...: either one of the classes, or the whole
+    # (whitespace normalized) attribute for names like "subtitle column"
+    classes = _classes(el)
+    return name in classes or " ".join(classes) == name
+
+def _find(el: etree._Element, name: str) -> Optional[etree._Element]:
+    for child in el.iterdescendants():
+        if isinstance(child.tag, str) and _has_class(child, name):
+            return child
+    return None
+
+def _find_tag(el: etree._Element, tag: str) -> Optional[etree._Element]:
+    for child in el.iterdescendants(tag):
+        return child
+    return None
+
+def parse_tree(html: str) -> etree._Element:
+    try:
+        return etree.HTML(html)
+    except ValueError:
+        # lxml refuses str input that carries an encoding declaration
+        return etree.HTML(html.encode("utf-8"))
+
+def is_home_page(root: etree._Element) -> bool:
+    # some of the urls will resolve to the steam home page
+    return any(
+        _has_class(el, "home_page_col_wrapper") for el in _find_candidates(root)
+    )
+
+def parse_html(html: str, appid: int) -> Optional[Dict[str, Any]]:
+    """
+    lxml version of `parse_page`, taking the raw page source. Returns None if
+    the page turned out to be the steam home page.
+    """
+    root = parse_tree(html)
+    if root is None:
+        return {"appid": appid, "tags": [], "features": []}
+    found: Dict[str, List[etree._Element]] = {name: [] for name in _WANTED_CLASSES}
+    for el in _find_candidates(root):
+        classes = _classes(el)
+        for name in _WANTED_CLASSES:
+            if name in classes:
+                found[name].append(el)
+    if found["home_page_col_wrapper"]:
+        return None
+    return _page_data(found, appid)
+
+def _page_data(found: Dict[str, List[etree._Element]], appid: int) -> Dict[str, Any]:
+    page_data = {"appid": appid}
+
+    # reviews
+    for review_desc in found["responsive_reviewdesc_short"]:
+        match_ = REVIEW_PATTERN.search(_text(review_desc))
+        if match_ is None:
+            continue
+        positive_review_pct, num_reviews = match_.groups()
+        positive_review_pct = int(positive_review_pct)
+        num_reviews = int(num_reviews.replace(",", ""))
+        span_text = _text(_find_tag(review_desc, "span"))
+        if span_text == "All Time":
+            page_data["all_positive_review_pct"] = positive_review_pct
+            page_data["total_num_reviews"] = num_reviews
+        elif span_text == "Recent":
+            page_data["recent_positive_review_pct"] = positive_review_pct
+            page_data["recent_num_reviews"] = num_reviews
+
+    # short description
+    if found["game_description_snippet"]:
+        description = found["game_description_snippet"][0]
+        page_data["description_snippet"] = _text(description).strip()
+
+    # publisher / developer
+    for dev_row in found["dev_row"]:
+        subtitle = _find(dev_row, "subtitle column")
+        if subtitle is None:
+            continue
+        row_type = _text(subtitle).strip()
+        names = list({_text(x).strip() for x in dev_row.iterdescendants("a")})
+        if row_type == "Developer:":
+            page_data["developers"] = names
+        elif row_type == "Publisher:":
+            page_data["publishers"] = names
+
+    # release date
+    if found["release_date"]:
+        release_date = found["release_date"][0]
+        page_data["release_date"] = _text(_find(release_date, "date")).strip()
+
+    # popular tags
+    page_data["tags"] = list({_text(x).strip() for x in found["app_tag"]})
+
+    # price
+    # NOTE omitting bundles and sales to keep things a bit simpler
+    for purchase_action in found["game_purchase_action_bg"]:
+        price = _find(purchase_action, "discount_original_price")
+        if price is None:
+            price = _find(purchase_action, "game_purchase_price price")
+        if price is not None:
+            price = _text(price).strip()
+            if price == "Free To Play":
+                page_data["price"] = 0
+            else:
+                match_ = PRICE_PATTERN.search(price)
+                if match_ is None:
+                    continue
+                page_data["price"] = float(match_.groups()[0])
+            break
+
+    # features
+    page_data["features"] = list({
+        _text(x).strip()
+        for x in found["game_area_details_specs_ctn"]
+        if x.tag == "a"
+    })
+
+    # long description
+    if found["game_area_description"]:
+        description = found["game_area_description"][0]
+        page_data["description"] = _text(description).strip()
+
+    return page_data
@@ -0,0 +1,209 @@
+"""
+Deterministic synthetic Steam data for the benchmarks.
+
+Writes applist.json, gamedetails.json and newsitems.json shaped like the ones
+get_raw_data.py and scrape_game_pages.py produce, and store pages that
+parse_html turns back into exactly the gamedetails records. Every app's data
+comes from its own random generator seeded with (seed, appid), so the same
+arguments always give the same files, and the store page written for an app
+matches its gamedetails record however many pages are written.
+
+Records are written as they are generated, so memory stays flat up to the
+1M app scale; the news bodies make up most of the size, which
+`contents_words` controls.
+
+    python synthetic_data.py OUT_DIR [--apps 10000] [--news-per-app 5] [--store-pages 1000]
+"""
+
+import argparse
+import html
+import json
+import os
+import random
+import sys
+from typing import Any, Dict, List, Tuple
+
+TAGS = ["Indie", "Action", "RPG", "Puzzle", "Strategy", "Casual", "Simulation", "+"]
+FEATURES = ["Single-player", "Multi-player", "Steam Achievements", "Co-op", "Steam Cloud"]
+AUTHORS = ["", "dev", "community manager"]
+DATA_FILES = ("applist.json", "gamedetails.json", "newsitems.json")
+
+def app_rng(seed: int, appid: int) -> random.Random:
+    return random.Random(f"{seed}:{appid}")
+
+def app_record(appid: int) -> Dict[str, Any]:
+    return {"appid": appid, "name": f"Game {appid}"}
+
+def game_record(rng: random.Random, appid: int, apps: int) -> Dict[str, Any]:
+    """
+    A gamedetails.json record, with every field parse_html can extract.
+    """
+    game = {
+        "appid": appid,
+        "all_positive_review_pct": rng.randint(0, 100),
+        "total_num_reviews": rng.randint(10, 200000),
+        "recent_positive_review_pct": rng.randint(0, 100),
+        "recent_num_reviews": rng.randint(10, 2000),
+        "description_snippet": f"A game about {' and '.join(rng.sample(TAGS[:-1], 2)).lower()}.",
+        "developers": [f"Developer {rng.randrange(apps // 10 + 1)}"],
+        "publishers": [f"Publisher {rng.randrange(apps // 20 + 1)}"],
+        "release_date": f"Aug {rng.randint(1, 28)}, {rng.randint(2005, 2023)}",
+        "tags": rng.sample(TAGS, 3),
+        "features": rng.sample(FEATURES, 2),
+        "description": " ".join(["lorem ipsum"] * rng.randint(10, 100)),
+    }
+    # every tenth game is free
+    if rng.random() < 0.1:
+        game["price"] = 0
+    else:
+        game["price"] = round(rng.uniform(0.99, 59.99), 2)
+    return game
+
+def news_records(
+    rng: random.Random,
+    appid: int,
+    first_gid: int,
+    count: int,
+    contents_words: Tuple[int, int],
+) -> List[Dict[str, Any]]:
+    return [
+        {
+            "gid": str(gid),
+            "title": f"Update {gid}",
+            "url": f"https://store.steampowered.com/news/{gid}",
+            "is_external_url": False,
+            "author": rng.choice(AUTHORS),
+            "contents": "patch notes " * rng.randint(*contents_words),
+            "feedlabel": "Community Announcements",
+            "date": 1600000000 + gid,
+            "feedname": "steam_community_announcements",
+            "feed_type": 1,
+            "appid": appid,
+            "tags": ["patchnotes"],
+        }
+        for gid in range(first_gid, first_gid + count)
+    ]
+
+def store_page(game: Dict[str, Any], name: str, padding: int = 200) -> str:
+    """
+    A store page for `game` that parse_html extracts `game` from again.
+    `padding` blocks of unrelated markup stand in for the navigation, media
+    and scripts that make up most of a real page.
+    """
+    e = html.escape
+    filler = "".join(
+        f'<div class="block responsive_apppage_details_left"><a href="/curator/{i}">'
+        f"Curator {i}</a><p>Recommended by {i} curators</p></div>"
+        for i in range(padding)
+    )
+    if game["price"] == 0:
+        price = "Free To Play"
+    else:
+        price = f"${game['price']:.2f}"
+    return "".join([
+        f"<html><head><title>{e(name)} on Steam</title>",
+        f"<script>var g_rgAppInfo = {{\"{game['appid']}\": {{\"pkgs\": []}}}};</script>",
+        "</head><body>",
+        filler,
+        f'<div class="game_description_snippet">\n\t{e(game["description_snippet"])}\n</div>',
+        '<div class="user_reviews">',
+        '<span class="responsive_reviewdesc_short">'
+        f'({game["recent_positive_review_pct"]}% of {game["recent_num_reviews"]:,})'
+        "<span>Recent</span></span>",
+        '<span class="responsive_reviewdesc_short">'
+        f'({game["all_positive_review_pct"]}% of {game["total_num_reviews"]:,})'
+        "<span>All Time</span></span>",
+        "</div>",
+        '<div class="release_date"><div class="subtitle column">Release Date:</div>',
+        f'<div class="date">{e(game["release_date"])}</div></div>',
+        '<div class="dev_row"><div class="subtitle column">Developer:</div>',
+        "".join(f'<a href="/developer/{e(x)}">{e(x)}</a>' for x in game["developers"]),
+        "</div>",
+        '<div class="dev_row"><div class="subtitle column">Publisher:</div>',
+        "".join(f'<a href="/publisher/{e(x)}">{e(x)}</a>' for x in game["publishers"]),
+        "</div>",
+        '<div class="glance_tags popular_tags">',
+        "".join(f'<a class="app_tag" href="/tags/{e(x)}">\n\t\t{e(x)}\t\t</a>' for x in game["tags"]),
+        "</div>",
+        '<div class="game_area_purchase_game"><div class="game_purchase_action">',
+        f'<div class="game_purchase_action_bg"><div class="game_purchase_price price">\n\t{price}\n</div></div>',
+        "</div></div>",
+        '<div class="game_area_features_list_ctn">',
+        "".join(
+            '<a class="game_area_details_specs_ctn" href="/search/?category2=2">'
+            f'<div class="icon"><img src="/ico.png"></div><div class="label">{e(x)}</div></a>'
+            for x in game["features"]
+        ),
+        "</div>",
+        f'<div id="game_area_description" class="game_area_description">\n{e(game["description"])}\n</div>',
+        "<script>GStoreItemData.AddNavParams({});</script>",
+        "</body></html>",
+    ])
+
+def write_dataset(
+    data_dir: str,
+    apps: int,
+    news_per_app: int,
+    seed: int = 0,
+    contents_words: Tuple[int, int] = (50, 500),
+) -> int:
+    """
+    Write synthetic data files for `apps` apps, one record at a time. Each
+    news body repeats a phrase between `contents_words` times. Returns the
+    total size of the files in bytes.
+    """
+    with open(os.path.join(data_dir, "applist.json"), "w") as applist, \
+            open(os.path.join(data_dir, "gamedetails.json"), "w") as gamedetails, \
+            open(os.path.join(data_dir, "newsitems.json"), "w") as newsitems:
+        for f in (applist, gamedetails, newsitems):
+            f.write("[")
+        for appid in range(apps):
+            rng = app_rng(seed, appid)
+            sep = ", " if appid else ""
+            applist.write(sep + json.dumps(app_record(appid)))
+            gamedetails.write(sep + json.dumps(game_record(rng, appid, apps)))
+            items = news_records(rng, appid, appid * news_per_app + 1, news_per_app, contents_words)
+            newsitems.write(sep + json.dumps(items))
+        for f in (applist, gamedetails, newsitems):
+            f.write("]")
+    return sum(os.path.getsize(os.path.join(data_dir, name)) for name in DATA_FILES)
+
+def write_store_pages(out_dir: str, apps: int, pages: int, seed: int = 0) -> None:
+    """
+    Write {appid}.html store pages for the first `pages` apps of the dataset
+    write_dataset(..., apps, seed=seed) writes.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    for appid in range(min(apps, pages)):
+        game = game_record(app_rng(seed, appid), appid, apps)
+        with open(os.path.join(out_dir, f"{appid}.html"), "w", encoding="utf-8") as f:
+            f.write(store_page(game, app_record(appid)["name"]))
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("out_dir")
+    parser.add_argument("--apps", type=int, default=10000)
+    parser.add_argument("--news-per-app", type=int, default=5)
+    parser.add_argument("--contents-words", type=int, nargs=2, default=[50, 500])
+    parser.add_argument(
+        "--store-pages",
+        type=int,
+        default=0,
+        help="also write this many store pages to OUT_DIR/store_pages",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    size = write_dataset(
+        args.out_dir, args.apps, args.news_per_app, args.seed, tuple(args.contents_words),
+    )
+    print(f"wrote {size / 2**20:.1f} MB of data files to {args.out_dir}")
+    if args.store_pages:
+        write_store_pages(
+            os.path.join(args.out_dir, "store_pages"), args.apps, args.store_pages, args.seed,
+        )
+        print(f"wrote {min(args.apps, args.store_pages)} store pages")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
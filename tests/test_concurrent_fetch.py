@@ -0,0 +1,101 @@
+import json
+import random
+import threading
+import time
+
+import pytest
+
+from concurrent_fetch import fetch_json
+import get_raw_data
+from http_client import PermanentError, RetriesExceeded
+from get_raw_data import get_news
+from raw_store import RawStore
+
+class FakeClient:
+    """
+    Answers get_json after a random delay, so requests finish out of order.
+    """
+    def __init__(self, fail_on=(), errors=None):
+        self.fail_on = set(fail_on)
+        self.errors = errors or {}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1):
+        pass
+
+    def get_json(self, url, params):
+        appid = params.get("appid", params.get("gameid"))
+        with self._lock:
+            self.calls.append(appid)
+        time.sleep(random.uniform(0, 0.005))
+        if appid in self.errors:
+            raise self.errors[appid]
+        if appid in self.fail_on:
+            raise RuntimeError(f"worker failed on {appid}")
+        return {"appnews": {"appid": appid, "newsitems": [
+            {"gid": str(appid), "date": appid, "title": f"news for {appid}"},
+        ]}}
+
+def test_results_come_back_in_job_order():
+    jobs = [(idx, {"appid": 100 + idx}) for idx in range(200)]
+    results = list(fetch_json("http://api/news", jobs, concurrency=8, client=FakeClient()))
+    assert [key for key, _ in results] == list(range(200))
+    assert [value["appnews"]["appid"] for _, value in results] == [100 + idx for idx in range(200)]
+
+def test_jobs_are_consumed_lazily():
+    client = FakeClient()
+    jobs = ((idx, {"appid": idx}) for idx in range(10**9))
+    results = fetch_json("http://api/news", jobs, concurrency=4, client=client)
+    first = [next(results) for _ in range(5)]
+    assert [key for key, _ in first] == list(range(5))
+    # no more than the window of 2 * concurrency was ever submitted
+    assert len(client.calls) <= 5 + 2 * 4
+    results.close()
+
+def test_a_failing_worker_stops_at_its_place_in_order():
+    jobs = [(idx, {"appid": idx}) for idx in range(50)]
+    results = fetch_json("http://api/news", jobs, concurrency=8, client=FakeClient(fail_on={20}))
+    seen = []
+    with pytest.raises(RuntimeError, match="worker failed on 20"):
+        for key, _ in results:
+            seen.append(key)
+    assert seen == list(range(20))
+
+def test_apps_that_fail_for_good_are_skipped_or_empty():
+    errors = {
+        3: PermanentError("HTTP 403", 403),
+        5: PermanentError("not JSON"),
+        7: RetriesExceeded("gave up"),
+    }
+    jobs = [(idx, {"appid": idx}) for idx in range(10)]
+    results = list(fetch_json("http://api/news", jobs, concurrency=2, client=FakeClient(errors=errors)))
+    # a client error is an answer, just without data; the others are left
+    # for the next run
+    assert [key for key, _ in results] == [0, 1, 2, 3, 4, 6, 8, 9]
+    assert dict(results)[3] == {}
+
+def test_get_news_keeps_partial_progress_and_resumes(tmp_path, monkeypatch):
+    monkeypatch.setattr(get_raw_data, "DATA_DIR", str(tmp_path))
+    applist = [{"appid": 1000 + idx, "name": f"app {idx}"} for idx in range(300)]
+    store_fh = str(tmp_path / "raw.sqlite")
+
+    monkeypatch.setattr(get_raw_data, "CLIENT", FakeClient(fail_on={1250}))
+    with pytest.raises(RuntimeError):
+        with RawStore(store_fh) as store:
+            get_news(store, applist)
+    # everything before the failure was committed, even past the last
+    # periodic commit
+    with RawStore(store_fh) as store:
+        assert set(range(1000, 1250)) <= store.fetched_appids("news")
+    assert not (tmp_path / "newsitems.json").exists()
+
+    client = FakeClient()
+    monkeypatch.setattr(get_raw_data, "CLIENT", client)
+    with RawStore(store_fh) as store:
+        get_news(store, applist)
+    # only what was missing is fetched again
+    assert 1249 not in client.calls and 1250 in client.calls
+    with open(tmp_path / "newsitems.json", "r") as f:
+        exported = json.loads(f.read())
+    assert [items[0]["gid"] for items in exported] == [str(app["appid"]) for app in applist]
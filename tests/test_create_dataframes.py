@@ -0,0 +1,16 @@
+import pandas as pd
+
+from create_dataframes import CsvWriter
+
+def test_csv_writer_leaves_out_new_columns(tmp_path, capsys):
+    fh = str(tmp_path / "newsitems.csv")
+    out = CsvWriter(fh, ["gid", "title"])
+    out.add_frame(pd.DataFrame({"gid": ["1"], "title": ["a"]}))
+    out.add_frame(pd.DataFrame({"gid": ["2"], "title": ["b"], "new_field": [1]}))
+    out.add_frame(pd.DataFrame({"gid": ["3"], "new_field": [2]}))
+    out.flush()
+    assert capsys.readouterr().out.count("new_field") == 1
+    df = pd.read_csv(fh, index_col=0, dtype=str)
+    assert list(df.columns) == ["gid", "title"]
+    assert df["gid"].tolist() == ["1", "2", "3"]
+    assert df.index.tolist() == [0, 1, 2]
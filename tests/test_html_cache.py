@@ -0,0 +1,18 @@
+import html_cache
+from html_cache import HtmlCache, read_blob
+
+def test_read_blob_remaps_a_grown_pack_and_closes_the_old_map(tmp_path):
+    with HtmlCache(str(tmp_path)) as cache:
+        cache.put(1, "<html>first</html>")
+        ((_, _, offset, length, codec),) = list(cache.latest())
+        assert read_blob(cache.pack_fh, offset, length, codec) == "<html>first</html>"
+        old = html_cache._views[cache.pack_fh]
+
+        cache.put(2, "<html>second</html>")
+        entries = {appid: entry for appid, *entry in cache.latest()}
+        _, offset, length, codec = entries[2]
+        assert read_blob(cache.pack_fh, offset, length, codec) == "<html>second</html>"
+        assert old.closed
+        new = html_cache._views.pop(cache.pack_fh)
+        assert new is not old
+        new.close()
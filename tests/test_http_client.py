@@ -0,0 +1,165 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from http_client import CircuitBreaker, PermanentError, RetriesExceeded, SteamClient, TokenBucket
+
+def open_breaker(reset_timeout=0.05):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=reset_timeout)
+    assert not breaker.on_failure()
+    assert breaker.on_failure()
+    assert breaker.state == "open"
+    return breaker
+
+def test_breaker_opens_after_the_threshold():
+    breaker = CircuitBreaker(failure_threshold=3)
+    breaker.on_failure()
+    breaker.on_failure()
+    # a success in between starts the count over
+    breaker.on_success()
+    breaker.on_failure()
+    breaker.on_failure()
+    assert breaker.state == "closed"
+    assert breaker.on_failure()
+    assert breaker.state == "open"
+
+def test_stale_results_dont_move_an_open_breaker():
+    breaker = open_breaker()
+    # requests let through before it opened, finishing late
+    breaker.on_success()
+    assert breaker.state == "open"
+    opened_at = breaker.opened_at
+    assert not breaker.on_failure()
+    assert breaker.opened_at == opened_at
+
+def test_only_the_trial_closes_a_half_open_breaker():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    waited, trial = breaker.wait()
+    assert trial and breaker.state == "half_open"
+    breaker.on_success()
+    assert breaker.state == "half_open"
+    breaker.on_success(trial)
+    assert breaker.state == "closed"
+    assert breaker.wait() == (pytest.approx(0, abs=0.01), False)
+
+def test_a_failed_trial_reopens_the_breaker():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    waited, trial = breaker.wait()
+    assert waited == pytest.approx(0, abs=0.01)
+    assert breaker.on_failure(trial)
+    assert breaker.state == "open"
+
+def test_one_trial_at_a_time():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    _, trial = breaker.wait()
+    second = []
+    thread = threading.Thread(target=lambda: second.append(breaker.wait()))
+    thread.start()
+    thread.join(0.1)
+    # held back until the trial is decided
+    assert thread.is_alive()
+    breaker.on_success(trial)
+    thread.join(1)
+    assert second[0][1] is False
+
+def test_interrupted_trial_lets_the_next_caller_try():
+    client = SteamClient(backoff_base=0)
+    _, breaker = client.host("example.com")
+    breaker.failure_threshold = 1
+    breaker.reset_timeout = 0.0
+    breaker.on_failure()
+
+    def interrupted():
+        raise KeyboardInterrupt
+    with pytest.raises(KeyboardInterrupt):
+        client.call("example.com", interrupted)
+    # the breaker neither closed on it nor kept the trial slot
+    assert breaker.state == "half_open" and not breaker.trial_in_flight
+    assert client.call("example.com", lambda: "ok") == "ok"
+    assert breaker.state == "closed"
+
+def test_call_retries_then_gives_up():
+    client = SteamClient(max_retries=2, backoff_base=0)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError("reset")
+        return "ok"
+    assert client.call("example.com", flaky, retry_on=(ConnectionError,)) == "ok"
+    assert client.stats["retries"] == 2
+
+    def down():
+        raise ConnectionError("refused")
+    with pytest.raises(RetriesExceeded):
+        client.call("example.com", down, retry_on=(ConnectionError,))
+
+def test_non_retryable_errors_count_as_an_answer():
+    client = SteamClient(backoff_base=0)
+    _, breaker = client.host("example.com")
+    breaker.failures = 5
+
+    def broken():
+        raise ValueError("bad json")
+    with pytest.raises(ValueError):
+        client.call("example.com", broken, retry_on=(ConnectionError,))
+    assert breaker.failures == 0
+
+def test_bucket_paces_requests():
+    bucket = TokenBucket(initial_rate=20.0, max_rate=20.0)
+    start = time.monotonic()
+    waits = [bucket.acquire() for _ in range(21)]
+    # a second's worth is banked at most; the rest come 1/rate apart
+    assert time.monotonic() - start >= 0.9
+    assert sum(waits) == pytest.approx(time.monotonic() - start, abs=0.1)
+
+def test_bucket_backs_off_once_per_burst_of_throttling():
+    bucket = TokenBucket(initial_rate=8.0, max_rate=10.0, increase=1.0)
+    bucket.on_throttled(None)
+    bucket.on_throttled(None)
+    assert bucket.rate == 4.0
+    bucket.on_success()
+    assert bucket.rate == 5.0
+    for _ in range(10):
+        bucket.on_success()
+    assert bucket.rate == 10.0
+
+def test_bucket_waits_out_retry_after():
+    bucket = TokenBucket(initial_rate=100.0, max_rate=100.0)
+    bucket.on_throttled(0.2)
+    assert bucket.acquire() >= 0.19
+
+class FakeSession:
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+        self.calls = 0
+
+    def get(self, url, params=None, **kwargs):
+        self.calls += 1
+        response = requests.Response()
+        response.status_code = self.status
+        response._content = self.body
+        response.url = url
+        return response
+
+@pytest.mark.parametrize("status, body, match", [
+    (403, b"<html>Forbidden</html>", "HTTP 403"),
+    (200, b"<html>Service Unavailable</html>", "didn't return JSON"),
+])
+def test_get_json_doesnt_retry_permanent_errors(status, body, match):
+    client = SteamClient(backoff_base=0)
+    client.session = FakeSession(status, body)
+    with pytest.raises(PermanentError, match=match) as e:
+        client.get_json("http://example.com/api", {"appid": 1})
+    assert e.value.status == (status if status >= 400 else None)
+    assert client.session.calls == 1
+    assert client.stats["retries"] == 0
+    # the host answered, so the breaker isn't moved towards opening
+    assert client.host("example.com")[1].failures == 0
@@ -0,0 +1,97 @@
+import json
+
+from jsonl_log import JsonlLog
+import scrape_game_pages
+
+def write_log(path, records):
+    with JsonlLog(str(path)) as log:
+        for record in records:
+            log.append(record)
+    return JsonlLog(str(path))
+
+def read_json(path):
+    with open(path, "r") as f:
+        return json.loads(f.read())
+
+def test_append_and_iterate(tmp_path):
+    log = write_log(tmp_path / "log.jsonl", [{"appid": 1}, {"appid": 2, "name": "b"}])
+    assert list(log) == [{"appid": 1}, {"appid": 2, "name": "b"}]
+    assert log.keys("appid") == {1, 2}
+
+def test_missing_log_is_empty(tmp_path):
+    log = JsonlLog(str(tmp_path / "log.jsonl"))
+    assert list(log) == []
+    assert log.keys() == set()
+    assert log.compact(str(tmp_path / "out.json")) == 0
+    assert read_json(tmp_path / "out.json") == []
+
+def test_partial_line_is_dropped_on_append(tmp_path):
+    path = tmp_path / "log.jsonl"
+    write_log(path, [{"appid": 1}, {"appid": 2}])
+    # a crash in the middle of writing the third record
+    with open(path, "a") as f:
+        f.write('{"appid": 3, "na')
+    log = JsonlLog(str(path))
+    assert log.keys() == {1, 2}
+    with log:
+        log.append({"appid": 4})
+    assert list(JsonlLog(str(path))) == [{"appid": 1}, {"appid": 2}, {"appid": 4}]
+
+def test_compact_keeps_the_last_record_per_key(tmp_path):
+    log = write_log(tmp_path / "log.jsonl", [
+        {"appid": 1, "v": 1},
+        {"appid": 2, "v": 1},
+        {"appid": 1, "v": 2},
+    ])
+    assert log.compact(str(tmp_path / "out.json")) == 2
+    assert read_json(tmp_path / "out.json") == [{"appid": 2, "v": 1}, {"appid": 1, "v": 2}]
+
+def test_compact_keep_and_order(tmp_path):
+    log = write_log(tmp_path / "log.jsonl", [
+        {"appid": 3},
+        {"appid": 1},
+        {"appid": 2, "skipped": True},
+        {"appid": 4},
+    ])
+    count = log.compact(
+        str(tmp_path / "out.json"),
+        keep=lambda record: not record.get("skipped", False),
+        order=[1, 2, 3, 5],
+    )
+    assert count == 3
+    # keys missing from `order` follow in log order
+    assert read_json(tmp_path / "out.json") == [{"appid": 1}, {"appid": 3}, {"appid": 4}]
+
+def test_compact_skips_records_without_the_key(tmp_path, capsys):
+    log = write_log(tmp_path / "log.jsonl", [{"appid": 1}, {"name": "no appid"}])
+    assert log.compact(str(tmp_path / "out.json")) == 1
+    assert read_json(tmp_path / "out.json") == [{"appid": 1}]
+    assert "dropping 1 records without 'appid'" in capsys.readouterr().out
+
+def test_keys_reads_the_key_field_or_falls_back_to_the_whole_record(tmp_path):
+    path = tmp_path / "log.jsonl"
+    write_log(path, [
+        {"appid": 1, "description": 'has "appid": 9, inside'},
+        {"name": "key not first", "appid": 2},
+        {"appid": "3\"x", "skipped": True},
+        {"appid": -4},
+        {"other": 5},
+    ])
+    # cut short after the key, but without its newline
+    with open(path, "a") as f:
+        f.write('{"appid": 6, "description": "lo')
+    assert JsonlLog(str(path)).keys() == {1, 2, '3"x', -4}
+    assert JsonlLog(str(path)).keys("other") == {5}
+
+def test_migrate_legacy_checkpoint_keeps_skipped_apps(tmp_path, monkeypatch):
+    legacy = tmp_path / "gamedetails_chkpt.json"
+    legacy.write_text(json.dumps({"gamedetails": [{"appid": 10}, {"appid": 30}], "idx": 4}))
+    monkeypatch.setattr(scrape_game_pages, "legacy_checkpoint_fh", str(legacy))
+    applist = [{"appid": 10}, {"appid": 20}, {"name": "no appid"}, {"appid": 30}, {"appid": 40}]
+    log = JsonlLog(str(tmp_path / "log.jsonl"))
+    with log:
+        scrape_game_pages.migrate_legacy_checkpoint(log, applist)
+    assert not legacy.exists()
+    # 20 resolved to the home page; 40 hadn't been reached yet
+    assert list(log) == [{"appid": 10}, {"appid": 30}, {"appid": 20, "skipped": True}]
+    assert log.keys() == {10, 20, 30}
@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+
+import pytest
+
+import pipeline
+from pipeline import (
+    dependencies,
+    FileHashes,
+    fingerprint,
+    local_modules,
+    Stage,
+    stage_args,
+    up_to_date,
+    watched_hashes,
+)
+
+@pytest.fixture
+def dirs(tmp_path, monkeypatch):
+    src_dir = tmp_path / "src"
+    data_dir = tmp_path / "data"
+    src_dir.mkdir()
+    data_dir.mkdir()
+    monkeypatch.setattr(pipeline, "SRC_DIR", str(src_dir))
+    monkeypatch.setattr(pipeline, "DATA_DIR", str(data_dir))
+    (src_dir / "stage.py").write_text("import json\nfrom helpers import f\n")
+    (src_dir / "helpers.py").write_text("import other\ndef f(): pass\n")
+    (src_dir / "other.py").write_text("X = 1\n")
+    (src_dir / "unrelated.py").write_text("Y = 1\n")
+    (data_dir / "in.json").write_text("[1]")
+    return src_dir, data_dir
+
+STAGE = Stage("stage.py", ("--flag",), ("in.json",), ("out.json",))
+
+def test_local_modules_follow_imports(dirs):
+    assert local_modules("stage.py") == ["helpers.py", "other.py", "stage.py"]
+
+def test_dependencies():
+    stages = {
+        "a": Stage("a.py", (), (), ("a.json",)),
+        "b": Stage("b.py", (), ("a.json", "raw.json"), ("b.json",)),
+        "c": Stage("c.py", (), ("a.json", "b.json"), ()),
+    }
+    assert dependencies(stages) == {"a": set(), "b": {"a"}, "c": {"a", "b"}}
+
+def test_fingerprint_changes_with_code_inputs_and_args(dirs):
+    src_dir, data_dir = dirs
+    before = fingerprint(STAGE, FileHashes())
+    assert fingerprint(STAGE, FileHashes()) == before
+
+    (src_dir / "unrelated.py").write_text("Y = 2\n")
+    assert fingerprint(STAGE, FileHashes()) == before
+
+    (src_dir / "other.py").write_text("X = 2\n")
+    after_code = fingerprint(STAGE, FileHashes())
+    assert after_code != before
+
+    (data_dir / "in.json").write_text("[2]")
+    after_input = fingerprint(STAGE, FileHashes())
+    assert after_input != after_code
+
+    assert fingerprint(STAGE._replace(args=()), FileHashes()) != after_input
+
+def test_fingerprint_covers_only_the_stages_settings(dirs, monkeypatch):
+    stage = STAGE._replace(settings=("STEAM_TEST_SETTING",))
+    monkeypatch.setenv("STEAM_TEST_SETTING", "a")
+    before = fingerprint(stage, FileHashes())
+    plain = fingerprint(STAGE, FileHashes())
+    monkeypatch.setenv("STEAM_TEST_SETTING", "b")
+    assert fingerprint(stage, FileHashes()) != before
+    assert fingerprint(STAGE, FileHashes()) == plain
+
+def test_file_hashes_are_remembered_until_the_file_changes(dirs):
+    _, data_dir = dirs
+    fh = str(data_dir / "in.json")
+    file_hash = FileHashes()
+    first = file_hash(fh)
+    assert file_hash.known[fh][2] == first
+    # a stale entry with the same size and mtime is trusted
+    file_hash.known[fh][2] = "cached"
+    assert file_hash(fh) == "cached"
+    (data_dir / "in.json").write_text("[1, 2]")
+    assert file_hash(fh) not in ("cached", first)
+    assert file_hash(str(data_dir / "missing.json")) is None
+
+def test_up_to_date(dirs):
+    _, data_dir = dirs
+    file_hash = FileHashes()
+    assert not up_to_date(STAGE, None, file_hash)
+    (data_dir / "out.json").write_text("[]")
+    record = {
+        "fingerprint": fingerprint(STAGE, file_hash),
+        "outputs": pipeline.output_hashes(STAGE, file_hash),
+    }
+    assert up_to_date(STAGE, record, file_hash)
+
+    # an output changed or removed since, has to be written again
+    (data_dir / "out.json").write_text("[0]")
+    assert not up_to_date(STAGE, record, FileHashes())
+    os.remove(data_dir / "out.json")
+    assert not up_to_date(STAGE, record, FileHashes())
+
+def test_when_changed_args_follow_the_watched_modules(dirs):
+    src_dir, _ = dirs
+    stage = STAGE._replace(when_changed=(("--reparse", ("helpers.py",)),))
+    # never ran, so there is no telling what the old output was parsed with
+    assert stage_args(stage, None, FileHashes()) == ("--flag", "--reparse")
+    record = {"watched": watched_hashes(stage, FileHashes())}
+    assert sorted(record["watched"]) == ["helpers.py", "other.py"]
+    assert stage_args(stage, record, FileHashes()) == ("--flag",)
+
+    (src_dir / "stage.py").write_text("import json\nfrom helpers import f\nZ = 1\n")
+    assert stage_args(stage, record, FileHashes()) == ("--flag",)
+    (src_dir / "other.py").write_text("X = 2\n")
+    assert stage_args(stage, record, FileHashes()) == ("--flag", "--reparse")
+
+def test_exclusive_stages_run_one_at_a_time(dirs, monkeypatch):
+    _, data_dir = dirs
+    monkeypatch.setattr(pipeline, "STATE_FH", str(data_dir / "pipeline_state.json"))
+    monkeypatch.setattr(pipeline, "LOG_DIR", str(data_dir / "logs"))
+    monkeypatch.setattr(pipeline, "STAGES", {
+        "a": Stage("stage.py", ("a",), (), ("a.json",), exclusive=("host",)),
+        "b": Stage("stage.py", ("b",), (), ("b.json",), exclusive=("host",)),
+        "c": Stage("stage.py", ("c",), (), ("c.json",)),
+    })
+    lock = threading.Lock()
+    running = set()
+    overlaps = []
+
+    def run_stage(name, stage, args):
+        with lock:
+            running.add(name)
+            overlaps.append(set(running))
+        time.sleep(0.05)
+        (data_dir / f"{name}.json").write_text("[]")
+        with lock:
+            running.discard(name)
+        return 0.05
+    monkeypatch.setattr(pipeline, "run_stage", run_stage)
+    pipeline.run(["a", "b", "c"], set(), jobs=3)
+    assert not any({"a", "b"} <= seen for seen in overlaps)
+    # the stage that shares nothing still runs alongside
+    assert any("c" in seen and len(seen) > 1 for seen in overlaps)
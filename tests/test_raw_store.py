@@ -0,0 +1,125 @@
+import json
+
+import pytest
+
+import metrics
+import refresh_news
+from raw_store import newest, RawStore
+from refresh_news import append_export, seed_high_water_marks
+
+@pytest.fixture
+def store(tmp_path):
+    with RawStore(str(tmp_path / "raw.sqlite")) as store:
+        yield store
+
+def item(gid, date):
+    return {"gid": str(gid), "date": date, "title": f"news {gid}"}
+
+def test_newest():
+    assert newest([]) is None
+    assert newest([item(1, 100), item(3, 300), item(2, 200)]) == (300, "3")
+
+def test_fetched_appids_include_empty_responses(store):
+    store.put("news", 10, 0, [item(1, 100)])
+    store.put("news", 20, 1, None)
+    store.put("achievements", 30, 2, [])
+    assert store.fetched_appids("news") == {10, 20}
+    assert store.get("news", 20) is None
+
+def test_export_json_skips_empty_responses(store, tmp_path):
+    store.put("news", 20, 1, [item(2, 200)])
+    store.put("news", 10, 0, [item(1, 100)])
+    store.put("news", 30, 2, None)
+    fh = tmp_path / "newsitems.json"
+    assert store.export_json("news", str(fh)) == 2
+    with open(fh, "r") as f:
+        assert json.loads(f.read()) == [[item(1, 100)], [item(2, 200)]]
+
+def test_close_commits(tmp_path):
+    fh = str(tmp_path / "raw.sqlite")
+    with RawStore(fh, commit_every=1000) as store:
+        store.put("news", 10, 0, [item(1, 100)])
+    with RawStore(fh) as store:
+        assert store.fetched_appids("news") == {10}
+
+def test_high_water_marks(store):
+    assert store.high_water_marks("news") == {}
+    store.set_high_water_mark("news", 10, 100, "1")
+    store.set_high_water_mark("news", 10, 200, "2")
+    store.set_high_water_mark("other", 10, 300, "3")
+    assert store.high_water_marks("news") == {10: (200, "2")}
+
+def test_iter_unmarked(store):
+    store.put("news", 10, 0, [item(1, 100)])
+    store.put("news", 20, 1, [item(2, 200)])
+    store.put("news", 30, 2, None)
+    store.set_high_water_mark("news", 10, 100, "1")
+    assert list(store.iter_unmarked("news")) == [(20, [item(2, 200)])]
+
+def test_seed_high_water_marks(store):
+    store.put("news", 10, 0, [item(1, 100), item(2, 200)])
+    store.put("news", 20, 1, [])
+    store.put("news", 30, 2, [item(3, 300)])
+    store.set_high_water_mark("news", 30, 400, "4")
+    marks = seed_high_water_marks(store)
+    # an app with no news has nothing to mark; existing marks are kept
+    assert marks == {10: (200, "2"), 30: (400, "4")}
+
+def test_transaction_rolls_back_on_error(tmp_path):
+    fh = str(tmp_path / "raw.sqlite")
+    with RawStore(fh, commit_every=1) as store:
+        store.put("news", 10, 0, [item(1, 100)])
+        with pytest.raises(RuntimeError):
+            with store.transaction():
+                store.replace("news", 10, [item(2, 200), item(1, 100)])
+                store.set_high_water_mark("news", 10, 200, "2")
+                # visible inside the block, despite commit_every=1 not committing
+                assert store.high_water_marks("news") == {10: (200, "2")}
+                raise RuntimeError
+        assert store.high_water_marks("news") == {}
+    with RawStore(fh) as store:
+        assert store.get("news", 10) == [item(1, 100)]
+        assert store.high_water_marks("news") == {}
+
+class FakeClient:
+    def __init__(self, news):
+        self.news = news
+
+    def get_json(self, url, params):
+        items = [i for i in self.news[params["appid"]] if i["date"] <= params.get("enddate", 10**9)]
+        return {"appnews": {"newsitems": items[:params["count"]]}}
+
+    def summary(self):
+        return ""
+
+@pytest.fixture
+def no_metrics(monkeypatch):
+    # keep the metrics files out of the data directory
+    monkeypatch.setattr(metrics, "start", lambda stage: None)
+
+def test_refresh_keeps_marks_when_the_append_fails(tmp_path, monkeypatch, no_metrics):
+    fh = str(tmp_path / "raw.sqlite")
+    with RawStore(fh) as store:
+        store.put("news", 10, 0, [item(1, 100)])
+        store.set_high_water_mark("news", 10, 100, "1")
+    export = tmp_path / "newsitems.json"
+    export.write_text(json.dumps([[item(1, 100)]]))
+    monkeypatch.setattr(refresh_news, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(refresh_news, "RawStore", lambda: RawStore(fh))
+    monkeypatch.setattr(refresh_news, "SteamClient", lambda: FakeClient({10: [item(2, 200), item(1, 100)]}))
+
+    def fail(fh, lists):
+        raise OSError("disk full")
+    monkeypatch.setattr(refresh_news, "append_export", fail)
+    with pytest.raises(OSError):
+        refresh_news.main()
+    with RawStore(fh) as store:
+        assert store.high_water_marks("news") == {10: (100, "1")}
+        assert store.get("news", 10) == [item(1, 100)]
+
+    # the next run finds the same item again and exports it
+    monkeypatch.setattr(refresh_news, "append_export", append_export)
+    refresh_news.main()
+    with RawStore(fh) as store:
+        assert store.high_water_marks("news") == {10: (200, "2")}
+    assert json.loads(export.read_text()) == [[item(1, 100)], [item(2, 200)]]
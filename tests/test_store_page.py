@@ -0,0 +1,64 @@
+import random
+import re
+
+import pytest
+
+from benchmark_parse_page import normalize, parse_with_soup
+from store_page import parse_html
+from synthetic_data import game_record, store_page
+
+def synthetic_page(appid, **changes):
+    game = game_record(random.Random(appid), appid, 1000)
+    game.update(changes)
+    return store_page(game, f"Game {appid}", padding=5)
+
+def without_reviews(page):
+    return re.sub(r'<div class="user_reviews">.*?</div>', "", page)
+
+def discounted(page):
+    return re.sub(
+        r'<div class="game_purchase_price price">(.*?)</div>',
+        '<div class="discount_block"><div class="discount_pct">-50%</div>'
+        '<div class="discount_original_price">$39.98</div>'
+        '<div class="discount_final_price">$19.99</div></div>',
+        page,
+        flags=re.S,
+    )
+
+# what the store shows instead of the page for a mature game
+AGE_GATE = """<html><head><title>Site Error</title></head><body>
+<div class="agegate_birthday_desc">Please enter your birth date to continue:</div>
+<form id="agecheck_form"><select id="ageYear"><option>1990</option></select></form>
+<a class="btnv6_blue_hoverfade" href="#">View Page</a>
+</body></html>"""
+
+HOME_PAGE = """<html><body><div class="home_page_col_wrapper">
+<div class="app_tag">Featured</div></div></body></html>"""
+
+PAGES = {
+    **{f"synthetic_{appid}": synthetic_page(appid) for appid in range(10)},
+    "free": synthetic_page(10, price=0),
+    "no_reviews": without_reviews(synthetic_page(11)),
+    "discounted": discounted(synthetic_page(12)),
+    "several_developers": synthetic_page(13, developers=["A & B", "C"], publishers=["A & B"]),
+    "age_gate": AGE_GATE,
+    "home_page": HOME_PAGE,
+    "empty": "",
+}
+
+@pytest.mark.parametrize("name", PAGES)
+def test_parse_html_matches_parse_page(name):
+    page = PAGES[name]
+    assert normalize(parse_html(page, 20)) == normalize(parse_with_soup(page, 20))
+
+def test_edge_cases_parse_as_expected():
+    assert parse_html(PAGES["free"], 1)["price"] == 0
+    assert parse_html(PAGES["discounted"], 1)["price"] == 39.98
+    no_reviews = parse_html(PAGES["no_reviews"], 1)
+    assert "total_num_reviews" not in no_reviews and "recent_num_reviews" not in no_reviews
+    assert parse_html(PAGES["age_gate"], 1) == {"appid": 1, "tags": [], "features": []}
+    assert parse_html(PAGES["home_page"], 1) is None
+
+def test_synthetic_pages_round_trip():
+    game = game_record(random.Random(0), 5, 1000)
+    assert normalize(parse_html(store_page(game, "Game 5", padding=5), 5)) == normalize(game)